@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+# Compares the conversion of the `__last_update` values of a large feed
+# from local time to the UTC time in the feed, once with a datetime per
+# item (as pyatom formats it) and once in bulk with `LocalTimeConverter`.
+#
+#     python benchmarks/timestamps.py [number of items]
+
+import os
+import sys
+import time
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dateutil.tz
+
+from restfulOpenErpProxy import LocalTimeConverter
+
+
+def perItem(strings):
+    result = []
+    for s in strings:
+        tz = dateutil.tz.tzlocal()
+        utc = dateutil.tz.tzutc()
+        t = datetime.datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')
+        result.append(t.replace(tzinfo=tz).astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+    return result
+
+
+def bulk(strings):
+    return LocalTimeConverter().toRfc3339List(strings)
+
+
+def measure(f, strings, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        f(strings)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+    # items changed over the last few months
+    start = datetime.datetime(2013, 1, 1, 20, 41, 36, 123456)
+    strings = [(start - datetime.timedelta(seconds=397 * i)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        for i in range(count)]
+    assert perItem(strings) == bulk(strings)
+    old = measure(perItem, strings)
+    new = measure(bulk, strings)
+    print "%d timestamps, total time: %.3fs one by one, %.3fs in bulk (%.1fx)" % (count, old, new, old / new)
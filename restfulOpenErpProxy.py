@@ -19,22 +19,53 @@
 # can be built using one of the [docco](https://github.com/jashkenas/docco)
 # derivatives.
 
+import os
 import sys
+import time
+import signal
+import socket
+import optparse
+import threading
+import weakref
+import collections
+import subprocess
+import stat
+import shutil
+import atexit
+import tempfile
 import xmlrpclib
 import ConfigParser
 import datetime
 import dateutil.tz
 import inspect
+import json
+import base64
 import re
+import hashlib
+import heapq
+import math
+import random
+import zlib
+from cStringIO import StringIO
 from xml.sax.saxutils import escape as xmlescape
 
 from lxml import etree
 
-from twisted.web.server import Site, NOT_DONE_YET
+from twisted.web.server import Request, Site, NOT_DONE_YET
 from twisted.web.resource import ErrorPage, Resource
-from twisted.internet import reactor, task
-from twisted.python import log
+from twisted.internet import defer, error, reactor, task, tcp, threads
+try:
+    from twisted.internet.interfaces import IReactorSocket
+except ImportError:
+    # Twisted < 12.1 cannot adopt sockets; workers use SO_REUSEPORT then
+    IReactorSocket = None
+from twisted.python import failure, log
 from twisted.web.xmlrpc import Proxy
+from twisted.web.http_headers import Headers
+from twisted.web.client import Agent
+from twisted.internet.protocol import ClientCreator, Protocol
+from twisted.protocols.basic import FileSender
+from twisted.protocols.memcache import MemCacheProtocol
 
 import pyatom
 
@@ -61,11 +92,85 @@ def localTimeStringToUtcDatetime(s):
     """Helper function to take a string like "2013-01-01 20:41:36.12345"
     representing a local time and use the information about the local
     timezone to create a datetime object in UTC time."""
-    tz = dateutil.tz.tzlocal()
-    utc = dateutil.tz.tzutc()
-    t = datetime.datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')  # this time is in local tz
-    t_withtz = t.replace(tzinfo=tz)
-    return t_withtz.astimezone(utc)
+    return localTimes.toUtcDatetime(s)
+
+
+# Feeds contain a timestamp for every item, so converting them has to be
+# cheap.  `LocalTimeConverter` keeps the timezone objects, parses the
+# fixed-width format that OpenERP uses by slicing and remembers the UTC
+# offset of every local hour it has seen (offsets only change at full
+# hours).  `toRfc3339()` returns the UTC time as the string that ends up
+# in the feed without creating any datetime objects; pyatom formats the
+# `updated` values with `strftime()`, so the strings are wrapped in
+# `Rfc3339Time`, which formats to itself.
+
+class Rfc3339Time(str):
+    """A UTC time like "2013-01-01T19:41:36Z"."""
+
+    def strftime(self, format):
+        return str(self)
+
+
+class LocalTimeConverter(object):
+    def __init__(self, tz=None):
+        if tz is None:
+            tz = dateutil.tz.tzlocal()
+        self.tz = tz
+        self.utc = dateutil.tz.tzutc()
+        # local "YYYY-MM-DD HH" -> (UTC offset in seconds, UTC "YYYY-MM-DDTHH"
+        #  or None if the offset is not a multiple of an hour)
+        self.hours = {}
+
+    def __parse(self, s):
+        """Return the fields of the local time `s`."""
+        if len(s) == 26 and s[4] == '-' and s[10] == ' ' and s[19] == '.':
+            return (int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                int(s[20:26]))
+        t = datetime.datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')
+        return (t.year, t.month, t.day, t.hour, t.minute, t.second, t.microsecond)
+
+    def __getHour(self, key, year, month, day, hour):
+        try:
+            return self.hours[key]
+        except KeyError:
+            t = datetime.datetime(year, month, day, hour, tzinfo=self.tz)
+            offset = t.utcoffset()
+            offset = offset.days * 86400 + offset.seconds
+            if offset % 3600 == 0:
+                prefix = (t.replace(tzinfo=None) - datetime.timedelta(seconds=offset)).strftime("%Y-%m-%dT%H")
+            else:
+                prefix = None
+            self.hours[key] = (offset, prefix)
+            return offset, prefix
+
+    def toUtcDatetime(self, s):
+        """Return the local time `s` as a datetime in UTC."""
+        year, month, day, hour, minute, second, microsecond = self.__parse(s)
+        key = "%04d-%02d-%02d %02d" % (year, month, day, hour)
+        offset, prefix = self.__getHour(key, year, month, day, hour)
+        t = datetime.datetime(year, month, day, hour, minute, second, microsecond) - \
+            datetime.timedelta(seconds=offset)
+        return t.replace(tzinfo=self.utc)
+
+    def toRfc3339(self, s):
+        """Return the local time `s` in UTC as an `Rfc3339Time` (without
+        the fraction of the second)."""
+        if len(s) == 26 and s[4] == '-' and s[10] == ' ' and s[19] == '.':
+            key = s[:13]
+            try:
+                offset, prefix = self.hours[key]
+            except KeyError:
+                offset, prefix = self.__getHour(key, int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]))
+            if prefix is not None:
+                return Rfc3339Time(prefix + s[13:19] + "Z")
+        return Rfc3339Time(self.toUtcDatetime(s).strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+    def toRfc3339List(self, strings):
+        """Return `toRfc3339()` of all local times in `strings`."""
+        toRfc3339 = self.toRfc3339
+        return [toRfc3339(s) for s in strings]
+
+localTimes = LocalTimeConverter()
 
 
 def httpdate(dt):
@@ -74,6 +179,99 @@ def httpdate(dt):
     return dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
 
 
+# The contents of binary fields (images, attachments) are served as
+# resources of their own.  As they can be large, clients may ask for a
+# part of them with a `Range` header, and for the contents only if they
+# have changed with `If-None-Match`.  Only single byte ranges are
+# supported; for anything else the whole body is sent, which HTTP allows.
+
+BINARY_SIGNATURES = (("\x89PNG\r\n\x1a\n", "image/png"),
+                     ("\xff\xd8\xff", "image/jpeg"),
+                     ("GIF87a", "image/gif"),
+                     ("GIF89a", "image/gif"),
+                     ("%PDF-", "application/pdf"),
+                     ("PK\x03\x04", "application/zip"))
+
+
+def guessContentType(data):
+    """Return the content type of `data`, judging by its first bytes."""
+    for signature, contentType in BINARY_SIGNATURES:
+        if data.startswith(signature):
+            return contentType
+    return "application/octet-stream"
+
+
+def parseByteRange(header, size):
+    """Return the (first, last) positions of the bytes that the `Range`
+    header `header` asks for in a body of `size` bytes, None if the whole
+    body should be sent and (None, None) if the range cannot be satisfied."""
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[6:].strip()
+    if "," in spec or not "-" in spec:
+        return None
+    first, last = spec.split("-", 1)
+    try:
+        if not first:
+            # the last bytes of the body
+            length = int(last)
+            if length <= 0 or size == 0:
+                return (None, None)
+            return (max(size - length, 0), size - 1)
+        first = int(first)
+        if last:
+            last = int(last)
+        else:
+            last = size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        return (None, None)
+    if first > last:
+        return None
+    return (first, min(last, size - 1))
+
+
+def writeRanged(request, body, chunkSize=64 * 1024):
+    """Write `body`, or the part of it that the `Range` header asks for,
+    and finish `request`.  If the client already has the representation
+    with the `ETag` set for the response, answer 304 instead.  Large bodies
+    are streamed, so that they do not pile up in the transport's buffer."""
+    etag = request.responseHeaders.getRawHeaders("ETag")
+    etag = etag and etag[0] or None
+    request.setHeader("Accept-Ranges", "bytes")
+    ifNoneMatch = request.getHeader("If-None-Match")
+    if etag and ifNoneMatch and (ifNoneMatch.strip() == "*" or etag in [t.strip() for t in ifNoneMatch.split(",")]):
+        request.setResponseCode(304)
+        request.finish()
+        return
+    byteRange = parseByteRange(request.getHeader("Range"), len(body))
+    ifRange = request.getHeader("If-Range")
+    if byteRange and ifRange and ifRange != etag:
+        # the client has an outdated part, so it gets everything
+        byteRange = None
+    if byteRange == (None, None):
+        request.setResponseCode(416)
+        request.setHeader("Content-Range", "bytes */%d" % len(body))
+        request.finish()
+        return
+    elif byteRange:
+        first, last = byteRange
+        request.setResponseCode(206)
+        request.setHeader("Content-Range", "bytes %d-%d/%d" % (first, last, len(body)))
+        body = body[first:last + 1]
+    request.setHeader("Content-Length", str(len(body)))
+    if len(body) <= chunkSize or not hasattr(request, "registerProducer"):
+        request.write(body)
+        request.finish()
+        return
+    sender = FileSender()
+    sender.CHUNK_SIZE = chunkSize
+    d = sender.beginFileTransfer(StringIO(body), request)
+    # if the client goes away, there is nothing left to finish
+    d.addCallbacks(lambda _: request.finish(), lambda _: None)
+
+
 # `UnauthorizedPage` is a helper class to represent a 401 "Unauthorized"
 # HTTP response.  This response will be used when there is no user/password
 # Basic authentication information in the header.
@@ -88,12 +286,2093 @@ class UnauthorizedPage(ErrorPage):
         return r
 
 
-def quietProxy(url):
-    p = Proxy(url)
+def quietProxy(url, connectTimeout=30.0):
+    p = Proxy(url, connectTimeout=connectTimeout)
     p.queryFactory.noisy = False
     return p
 
 
+def withTimeout(d, timeout, exception, clock=reactor):
+    """Cancel `d` if it has not fired after `timeout` seconds and make it
+    fail with `exception` instead of `CancelledError` then."""
+    timedOut = []
+
+    def expire():
+        timedOut.append(True)
+        d.cancel()
+    timer = clock.callLater(timeout, expire)
+
+    def done(result):
+        if timer.active():
+            timer.cancel()
+        if timedOut and isinstance(result, failure.Failure) and result.check(defer.CancelledError):
+            return failure.Failure(exception)
+        return result
+    return d.addBoth(done)
+
+
+# We parse XML with parsers that drop all comments.  Since lxml parsers
+# must not be shared between threads, but we do not want to create a new
+# one for every document, there is one parser per thread.
+
+threadLocal = threading.local()
+
+
+def getXmlParser():
+    if not hasattr(threadLocal, "xmlParser"):
+        threadLocal.xmlParser = etree.XMLParser(remove_comments=True)
+    return threadLocal.xmlParser
+
+
+def getConfigValue(config, section, option, default, conv=str):
+    """Helper function to read an optional value from the configuration
+    file, falling back to `default` if it is not given there."""
+    if config is None:
+        return default
+    try:
+        return conv(config.get(section, option))
+    except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+        return default
+
+
+def configBool(value):
+    return value.lower() in ("1", "yes", "true", "on")
+
+
+# Backend
+# -------
+#
+# All XML-RPC calls to OpenERP go through an `OpenErpBackendPool`, which
+# distributes them among one or more `OpenErpBackend`s.  Each of these makes
+# sure that we do not send more concurrent calls than OpenERP can handle:
+# At most `max_calls` calls (and, optionally, `max_calls_per_db` calls per
+# database) are in progress at the same time, further calls wait in a
+# queue.  If the queue is full or a call has been waiting for longer than
+# `queue_timeout` seconds, we give up and answer with 503, so that clients
+# do not pile up requests that would time out anyway.  A call that has
+# not been answered after `call_timeout` seconds fails as well.
+#
+# Several OpenERP servers can be given in `url`.  A server that cannot be
+# reached is taken out of rotation for a while; calls that only read data
+# are then repeated on one of the others.  In the standalone server, each
+# server's `common.version` is probed every `health_interval` seconds, so
+# that a recovered server gets its share of the load again quickly.
+# Servers working on a read-only replica of the database can be given in
+# `read_urls`; they only receive calls that do not change anything.
+#
+# If most calls to a database on some server fail or are very slow, a
+# `CircuitBreaker` makes further calls fail immediately for a while, so
+# that requests do not pile up while OpenERP restarts.  The state of all
+# servers and circuit breakers can be seen at `/_health`.
+
+class Metrics(object):
+    """Keep counters and gauges (functions returning the current value)
+    and write them to the log now and then."""
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+
+    def increment(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def setGauge(self, name, f):
+        self.gauges[name] = f
+
+    def snapshot(self):
+        values = dict(self.counters)
+        for name, f in self.gauges.iteritems():
+            values[name] = f()
+        return values
+
+    def logValues(self):
+        values = self.snapshot()
+        log.msg("metrics: " + ", ".join(["%s=%s" % (k, values[k]) for k in sorted(values)]))
+
+metrics = Metrics()
+
+
+class CallLimiter(object):
+    """Limit the number of calls that are in progress at the same time
+    and keep a bounded queue of waiting calls."""
+    def __init__(self, name, maxCalls, maxQueue, queueTimeout, retryAfter, clock=reactor):
+        self.name = name
+        self.maxCalls = maxCalls
+        self.maxQueue = maxQueue
+        self.queueTimeout = queueTimeout
+        self.retryAfter = retryAfter
+        self.clock = clock
+        self.active = 0
+        self.waiting = collections.deque()
+        metrics.setGauge(name + ".active", lambda: self.active)
+        metrics.setGauge(name + ".queued", lambda: len(self.waiting))
+
+    def acquire(self):
+        if self.active < self.maxCalls:
+            self.active += 1
+            return defer.succeed(None)
+        elif len(self.waiting) >= self.maxQueue:
+            metrics.increment(self.name + ".shed")
+            return defer.fail(BackendOverloaded(self.retryAfter))
+        entry = []
+        d = defer.Deferred(lambda d: self.__dequeue(entry))
+        entry.extend([d, self.clock.callLater(self.queueTimeout, self.__timeout, entry)])
+        self.waiting.append(entry)
+        return d
+
+    def release(self):
+        if self.waiting:
+            # the slot is handed over to the next waiting call
+            d, timer = self.waiting.popleft()
+            timer.cancel()
+            d.callback(None)
+        else:
+            self.active -= 1
+
+    def run(self, f, *args):
+        """Call `f` as soon as a slot is free and return a Deferred
+        firing with its result."""
+        def call(_):
+            d = defer.maybeDeferred(f, *args)
+            d.addBoth(self.__releaseAndReturn)
+            return d
+        return self.acquire().addCallback(call)
+
+    def __releaseAndReturn(self, result):
+        self.release()
+        return result
+
+    def __dequeue(self, entry):
+        if entry in self.waiting:
+            self.waiting.remove(entry)
+            entry[1].cancel()
+
+    def __timeout(self, entry):
+        self.waiting.remove(entry)
+        metrics.increment(self.name + ".shed")
+        entry[0].errback(BackendOverloaded(self.retryAfter))
+
+
+class CircuitBreaker(object):
+    """Stop sending calls to a server (database) that keeps failing.  The
+    breaker is closed (calls pass) as long as less than `errorRate` of the
+    last `window` calls failed or took longer than `slowCall` seconds.
+    Otherwise it opens, and calls fail immediately for `openTime` seconds.
+    Then it is half-open: One trial call is let through, and depending on
+    its outcome, the breaker closes or opens again."""
+    def __init__(self, name, window, minCalls, errorRate, slowCall, openTime, clock=reactor):
+        self.name = name
+        self.window = window
+        self.minCalls = minCalls
+        self.errorRate = errorRate
+        self.slowCall = slowCall
+        self.openTime = openTime
+        self.clock = clock
+        self.state = "closed"
+        self.outcomes = collections.deque()
+        self.openedAt = 0
+        self.trialRunning = False
+        metrics.setGauge(name + ".breaker", self.getState)
+
+    def getState(self):
+        if self.state == "open" and self.clock.seconds() - self.openedAt >= self.openTime:
+            self.state = "half-open"
+        return self.state
+
+    def isOpen(self):
+        """Whether a call would be rejected right now."""
+        state = self.getState()
+        return state == "open" or (state == "half-open" and self.trialRunning)
+
+    def allow(self):
+        """Raise `CircuitOpen` if a call must not be made now; otherwise
+        return whether it is a trial call."""
+        if self.isOpen():
+            metrics.increment(self.name + ".rejected")
+            raise CircuitOpen(max(1, int(self.openedAt + self.openTime - self.clock.seconds())))
+        if self.state == "half-open":
+            self.trialRunning = True
+            return True
+        return False
+
+    def record(self, ok, trial):
+        if trial:
+            self.trialRunning = False
+            if ok:
+                log.msg("closing circuit breaker for " + self.name)
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self.__open()
+        elif self.state == "closed":
+            self.outcomes.append(ok)
+            if len(self.outcomes) > self.window:
+                self.outcomes.popleft()
+            failures = len([o for o in self.outcomes if not o])
+            if len(self.outcomes) >= self.minCalls and failures >= self.errorRate * len(self.outcomes):
+                self.__open()
+
+    def cancelled(self, trial):
+        """The call was given up on for other reasons than the server."""
+        if trial:
+            self.trialRunning = False
+
+    def __open(self):
+        if self.state != "open":
+            log.msg("opening circuit breaker for " + self.name)
+            metrics.increment(self.name + ".opened")
+        self.state = "open"
+        self.openedAt = self.clock.seconds()
+        self.outcomes.clear()
+
+
+# Calls that only read data can be repeated on another server if the
+# first one could not be reached.
+
+READ_METHODS = ('search', 'read', 'fields_get', 'fields_view_get', 'default_get', 'name_get', 'name_search')
+
+CONNECTION_ERRORS = (error.ConnectError, error.ConnectionLost, error.TimeoutError, error.DNSLookupError)
+
+
+def isIdempotentCall(service, method, args):
+    return service == 'common' or (method == 'execute' and len(args) > 4 and args[4] in READ_METHODS)
+
+
+class OpenErpBackend(object):
+    """One OpenERP server.  If it cannot be reached, it is ejected from
+    the pool for `eject_time` seconds or until a health probe succeeds."""
+    def __init__(self, url, config=None):
+        self.url = url
+        self.maxCalls = getConfigValue(config, "OpenERP", "max_calls", 16, int)
+        self.maxCallsPerDb = getConfigValue(config, "OpenERP", "max_calls_per_db", 0, int)
+        self.maxQueue = getConfigValue(config, "OpenERP", "max_queue", 100, int)
+        self.queueTimeout = getConfigValue(config, "OpenERP", "queue_timeout", 10, float)
+        self.retryAfter = getConfigValue(config, "OpenERP", "retry_after", 5, int)
+        self.ejectAfter = getConfigValue(config, "OpenERP", "eject_after", 1, int)
+        self.ejectTime = getConfigValue(config, "OpenERP", "eject_time", 30, float)
+        self.connectTimeout = getConfigValue(config, "OpenERP", "connect_timeout", 10, float)
+        self.callTimeout = getConfigValue(config, "OpenERP", "call_timeout", 60, float)
+        self.breakerWindow = getConfigValue(config, "OpenERP", "breaker_window", 20, int)
+        self.breakerMinCalls = getConfigValue(config, "OpenERP", "breaker_min_calls", 10, int)
+        self.breakerErrorRate = getConfigValue(config, "OpenERP", "breaker_error_rate", 0.5, float)
+        self.breakerSlowCall = getConfigValue(config, "OpenERP", "breaker_slow_call", 10, float)
+        self.breakerOpenTime = getConfigValue(config, "OpenERP", "breaker_open_time", 30, float)
+        self.breakers = {}
+        self.limiter = CallLimiter(url, self.maxCalls, self.maxQueue, self.queueTimeout, self.retryAfter)
+        self.dbLimiters = {}
+        self.outstanding = 0
+        self.failures = 0
+        self.ejectedUntil = 0
+        metrics.setGauge(url + ".outstanding", lambda: self.outstanding)
+        metrics.setGauge(url + ".ejected", lambda: int(not self.isAvailable()))
+
+    def getLimiters(self, dbname):
+        """Return the limiters a call to the given database must pass."""
+        if not self.maxCallsPerDb:
+            return [self.limiter]
+        if not dbname in self.dbLimiters:
+            self.dbLimiters[dbname] = CallLimiter(self.url + dbname, self.maxCallsPerDb,
+                self.maxQueue, self.queueTimeout, self.retryAfter)
+        return [self.dbLimiters[dbname], self.limiter]
+
+    def getBreaker(self, dbname):
+        """Return the circuit breaker for the given database, or None."""
+        if not self.breakerWindow:
+            return None
+        if not dbname in self.breakers:
+            self.breakers[dbname] = CircuitBreaker(self.url + dbname, self.breakerWindow,
+                self.breakerMinCalls, self.breakerErrorRate, self.breakerSlowCall, self.breakerOpenTime)
+        return self.breakers[dbname]
+
+    def isAvailable(self, dbname=None):
+        if time.time() < self.ejectedUntil:
+            return False
+        return dbname is None or not dbname in self.breakers or not self.breakers[dbname].isOpen()
+
+    def callRemote(self, service, method, *args):
+        """Call `method` of the given OpenERP service (e.g. 'object');
+        the first argument is always the name of the database."""
+        breaker = self.getBreaker(args[0])
+        # fail fast instead of waiting in the queue for nothing
+        if breaker and breaker.isOpen():
+            return defer.maybeDeferred(breaker.allow)
+        proxy = quietProxy(self.url + service, self.connectTimeout)
+        f, fargs = self.__callWithTimeout, (breaker, proxy, method) + args
+        for limiter in reversed(self.getLimiters(args[0])):
+            f, fargs = limiter.run, (f,) + fargs
+        self.outstanding += 1
+        d = f(*fargs)
+        d.addBoth(self.__callDone)
+        return d
+
+    def __callWithTimeout(self, breaker, proxy, method, *args):
+        trial = breaker and breaker.allow()
+        d = proxy.callRemote(method, *args)
+        if self.callTimeout:
+            withTimeout(d, self.callTimeout,
+                error.TimeoutError("no answer from %s within %s seconds" % (self.url, self.callTimeout)))
+        if breaker:
+            d.addBoth(self.__recordOutcome, breaker, trial, breaker.clock.seconds())
+        return d
+
+    def __recordOutcome(self, result, breaker, trial, started):
+        if isinstance(result, failure.Failure) and result.check(defer.CancelledError):
+            breaker.cancelled(trial)
+        else:
+            failed = isinstance(result, failure.Failure) and result.check(*CONNECTION_ERRORS)
+            breaker.record(not failed and breaker.clock.seconds() - started <= breaker.slowCall, trial)
+        return result
+
+    def __callDone(self, result):
+        self.outstanding -= 1
+        if isinstance(result, failure.Failure) and result.check(*CONNECTION_ERRORS):
+            self.failures += 1
+            if self.failures >= self.ejectAfter:
+                self.eject(result.getErrorMessage())
+        elif not isinstance(result, failure.Failure) or result.check(xmlrpclib.Fault):
+            self.failures = 0
+        return result
+
+    def eject(self, reason):
+        if self.isAvailable():
+            log.msg("ejecting backend %s: %s" % (self.url, reason))
+            metrics.increment(self.url + ".ejections")
+        self.ejectedUntil = time.time() + self.ejectTime
+
+    def probe(self):
+        """Check with a cheap call whether the server is alive."""
+        def alive(_):
+            if not self.isAvailable():
+                log.msg("backend %s is back" % self.url)
+            self.failures = 0
+            self.ejectedUntil = 0
+
+        def dead(err):
+            self.eject(err.getErrorMessage())
+        proxy = quietProxy(self.url + 'common', self.connectTimeout)
+        d = self.__callWithTimeout(None, proxy, 'version')
+        d.addCallbacks(alive, dead)
+        return d
+
+
+class OpenErpBackendPool(object):
+    """A number of OpenERP servers working on the same databases.  Each
+    call goes to the available server with the fewest outstanding calls;
+    a call that only reads data is retried on another server if the first
+    one could not be reached.
+
+    Calls that only read data go to the servers in `readUrls` (if any),
+    except for users who have changed something during the last
+    `read_your_writes` seconds, so that they see their own changes even
+    if these servers lag behind."""
+    def __init__(self, urls, config=None, readUrls=()):
+        self.backends = [OpenErpBackend(url, config) for url in urls]
+        self.readBackends = [OpenErpBackend(url, config) for url in readUrls]
+        self.retries = getConfigValue(config, "OpenERP", "retries", 1, int)
+        self.healthInterval = getConfigValue(config, "OpenERP", "health_interval", 10, float)
+        self.readYourWrites = getConfigValue(config, "OpenERP", "read_your_writes", 5, float)
+        self.lastWrites = {}
+        self.nextIndex = 0
+        self.healthCheck = None
+
+    def chooseBackend(self, backends, dbname=None, exclude=()):
+        candidates = [b for b in backends if not b in exclude]
+        candidates = [b for b in candidates if b.isAvailable(dbname)] or candidates
+        # start with a different server every time to spread calls evenly
+        #  among servers with the same number of outstanding calls
+        self.nextIndex = (self.nextIndex + 1) % len(candidates)
+        candidates = candidates[self.nextIndex:] + candidates[:self.nextIndex]
+        return min(candidates, key=lambda b: b.outstanding)
+
+    def callRemote(self, service, method, *args):
+        """Call `method` of the given OpenERP service (e.g. 'object');
+        the first argument is always the name of the database."""
+        if not isIdempotentCall(service, method, args):
+            d = self.chooseBackend(self.backends, args[0]).callRemote(service, method, *args)
+            d.addBoth(self.__recordWrite, args[:2])
+            return d
+        if self.readBackends and self.__mayReadFromReplica(args[:2]):
+            # the primary servers are only used if no replica answers
+            backend = self.chooseBackend(self.readBackends, args[0])
+            backends = self.readBackends + self.backends
+            metrics.increment("backend.replicaReads")
+        else:
+            backends = self.backends
+            backend = self.chooseBackend(backends, args[0])
+        d = backend.callRemote(service, method, *args)
+        d.addErrback(self.__retry, backends, [backend], self.retries, service, method, args)
+        return d
+
+    def __mayReadFromReplica(self, user):
+        if time.time() - self.lastWrites.get(user, 0) < self.readYourWrites:
+            return False
+        return len([b for b in self.readBackends if b.isAvailable(user[0])]) > 0
+
+    def __recordWrite(self, result, user):
+        # user is (database, uid)
+        if self.readBackends and self.readYourWrites:
+            now = time.time()
+            for key, when in self.lastWrites.items():
+                if now - when >= self.readYourWrites:
+                    del self.lastWrites[key]
+            self.lastWrites[user] = now
+        return result
+
+    def __retry(self, err, backends, tried, retries, service, method, args):
+        err.trap(CircuitOpen, *CONNECTION_ERRORS)
+        if not retries or len(tried) >= len(backends):
+            return err
+        backend = self.chooseBackend(backends, args[0], tried)
+        log.msg("retrying '%s' call on %s: %s" % (method, backend.url, err.getErrorMessage()))
+        metrics.increment("backend.retries")
+        d = backend.callRemote(service, method, *args)
+        d.addErrback(self.__retry, backends, tried + [backend], retries - 1, service, method, args)
+        return d
+
+    def checkHealth(self):
+        for backend in self.backends + self.readBackends:
+            backend.probe()
+
+    def startHealthChecks(self):
+        if self.healthInterval and not self.healthCheck:
+            self.healthCheck = task.LoopingCall(self.checkHealth)
+            self.healthCheck.start(self.healthInterval)
+
+    def stopHealthChecks(self):
+        if self.healthCheck:
+            self.healthCheck.stop()
+            self.healthCheck = None
+
+
+# Requests
+# --------
+#
+# Twisted reads the whole body of a request before it is passed on to
+# the resources.  `OpenErpRequest` makes sure that this body does not grow
+# beyond the configured maximum size: A request whose Content-Length is too
+# large is rejected before its body is read at all, and a chunked body is
+# rejected as soon as it exceeds the limit.  (Twisted already spools
+# bodies of unknown or large size to a temporary file instead of keeping
+# them in memory.)
+
+class OpenErpRequest(Request):
+    bodyRejected = False
+
+    def gotLength(self, length):
+        self.bodySize = 0
+        maxBodySize = getattr(self.channel.site, "maxBodySize", None)
+        if maxBodySize and length is not None and length > maxBodySize:
+            self.rejectBody()
+        else:
+            Request.gotLength(self, length)
+
+    def handleContentChunk(self, data):
+        if self.bodyRejected:
+            return
+        self.bodySize += len(data)
+        maxBodySize = getattr(self.channel.site, "maxBodySize", None)
+        if maxBodySize and self.bodySize > maxBodySize:
+            self.rejectBody()
+        else:
+            Request.handleContentChunk(self, data)
+
+    def process(self):
+        # a rejected request has been answered already
+        if not self.bodyRejected:
+            # keep track of the requests in progress
+            site = self.channel.site
+            site.activeRequests += 1
+
+            def requestDone(_):
+                site.activeRequests -= 1
+            self.notifyFinish().addBoth(requestDone)
+            # Twisted stops reading from the connection while a request is
+            #  processed, so that we would not notice a client that has
+            #  gone; keep reading (anything the client sends is buffered)
+            #  so that work for an aborted request can be cancelled
+            self.channel.transport.resumeProducing()
+            Request.process(self)
+
+    def rejectBody(self):
+        """Answer with 413 and close the connection.  Since the request
+        has not been completely received yet, we cannot use the usual
+        machinery to write a response."""
+        self.bodyRejected = True
+        self.content = StringIO()
+        message = str(RequestTooLarge(self.channel.site.maxBodySize))
+        self.channel.transport.write("HTTP/1.1 413 Request Entity Too Large\r\n" +
+            "Content-Type: text/plain; charset=utf-8\r\n" +
+            "Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(message), message))
+        self.channel.transport.loseConnection()
+
+
+class OpenErpSite(Site):
+    requestFactory = OpenErpRequest
+
+    def __init__(self, resource, maxBodySize=None, *args, **kwargs):
+        Site.__init__(self, resource, *args, **kwargs)
+        self.maxBodySize = maxBodySize
+        self.activeRequests = 0
+
+
+def checkBodySize(request, maxBodySize):
+    """Raise `RequestTooLarge` if the body of `request` exceeds the given
+    size.  (This is only necessary for requests that were not received
+    by an `OpenErpSite`.)"""
+    if maxBodySize and request.content is not None:
+        request.content.seek(0, 2)
+        size = request.content.tell()
+        request.content.seek(0)
+        if size > maxBodySize:
+            raise RequestTooLarge(maxBodySize)
+
+
+# Cache stores
+# ------------
+#
+# Cached responses (and, if the store is shared, the schema, workflow
+# buttons and default values of the models) are kept in a cache store,
+# which maps string keys to values that expire after some seconds.  All
+# methods return Deferreds, and a store that has a problem behaves as if
+# it were empty, so the cache can never make a request fail.
+#
+# With `store: memory` in `[Cache]`, each proxy process keeps up to
+# `max_entries` values itself, dropping the least recently used ones.
+# With `store: memcached`, the values are kept on the memcached servers
+# given in `memcached_servers` instead, so that all proxy processes (and
+# hosts) using them share the cached responses, and OpenERP is asked for
+# the metadata of a model only once.  Values are sent in the XML-RPC
+# encoding, so they may only contain what XML-RPC can transport.
+
+class CacheStore(object):
+    # whether other processes see the values, too
+    shared = False
+
+    def get(self, key):
+        """Return (a Deferred for) the value of `key`, or None."""
+        raise NotImplementedError()
+
+    def getMulti(self, keys):
+        """Return (a Deferred for) a dict with the values of those `keys`
+        that are present."""
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl):
+        """Keep `value` for `ttl` seconds."""
+        raise NotImplementedError()
+
+    def add(self, key, value, ttl):
+        """Like `set()`, but only if there is no value for `key` yet."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+
+class MemoryCacheStore(CacheStore):
+    def __init__(self, maxEntries, maxBytes=64 * 1024 * 1024):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        # key -> [expires, last use, value, size]
+        self.values = {}
+        self.uses = 0
+        # the sum of the sizes of all values
+        self.size = 0
+
+    def __sizeOf(self, key, value):
+        """Return (roughly) the bytes taken by `value` under `key`."""
+        if isinstance(value, str):
+            return len(key) + len(value)
+        return len(key) + len(repr(value))
+
+    def __remove(self, key):
+        item = self.values.pop(key, None)
+        if item is None:
+            return False
+        self.size -= item[3]
+        return True
+
+    def __lookup(self, key, now):
+        item = self.values.get(key)
+        if item is None:
+            return None
+        if now > item[0]:
+            self.__remove(key)
+            return None
+        self.uses += 1
+        item[1] = self.uses
+        return item
+
+    def get(self, key):
+        item = self.__lookup(key, time.time())
+        if item is None:
+            return defer.succeed(None)
+        return defer.succeed(item[2])
+
+    def getMulti(self, keys):
+        now = time.time()
+        values = {}
+        for key in keys:
+            item = self.__lookup(key, now)
+            if item is not None:
+                values[key] = item[2]
+        return defer.succeed(values)
+
+    def set(self, key, value, ttl):
+        if self.maxEntries <= 0 or ttl <= 0:
+            return defer.succeed(False)
+        size = self.__sizeOf(key, value)
+        if size > self.maxBytes:
+            return defer.succeed(False)
+        self.__remove(key)
+        if len(self.values) >= self.maxEntries or self.size + size > self.maxBytes:
+            self.__evict(size)
+        self.uses += 1
+        self.values[key] = [time.time() + ttl, self.uses, value, size]
+        self.size += size
+        return defer.succeed(True)
+
+    def add(self, key, value, ttl):
+        if self.__lookup(key, time.time()) is not None:
+            return defer.succeed(False)
+        return self.set(key, value, ttl)
+
+    def delete(self, key):
+        return defer.succeed(self.__remove(key))
+
+    def __evict(self, size):
+        """Make room for a value of `size` bytes: Drop the expired values
+        and, if that is not enough, the least recently used ones until a
+        tenth of the entries and bytes is free again."""
+        now = time.time()
+        for key, item in self.values.items():
+            if now > item[0]:
+                self.__remove(key)
+        maxEntries = self.maxEntries - max(1, self.maxEntries / 10)
+        maxBytes = self.maxBytes - self.maxBytes / 10 - size
+        if len(self.values) > maxEntries or self.size > maxBytes:
+            byUse = sorted(self.values.items(), key=lambda keyAndItem: keyAndItem[1][1])
+            for key, item in byUse:
+                if len(self.values) <= maxEntries and self.size <= maxBytes:
+                    break
+                self.__remove(key)
+        metrics.increment("cachestore.evictions")
+
+
+class MemcachedConnection(MemCacheProtocol):
+    """Tells the store when the connection to a server is lost."""
+
+    def __init__(self, store, server, timeOut):
+        MemCacheProtocol.__init__(self, timeOut)
+        self.store = store
+        self.server = server
+
+    def connectionLost(self, reason):
+        MemCacheProtocol.connectionLost(self, reason)
+        self.store.disconnected(self)
+
+
+class MemcachedCacheStore(CacheStore):
+    shared = True
+
+    def __init__(self, servers, prefix="", timeout=1.0, retryAfter=10.0):
+        # (host, port) pairs; each key is kept on one of them
+        self.servers = []
+        for server in servers:
+            host, _, port = server.partition(":")
+            self.servers.append((host, int(port or 11211)))
+        self.prefix = prefix
+        self.timeout = timeout
+        # seconds to wait before connecting again to a server that failed
+        self.retryAfter = retryAfter
+        self.connections = {}
+        # server -> Deferreds waiting for the connection being established
+        self.connecting = {}
+        self.downUntil = {}
+
+    def getKey(self, key):
+        # memcached keys are limited to 250 characters without spaces
+        return self.prefix + hashlib.sha1(key).hexdigest()
+
+    def getServer(self, mkey):
+        return self.servers[zlib.crc32(mkey) % len(self.servers)]
+
+    def encode(self, value):
+        return xmlrpclib.dumps((value,), allow_none=True)
+
+    def decode(self, data):
+        return xmlrpclib.loads(data)[0][0]
+
+    def connect(self, server):
+        """Return a Deferred for a connection to `server`."""
+        if server in self.connections:
+            return defer.succeed(self.connections[server])
+        if time.time() < self.downUntil.get(server, 0):
+            return defer.fail(error.ConnectError(string="memcached at %s:%d is down" % server))
+        waiting = defer.Deferred()
+        if server in self.connecting:
+            self.connecting[server].append(waiting)
+            return waiting
+        self.connecting[server] = [waiting]
+
+        def connected(connection):
+            self.connections[server] = connection
+            for d in self.connecting.pop(server):
+                d.callback(connection)
+
+        def failed(err):
+            self.downUntil[server] = time.time() + self.retryAfter
+            log.msg("cannot connect to memcached at %s:%d: %s" % (server[0], server[1], err.getErrorMessage()))
+            for d in self.connecting.pop(server):
+                d.errback(err)
+        creator = ClientCreator(reactor, MemcachedConnection, self, server, self.timeout)
+        d = creator.connectTCP(server[0], server[1], self.timeout)
+        d.addCallbacks(connected, failed)
+        return waiting
+
+    def disconnected(self, connection):
+        if self.connections.get(connection.server) is connection:
+            del self.connections[connection.server]
+
+    def __call(self, mkey, operation, default):
+        """Return (a Deferred for) the result of `operation(connection)`
+        on the server for `mkey`, or `default` if that fails."""
+        d = self.connect(self.getServer(mkey))
+        d.addCallback(operation)
+
+        def failed(err):
+            metrics.increment("cachestore.errors")
+            if not err.check(error.ConnectError):
+                log.msg("memcached request failed: %s" % err.getErrorMessage())
+            return default
+        d.addErrback(failed)
+        return d
+
+    def __decode(self, data):
+        if data is None:
+            return None
+        try:
+            return self.decode(data)
+        except Exception as e:
+            log.msg("cannot decode cached value: %s" % e)
+            return None
+
+    def get(self, key):
+        mkey = self.getKey(key)
+        d = self.__call(mkey, lambda connection: connection.get(mkey), (0, None))
+        d.addCallback(lambda flagsAndData: self.__decode(flagsAndData[1]))
+        return d
+
+    def getMulti(self, keys):
+        byServer = {}
+        for key in keys:
+            mkey = self.getKey(key)
+            byServer.setdefault(self.getServer(mkey), {})[mkey] = key
+        values = {}
+
+        def collect(found, mkeys):
+            for mkey, (flags, data) in found.items():
+                value = self.__decode(data)
+                if value is not None:
+                    values[mkeys[mkey]] = value
+        dl = []
+        for mkeys in byServer.values():
+            d = self.__call(mkeys.keys()[0],
+                lambda connection, mkeys=mkeys: connection.getMultiple(mkeys.keys()), {})
+            d.addCallback(collect, mkeys)
+            dl.append(d)
+        d = defer.DeferredList(dl)
+        d.addCallback(lambda _: values)
+        return d
+
+    def __store(self, command, key, value, ttl):
+        mkey = self.getKey(key)
+        data = self.encode(value)
+        # memcached takes longer times as timestamps
+        ttl = min(int(math.ceil(ttl)), 30 * 24 * 60 * 60)
+        return self.__call(mkey, lambda connection: getattr(connection, command)(mkey, data, 0, ttl), False)
+
+    def set(self, key, value, ttl):
+        return self.__store("set", key, value, ttl)
+
+    def add(self, key, value, ttl):
+        return self.__store("add", key, value, ttl)
+
+    def delete(self, key):
+        mkey = self.getKey(key)
+        return self.__call(mkey, lambda connection: connection.delete(mkey), False)
+
+
+def makeCacheStore(config):
+    """Return the cache store configured in the `[Cache]` section."""
+    kind = getConfigValue(config, "Cache", "store", "memory").lower()
+    if kind == "memory":
+        return MemoryCacheStore(getConfigValue(config, "Cache", "max_entries", 1000, int),
+            getConfigValue(config, "Cache", "max_bytes", 64 * 1024 * 1024, int))
+    elif kind == "memcached":
+        return MemcachedCacheStore(getConfigValue(config, "Cache", "memcached_servers", "localhost:11211").split(),
+            getConfigValue(config, "Cache", "memcached_prefix", "rop:"),
+            getConfigValue(config, "Cache", "memcached_timeout", 1.0, float))
+    else:
+        raise ValueError("unknown cache store '%s'" % kind)
+
+
+# Response cache
+# --------------
+#
+# The aim of this proxy is to make OpenERP data cacheable, so every
+# successful GET response says how long it may be cached (Cache-Control,
+# Expires and Vary headers).  The policy is configured per database, model
+# and route (`item`, `feed`, `schema` or `defaults`) in sections named
+# `[Cache <database>/<model>/<route>]`, where each part may be `*`; more
+# specific sections take precedence, and `[Cache]` applies to everything.
+# (`[Cache <model>]` is the same as `[Cache */<model>/*]`.)  Responses are
+# private unless `public` is set, since they depend on the user's access
+# rights.  Schemas and defaults may be cached until the schema expires
+# (that is what a `max_age` of -1 means, see `MetadataScheduler`).
+#
+# We also keep the most recent representations of successfully requested
+# resources ourselves (per user, in the cache store):
+#
+# - for `max_age` seconds after it has been fetched, a representation is
+#   served without asking OpenERP;
+# - for another `stale_while_revalidate` seconds, it is still served
+#   immediately, but a fresh version is fetched in the background (only
+#   once, no matter how many requests come in);
+# - if OpenERP cannot answer in time (or cannot be reached at all), it is
+#   served for up to `stale_if_error` seconds after `max_age`, which is
+#   better than an error.
+#
+# Stale representations are marked with a Warning header.
+#
+# Changes made through the proxy invalidate the representations they make
+# outdated: Each representation is tagged with the paths it depends on
+# (`/<database>/<model>` for feeds, `/<database>/<model>/<id>` for items),
+# and `invalidate()` gives the tags of changed items, their collection and
+# related items a new version in the cache store.  Representations stored with an older
+# version of one of their tags are not used anymore.  Observers (e.g.
+# external caches) are told about the invalidated tags.
+
+class CachePolicy(object):
+    def __init__(self, maxAge, staleWhileRevalidate, staleIfError, public=False, sMaxAge=None,
+            vary="Authorization, Accept, Accept-Language"):
+        self.maxAge = maxAge
+        self.staleWhileRevalidate = staleWhileRevalidate
+        self.staleIfError = staleIfError
+        self.public = public
+        self.sMaxAge = sMaxAge
+        self.vary = vary
+
+    def withMaxAge(self, maxAge):
+        return CachePolicy(maxAge, self.staleWhileRevalidate, self.staleIfError, self.public,
+            self.sMaxAge, self.vary)
+
+    def getLifetime(self):
+        """How long a representation is useful at all."""
+        return self.maxAge + max(self.staleWhileRevalidate, self.staleIfError)
+
+    def getCacheControl(self):
+        directives = [self.public and "public" or "private", "max-age=%d" % self.maxAge]
+        if self.public and self.sMaxAge is not None:
+            directives.append("s-maxage=%d" % self.sMaxAge)
+        if self.staleWhileRevalidate:
+            directives.append("stale-while-revalidate=%d" % self.staleWhileRevalidate)
+        if self.staleIfError:
+            directives.append("stale-if-error=%d" % self.staleIfError)
+        return ", ".join(directives)
+
+    def setHeaders(self, request, age=0):
+        """Set the caching headers of a response that is `age` seconds old."""
+        request.setHeader("Cache-Control", self.getCacheControl())
+        expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.maxAge - age)
+        request.setHeader("Expires", httpdate(expires))
+        if self.vary:
+            request.setHeader("Vary", self.vary)
+
+
+class CacheEntry(object):
+    def __init__(self, fetched, expires, maxAge, versions, headers, body):
+        self.fetched = fetched
+        self.expires = expires
+        # the max-age at this point is kept since it may change over time
+        #  (see `OpenErpModelResource.__getCachePolicy()`)
+        self.maxAge = maxAge
+        # (tag, version) pairs
+        self.versions = versions
+        self.headers = headers
+        self.body = body
+
+    def dump(self):
+        """Return the entry as a value for a cache store."""
+        return [self.fetched, self.expires, self.maxAge, [list(v) for v in self.versions],
+            self.headers, xmlrpclib.Binary(self.body)]
+
+    @classmethod
+    def load(cls, value):
+        fetched, expires, maxAge, versions, headers, body = value
+        return cls(fetched, expires, maxAge, tuple([tuple(v) for v in versions]),
+            dict([(str(name), str(v)) for name, v in headers.items()]), body.data)
+
+
+class ResponseCache(object):
+    # options of a cache policy, with their defaults; nothing is cached
+    #  for a route unless its max_age or stale_* options are configured
+    options = (("max_age", int, 0),
+               ("stale_while_revalidate", int, 0),
+               ("stale_if_error", int, 0),
+               ("public", configBool, False),
+               ("s_maxage", int, None),
+               ("vary", str, "Authorization, Accept, Accept-Language"))
+
+    # seconds for which the version of a tag is kept
+    tagLifetime = 24 * 60 * 60
+
+    def __init__(self, config=None, store=None, clock=reactor):
+        self.config = config
+        self.clock = clock
+        if store is None:
+            store = makeCacheStore(config)
+        self.cacheStore = store
+        # larger responses are not kept (memcached does not take values
+        #  beyond 1 MB, and they would crowd out the rest of the memory store)
+        self.maxCachedBody = getConfigValue(config, "Cache", "max_cached_body", 512 * 1024, int)
+        # whether to send Surrogate-Key headers (see `CachePurger`)
+        self.surrogateKeys = getConfigValue(config, "Cache", "surrogate_keys", False, configBool)
+        self.policies = {}
+        # keys of the entries that are being refreshed
+        self.refreshing = set()
+        # the version of a tag is a random token that is replaced when
+        #  the tag is invalidated; a tag that the store has forgotten
+        #  gets a new one, so that forgetting versions is safe
+        self.invalidations = 0
+        self.observers = []
+
+    def getPolicy(self, dbname, model, route):
+        """Return the `CachePolicy` for the given route of a model; a
+        `max_age` of -1 must be replaced by the caller."""
+        if not (dbname, model, route) in self.policies:
+            sections = ["Cache",
+                        "Cache */*/%s" % route,
+                        "Cache %s/*/*" % dbname,
+                        "Cache %s/*/%s" % (dbname, route),
+                        "Cache %s" % model,
+                        "Cache */%s/*" % model,
+                        "Cache */%s/%s" % (model, route),
+                        "Cache %s/%s/*" % (dbname, model),
+                        "Cache %s/%s/%s" % (dbname, model, route)]
+            values = []
+            for option, conv, value in self.options:
+                for section in sections:
+                    value = getConfigValue(self.config, section, option, value, conv)
+                values.append(value)
+            self.policies[(dbname, model, route)] = CachePolicy(*values)
+        return self.policies[(dbname, model, route)]
+
+    def getKey(self, request):
+        return "response:" + hashlib.sha1("%s:%s@%s%s" % (request.getUser(), request.getPassword(),
+            request.getHeader("Host"), request.uri)).hexdigest()
+
+    def newVersion(self):
+        return "%x-%s" % (self.invalidations, os.urandom(6).encode("hex"))
+
+    def getVersions(self, tags):
+        """Return (a Deferred for) the current (tag, version) pairs."""
+        keys = ["tag:" + tag for tag in tags]
+        if not keys:
+            return defer.succeed(())
+
+        def complete(versions):
+            for key in keys:
+                if not key in versions:
+                    versions[key] = self.newVersion()
+                    self.cacheStore.add(key, versions[key], self.tagLifetime)
+            return tuple([(tag, versions[key]) for tag, key in zip(tags, keys)])
+        d = self.cacheStore.getMulti(keys)
+        d.addCallback(complete)
+        return d
+
+    def isCurrent(self, entry):
+        """Return (a Deferred for) whether none of the tags of `entry`
+        has been invalidated since it was fetched."""
+        keys = ["tag:" + tag for tag, version in entry.versions]
+        if not keys:
+            return defer.succeed(True)
+
+        def compare(versions):
+            for key, (tag, version) in zip(keys, entry.versions):
+                if versions.get(key) != version:
+                    return False
+            return True
+        d = self.cacheStore.getMulti(keys)
+        d.addCallback(compare)
+        return d
+
+    def invalidate(self, dbname, model, ids, related=()):
+        """Mark the representations of the given items, of the collection
+        they belong to and of the `related` (model, id) items as outdated,
+        and notify the observers."""
+        tags = ["/%s/%s" % (dbname, model)]
+        tags.extend(["/%s/%s/%s" % (dbname, model, i) for i in ids])
+        for relatedModel, i in related:
+            tag = "/%s/%s/%s" % (dbname, relatedModel, i)
+            if not tag in tags:
+                tags.append(tag)
+        self.invalidations += 1
+        version = self.newVersion()
+        for tag in tags:
+            self.cacheStore.set("tag:" + tag, version, self.tagLifetime)
+        metrics.increment("cache.invalidations")
+        for observer in self.observers:
+            try:
+                observer(tags)
+            except Exception:
+                log.err(None, "cache invalidation observer failed")
+
+    def addObserver(self, observer):
+        """Call `observer` with the list of invalidated tags whenever
+        cached representations are invalidated."""
+        self.observers.append(observer)
+
+    def store(self, request, policy, body, versions):
+        """Remember the response that is about to be sent for `request`;
+        `versions` are those of its tags when the request came in."""
+        lifetime = policy.getLifetime()
+        if lifetime <= 0:
+            return
+        if len(body) > self.maxCachedBody:
+            metrics.increment("cache.tooLarge")
+            return
+        now = self.clock.seconds()
+        headers = {}
+        for name in ("Content-Type", "Last-Modified", "ETag", "Accept-Ranges", "Surrogate-Key", "xkey"):
+            value = request.responseHeaders.getRawHeaders(name)
+            if value:
+                headers[name] = value[0]
+        entry = CacheEntry(now, now + lifetime, policy.maxAge, versions, headers, body)
+        self.cacheStore.set(self.getKey(request), entry.dump(), lifetime)
+
+    def serve(self, request, policy, refresh):
+        """Answer `request` from the cache if the representation there
+        is fresh enough; return (a Deferred for) whether we did.  If it is
+        stale, but may still be used while it is revalidated,
+        `refresh(request)` is called to fetch a new one (it must return a
+        Deferred)."""
+        if policy.getLifetime() <= 0:
+            # nothing is cached for this route
+            return defer.succeed(False)
+        key = self.getKey(request)
+        d = self.__getEntry(key)
+        d.addCallback(self.__serveEntry, key, request, policy, refresh)
+        return d
+
+    def __serveEntry(self, entry, key, request, policy, refresh):
+        if entry is None:
+            return False
+        age = self.clock.seconds() - entry.fetched
+        maxAge = entry.maxAge
+        if age <= maxAge:
+            self.__write(request, entry, policy, None)
+            metrics.increment("responses.cached")
+            return True
+        elif age <= maxAge + policy.staleWhileRevalidate:
+            self.__write(request, entry, policy, '110 - "Response is Stale"')
+            metrics.increment("responses.stale")
+            if not key in self.refreshing:
+                self.refreshing.add(key)
+                d = defer.maybeDeferred(refresh, request)
+                d.addBoth(lambda _: self.refreshing.discard(key))
+            return True
+        return False
+
+    def serveStale(self, request, policy):
+        """Answer `request` with the representation sent last time, if
+        there is one that is not too old; return (a Deferred for) whether
+        we did."""
+        d = self.__getEntry(self.getKey(request))
+        d.addCallback(self.__serveStaleEntry, request, policy)
+        return d
+
+    def __serveStaleEntry(self, entry, request, policy):
+        if entry is None:
+            return False
+        if self.clock.seconds() - entry.fetched > entry.maxAge + policy.staleIfError:
+            return False
+        self.__write(request, entry, policy, '110 - "Response is Stale", 111 - "Revalidation Failed"')
+        metrics.increment("responses.stale")
+        return True
+
+    def __getEntry(self, key):
+        """Return (a Deferred for) the current entry for `key`, or None."""
+        d = self.cacheStore.get(key)
+
+        def check(value):
+            if value is None:
+                return None
+            entry = CacheEntry.load(value)
+            d = self.isCurrent(entry)
+            d.addCallback(lambda current: current and entry or None)
+            return d
+        d.addCallback(check)
+        return d
+
+    def __write(self, request, entry, policy, warning):
+        age = int(self.clock.seconds() - entry.fetched)
+        request.setResponseCode(200)
+        for name, value in entry.headers.items():
+            request.setHeader(name, value)
+        policy.withMaxAge(entry.maxAge).setHeaders(request, age)
+        request.setHeader("Age", str(age))
+        if warning:
+            request.setHeader("Warning", warning)
+        if "Accept-Ranges" in entry.headers:
+            writeRanged(request, entry.body)
+        else:
+            request.write(entry.body)
+            request.finish()
+
+
+class RefreshRequest(object):
+    """Stands in for a client's GET request when a cached representation
+    is refreshed in the background: It collects the response instead of
+    sending it anywhere."""
+    method = "GET"
+
+    def __init__(self, request):
+        self.uri = request.uri
+        self.args = request.args
+        self.postpath = list(request.postpath)
+        self.urlPath = str(request.URLPath())
+        self.user = request.getUser()
+        self.password = request.getPassword()
+        # the whole representation is needed, whatever the client has
+        self.requestHeaders = request.requestHeaders.copy()
+        for name in ("Range", "If-Range", "If-None-Match", "If-Modified-Since"):
+            self.requestHeaders.removeHeader(name)
+        self.responseHeaders = Headers()
+        self.code = 200
+        self.body = []
+        self.notifications = []
+
+    def URLPath(self):
+        return self.urlPath
+
+    def getUser(self):
+        return self.user
+
+    def getPassword(self):
+        return self.password
+
+    def getHeader(self, name):
+        values = self.requestHeaders.getRawHeaders(name)
+        return values and values[-1] or None
+
+    def setHeader(self, name, value):
+        self.responseHeaders.setRawHeaders(name, [value])
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def write(self, data):
+        self.body.append(data)
+
+    def finish(self):
+        for d in self.notifications:
+            d.callback(None)
+        self.notifications = []
+
+    def notifyFinish(self):
+        d = defer.Deferred()
+        self.notifications.append(d)
+        return d
+
+
+# Purging external caches
+# -----------------------
+#
+# If there are HTTP caches (e.g. Varnish) in front of the proxy, they have
+# to learn about changes as well.  The `CachePurger` listens to the
+# invalidations of the `ResponseCache`, collects them for `delay` seconds
+# and then tells each of the caches in `[Purge] urls` about them, retrying
+# failed requests a few times.  Depending on `mode`, it sends
+#
+# - `purge`: one PURGE request per changed path (filtered feeds are not
+#   purged),
+# - `ban`: one BAN request whose `X-Ban-Url` header is a regular expression
+#   matching all changed paths (with any query string), or
+# - `xkey`: one PURGE request whose `Xkey-Purge` header lists the surrogate
+#   keys of the changed resources.
+#
+# Surrogate keys are sent with every response in the `Surrogate-Key` and
+# `xkey` headers if `[Cache] surrogate_keys` is set: `<db>`, `<db>/<model>`
+# and `<db>/<model>:<id>` for items (`:feed`, `:schema` and `:defaults`
+# for the other routes).
+
+def tagToSurrogateKey(tag):
+    """Return the surrogate key of the resources with the given tag
+    (see `ResponseCache`)."""
+    parts = tag.strip("/").split("/")
+    if len(parts) == 2:
+        return "%s/%s:feed" % tuple(parts)
+    return "%s/%s:%s" % tuple(parts)
+
+
+class DiscardBody(Protocol):
+    def __init__(self, finished):
+        self.finished = finished
+
+    def dataReceived(self, data):
+        pass
+
+    def connectionLost(self, reason):
+        self.finished.callback(None)
+
+
+class CachePurger(object):
+    def __init__(self, config=None):
+        self.urls = [url.rstrip("/") for url in getConfigValue(config, "Purge", "urls", "").split()]
+        self.mode = getConfigValue(config, "Purge", "mode", "purge").lower()
+        if not self.mode in ("purge", "ban", "xkey"):
+            raise ValueError("unknown purge mode '%s'" % self.mode)
+        # the Host header the caches know the proxy by
+        self.host = getConfigValue(config, "Purge", "host", None)
+        self.delay = getConfigValue(config, "Purge", "delay", 0.5, float)
+        self.retries = getConfigValue(config, "Purge", "retries", 3, int)
+        self.retryDelay = getConfigValue(config, "Purge", "retry_delay", 1, float)
+        self.timeout = getConfigValue(config, "Purge", "timeout", 10, float)
+        self.agent = Agent(reactor, connectTimeout=self.timeout)
+        self.pending = set()
+        self.flushCall = None
+
+    def invalidated(self, tags):
+        """Observer for `ResponseCache.invalidate()`."""
+        self.pending.update(tags)
+        if self.flushCall is None:
+            self.flushCall = reactor.callLater(self.delay, self.flush)
+
+    def getRequests(self, tags):
+        """Return (method, path, headers) for the requests that tell a
+        cache about the given tags."""
+        headers = {}
+        if self.host:
+            headers["Host"] = [self.host]
+        if self.mode == "purge":
+            return [("PURGE", tag, headers) for tag in tags]
+        elif self.mode == "ban":
+            headers["X-Ban-Url"] = ["^(%s)(\\?.*)?$" % "|".join([re.escape(tag) for tag in tags])]
+        else:
+            headers["Xkey-Purge"] = [" ".join([tagToSurrogateKey(tag) for tag in tags])]
+        return [("BAN" if self.mode == "ban" else "PURGE", "/", headers)]
+
+    def flush(self):
+        """Send the collected invalidations now."""
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+        self.flushCall = None
+        tags = sorted(self.pending)
+        self.pending = set()
+        dl = []
+        if tags:
+            for url in self.urls:
+                for method, path, headers in self.getRequests(tags):
+                    dl.append(self.send(url + path, method, headers, self.retries))
+        return defer.DeferredList(dl)
+
+    def send(self, url, method, headers, retries):
+        d = self.agent.request(method, url, Headers(headers), None)
+        withTimeout(d, self.timeout, error.TimeoutError("no answer from %s" % url))
+
+        def handleResponse(response):
+            finished = defer.Deferred()
+            response.deliverBody(DiscardBody(finished))
+            if response.code >= 500:
+                raise IOError("%s answered %d %s" % (url, response.code, response.phrase))
+            metrics.increment("purge.sent")
+            return finished
+
+        def retry(err):
+            if not retries:
+                metrics.increment("purge.failed")
+                log.msg("%s %s failed: %s" % (method, url, err.getErrorMessage()))
+                return
+            return task.deferLater(reactor, self.retryDelay, self.send, url, method, headers, retries - 1)
+        d.addCallback(handleResponse)
+        d.addErrback(retry)
+        return d
+
+
+# Health
+# ------
+#
+# `/_health` (which needs no authentication) shows whether the OpenERP
+# servers are available and the state of their circuit breakers, e.g. for
+# load balancers in front of the proxy.  It answers with 503 if none of
+# the (primary) servers is available.
+
+class HealthResource(Resource):
+    isLeaf = True
+
+    def __init__(self, pool):
+        Resource.__init__(self)
+        self.pool = pool
+
+    def render_GET(self, request):
+        hello()
+        available = [b for b in self.pool.backends if b.isAvailable()]
+        degraded = [b for b in self.pool.backends + self.pool.readBackends
+            if not b.isAvailable() or [br for br in b.breakers.values() if br.getState() != "closed"]]
+        if not available:
+            status = "unavailable"
+            request.setResponseCode(503)
+        elif degraded:
+            status = "degraded"
+        else:
+            status = "ok"
+        xml = ['<?xml version="1.0" encoding="utf-8"?>\n<health status="%s">\n' % status]
+        for role, backends in (("primary", self.pool.backends), ("replica", self.pool.readBackends)):
+            for b in backends:
+                xml.append('  <backend url="%s" role="%s" available="%s" outstanding="%d">\n' %
+                    (xmlescape(b.url), role, str(b.isAvailable()).lower(), b.outstanding))
+                for dbname in sorted(b.breakers):
+                    xml.append('    <breaker database="%s" state="%s" />\n' %
+                        (xmlescape(dbname), b.breakers[dbname].getState()))
+                xml.append('  </backend>\n')
+        xml.append('</health>\n')
+        request.setHeader("Content-Type", "application/xml; charset=utf-8")
+        request.setHeader("Cache-Control", "no-cache")
+        return "".join(xml)
+
+
+# Shared descriptions
+# -------------------
+#
+# Databases with the same modules installed have the same model
+# descriptions (`fields_get`) and workflow buttons, which can be large.
+# The `descriptions` table interns them by a hash of their content, so
+# that all models with the same description share one copy.  It only
+# holds weak references, so a description is dropped when no model uses
+# it anymore.  Shared descriptions must not be changed.
+#
+# The workflow buttons are also indexed by state: for every state named
+# in a `states` attribute, `ButtonList` knows the actions allowed in it,
+# with the start and the end of the link that announces them, so that
+# rendering an item and checking a workflow signal are dict lookups.
+
+class Description(dict):
+    """A model description; `hash` identifies its content."""
+    hash = None
+
+
+class ButtonList(list):
+    """The workflow buttons of a model; `hash` identifies its content."""
+    hash = None
+
+    def __init__(self, buttons=()):
+        list.__init__(self, buttons)
+        # (name, button, link start, link end) of all named buttons that
+        #  are not actions given by their (numeric) database id
+        actions = []
+        states = set()
+        for button in self:
+            if not "name" in button.attrib:
+                continue
+            name = button.attrib["name"]
+            try:
+                int(name)
+                continue
+            except ValueError:
+                pass
+            linkStart = "  <link rel='%s' href='" % name
+            linkEnd = "/%s' title='%s' />\n" % (name, button.attrib.get("string", ""))
+            if isinstance(linkEnd, unicode):
+                linkStart, linkEnd = linkStart.encode("utf-8"), linkEnd.encode("utf-8")
+            allowed = "states" in button.attrib and button.attrib["states"].split(",") or None
+            if allowed:
+                states.update(allowed)
+            actions.append(((name, button, linkStart, linkEnd), allowed))
+        # items without a state may use all actions, items in a state
+        #  that no button names only those without `states`
+        self.allActions = self.__index([a for a, allowed in actions])
+        self.statelessActions = self.__index([a for a, allowed in actions if allowed is None])
+        self.byState = {}
+        for state in states:
+            self.byState[state] = self.__index([a for a, allowed in actions if allowed is None or state in allowed])
+
+    def __index(self, actions):
+        byName = {}
+        for action in reversed(actions):
+            byName[action[0]] = action[1]
+        return (actions, byName)
+
+    def __getIndex(self, item):
+        if not "state" in item:
+            return self.allActions
+        try:
+            return self.byState.get(item["state"], self.statelessActions)
+        except TypeError:
+            # not a state that can be named by a button
+            return self.statelessActions
+
+    def getActions(self, item):
+        """Return (name, button, link start, link end) of all actions
+        allowed in the current state of `item`, in the order of the view."""
+        return self.__getIndex(item)[0]
+
+    def findAction(self, item, name):
+        """Return the button of the action `name` if it is allowed in the
+        current state of `item`, None otherwise."""
+        return self.__getIndex(item)[1].get(name)
+
+
+class DescriptionTable(object):
+    def __init__(self):
+        self.descriptions = weakref.WeakValueDictionary()
+        self.buttons = weakref.WeakValueDictionary()
+        metrics.setGauge("descriptions.distinct", lambda: len(self.descriptions))
+
+    def getDescription(self, desc):
+        """Return the shared `Description` with the same content as `desc`."""
+        try:
+            key = hashlib.sha1(json.dumps(desc, sort_keys=True)).hexdigest()
+        except (TypeError, ValueError):
+            # not something we can hash, so it is not shared
+            return Description(desc)
+        shared = self.descriptions.get(key)
+        if shared is None:
+            shared = Description(desc)
+            shared.hash = key
+            self.descriptions[key] = shared
+        else:
+            metrics.increment("descriptions.shared")
+        return shared
+
+    def getButtons(self, arch):
+        """Return the shared `ButtonList` of the form view `arch`."""
+        if isinstance(arch, unicode):
+            key = hashlib.sha1(arch.encode("utf-8")).hexdigest()
+        else:
+            key = hashlib.sha1(arch).hexdigest()
+        shared = self.buttons.get(key)
+        if shared is None:
+            shared = ButtonList(etree.fromstring(arch).findall(".//button"))
+            shared.hash = key
+            self.buttons[key] = shared
+        else:
+            metrics.increment("descriptions.shared")
+        return shared
+
+descriptions = DescriptionTable()
+
+
+# Render plans
+# ------------
+#
+# Rendering an item, the default values or the schema of a model needs
+# the same things for every response: the tag of each field, its type,
+# the URL of the related collection and the way its value is written.  A
+# `RenderPlan` prepares them once per model description and base URL (the
+# model resource keeps its plans until the description changes), and the
+# output is put together with a list join.  The RelaxNG schema does not
+# depend on any item, so the plan renders it only once.
+#
+# Binary fields are not read with the item; it links to their contents
+# at `/{db}/{model}/{id}/{field}` instead.
+
+RELATIONAL_TYPES = ('many2one', 'one2many', 'many2many')
+
+class FieldPlan(object):
+    def __init__(self, ns, name, desc, parent):
+        self.name = name
+        self.tag = ns + ":" + name
+        self.type = desc['type']
+        self.required = "required" in desc and desc['required'] or False
+        if self.type in RELATIONAL_TYPES:
+            self.relation = parent + "/" + desc.get('relation', '')
+            self.start = "    <%s type='%s' relation='%s'" % (self.tag, self.type, self.relation)
+        else:
+            self.relation = None
+            self.start = "    <%s type='%s'" % (self.tag, self.type)
+        self.end = "</%s>\n" % self.tag
+        if self.type == 'binary':
+            # the item's URL goes between these
+            self.linkStart = self.start + ">\n      <link href='"
+            self.linkEnd = "/%s' />\n    %s" % (name, self.end)
+        self.renderItem = {'many2one': self.__itemMany2one,
+                           'one2many': self.__itemX2many,
+                           'many2many': self.__itemX2many,
+                           'binary': None}.get(self.type, self.__itemData)
+        self.renderDefault = {'many2one': self.__defaultMany2one,
+                              'one2many': self.__defaultX2many,
+                              'many2many': self.__defaultX2many,
+                              'boolean': self.__defaultBoolean}.get(self.type, self.__defaultData)
+
+    # values as read from OpenERP, with the value in a comment if empty
+
+    def __itemEmpty(self, value):
+        return "%s><!-- %s -->%s" % (self.start, value, self.end)
+
+    def __itemMany2one(self, value):
+        if not value:
+            return self.__itemEmpty(value)
+        return "%s>\n      <link href='%s/%s' />\n    %s" % (self.start, self.relation, value[0], self.end)
+
+    def __itemX2many(self, value):
+        if not value:
+            return self.__itemEmpty(value)
+        links = ''.join(['\n      <link href="%s/%s" />' % (self.relation, v) for v in value])
+        return "%s>%s\n    %s" % (self.start, links, self.end)
+
+    def __itemData(self, value):
+        if not value and self.type != "boolean":
+            return self.__itemEmpty(value)
+        return "%s>%s%s" % (self.start, xmlescape(unicode(value).encode('utf-8')), self.end)
+
+    # default values, with a closed tag if empty
+
+    def __defaultMany2one(self, value):
+        if not value:
+            return self.start + " />\n"
+        return "%s>\n      <link href='%s/%s' />\n    %s" % (self.start, self.relation, str(value), self.end)
+
+    def __defaultX2many(self, value):
+        if not value:
+            return self.start + " />\n"
+        links = ''.join(['\n      <link href="%s/%s" />' % (self.relation, str(v)) for v in value])
+        return "%s>%s\n    %s" % (self.start, links, self.end)
+
+    def __defaultBoolean(self, value):
+        return "%s>%s%s" % (self.start, xmlescape(str(value and "True" or "False")), self.end)
+
+    def __defaultData(self, value):
+        if not value:
+            return self.start + " />\n"
+        return "%s>%s%s" % (self.start, xmlescape(str(value)), self.end)
+
+    def renderRelaxNG(self):
+        xml = ['  <element name="%s">\n    <attribute name="type" />' % self.name]
+        if self.relation:
+            xml.append('\n    <attribute name="relation" />')
+        if self.type in ('many2many', 'one2many'):
+            elemName = self.required and "oneOrMore" or "zeroOrMore"
+            xml.append('\n    <%s><element name="link" ns="http://www.w3.org/2005/Atom"><attribute name="href" /></element></%s>\n  ' % (elemName, elemName))
+        else:
+            # select the correct field type
+            if self.type == "many2one":
+                s = '<element name="link" ns="http://www.w3.org/2005/Atom"><attribute name="href" /></element>'
+            elif self.type == "float":
+                s = '<data type="double" />'
+            elif self.type == "boolean":
+                s = '<choice><value>True</value><value>False</value></choice>'
+            elif self.type == "integer":
+                s = '<data type="decimal" />'
+            elif self.type == "binary":
+                # the link to the current contents, or new contents in base64
+                s = '<choice><element name="link" ns="http://www.w3.org/2005/Atom"><attribute name="href" /></element><text /></choice>'
+            else:
+                s = None
+            if s is not None:
+                output = self.required and s or "<optional>" + s + "</optional>"
+            else:
+                output = self.required and '<data type="string"><param name="minLength">1</param></data>' or \
+                    "<optional><text /></optional>"
+            xml.append("\n    " + output + '\n  ')
+        xml.append('</element>\n')
+        return ''.join(xml)
+
+
+class RenderPlan(object):
+    def __init__(self, model, desc, path):
+        self.model = model
+        self.desc = desc
+        # the URL of the collection and of its schema
+        self.path = path
+        self.schema = path + "/schema"
+        self.ns = "".join([word[0] for word in model.split('.')])
+        self.rootTag = self.ns + ":" + model.replace('.', '_')
+        parent = '/'.join(path.split("/")[:-1])
+        # in the order of the description
+        self.fields = [FieldPlan(self.ns, name, val, parent) for name, val in desc.iteritems()]
+        self.fieldsByName = dict([(f.name, f) for f in self.fields])
+        self.binaryFields = [f for f in self.fields if f.type == 'binary']
+        # the fields to read for an item (all of them if empty)
+        if self.binaryFields:
+            self.readFields = [f.name for f in self.fields if f.type != 'binary']
+        else:
+            self.readFields = []
+        self.relaxNG = None
+
+    def renderItemFields(self, item, path):
+        """Return the XML of the fields of an item as read from OpenERP;
+        `path` is the URL of the item."""
+        xml = []
+        fields = self.fieldsByName
+        for key, value in item.iteritems():
+            if key in fields:
+                if fields[key].renderItem is not None:
+                    xml.append(fields[key].renderItem(value))
+            else:  # no type given or no desc present
+                xml.append("    <%s:%s>%s</%s:%s>\n" % (self.ns, key, xmlescape(unicode(value).encode('utf-8')),
+                    self.ns, key))
+        for f in self.binaryFields:
+            xml.extend((f.linkStart, path, f.linkEnd))
+        return ''.join(xml)
+
+    def renderDefaultFields(self, defaults):
+        """Return the XML of the fields of an item with default values."""
+        return ''.join([f.renderDefault(f.name in defaults and defaults[f.name] or "") for f in self.fields])
+
+    def getRelaxNG(self):
+        if self.relaxNG is None:
+            xml = ['''<?xml version="1.0" encoding="utf-8"?>
+<element name="%s" xmlns="http://relaxng.org/ns/structure/1.0" datatypeLibrary="http://www.w3.org/2001/XMLSchema-datatypes" ns="%s">
+<interleave>
+    <element name="id"><data type="decimal" /></element>
+''' % (self.model.replace(".", "_"), self.schema)]
+            xml.extend([f.renderRelaxNG() for f in self.fields])
+            xml.append('</interleave>\n</element>')
+            self.relaxNG = ''.join(xml)
+        return self.relaxNG
+
+
+# Metadata expiry
+# ---------------
+#
+# The schema, workflow buttons and default values of a model are kept for
+# `metadata_ttl` seconds (`[Cache]`), give or take `metadata_jitter` (a
+# fraction of it), so that models loaded at the same time do not all
+# expire at once.  After that, they are still used, but fetched again in
+# the background on next use (see `OpenErpModelResource.__revalidate()`);
+# if that does not happen within `metadata_max_stale` seconds, they are
+# dropped.  A single `MetadataScheduler` keeps the expiry times of all
+# models in a heap and has one timer for the earliest of them.
+
+class MetadataScheduler(object):
+    def __init__(self, config=None, clock=reactor):
+        self.ttl = getConfigValue(config, "Cache", "metadata_ttl", 2 * 60 * 60, float)
+        self.jitter = getConfigValue(config, "Cache", "metadata_jitter", 0.1, float)
+        self.maxStale = getConfigValue(config, "Cache", "metadata_max_stale", 10 * 60, float)
+        self.clock = clock
+        # (dbname, model) -> [time, "fresh" or "stale", model resource]
+        self.entries = {}
+        # (time, key) pairs; those not matching `entries` are left over
+        #  from earlier schedules and skipped
+        self.heap = []
+        self.timer = None
+        metrics.setGauge("metadata.models", lambda: len(self.entries))
+
+    def getKey(self, resource):
+        return (resource.dbname, resource.model)
+
+    def schedule(self, resource, fetchedAt=None):
+        """Let the metadata of `resource`, fetched at `fetchedAt` (now by
+        default), expire after the TTL."""
+        if fetchedAt is None:
+            fetchedAt = self.clock.seconds()
+        ttl = self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+        self.__push(resource, fetchedAt + ttl, "fresh")
+
+    def unschedule(self, resource):
+        self.entries.pop(self.getKey(resource), None)
+
+    def getRemaining(self, resource):
+        """Return the seconds until the metadata of `resource` expires."""
+        entry = self.entries.get(self.getKey(resource))
+        if entry is None or entry[1] != "fresh":
+            return 0
+        return max(0, entry[0] - self.clock.seconds())
+
+    def inspect(self):
+        """Return (dbname, model, state, seconds until the next step) for
+        all models with metadata, the next to expire first."""
+        now = self.clock.seconds()
+        return sorted([(key[0], key[1], entry[1], entry[0] - now) for key, entry in self.entries.items()],
+            key=lambda item: item[3])
+
+    def flush(self, dbname=None, model=None):
+        """Drop the metadata of the given models (all by default) now;
+        return how many there were."""
+        flushed = 0
+        for key, entry in self.entries.items():
+            if dbname in (None, key[0]) and model in (None, key[1]):
+                del self.entries[key]
+                entry[2].clearCachedValues()
+                flushed += 1
+        return flushed
+
+    def stop(self):
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+    def __push(self, resource, when, state):
+        key = self.getKey(resource)
+        self.entries[key] = [when, state, resource]
+        heapq.heappush(self.heap, (when, key))
+        if self.timer is None or when < self.timer.getTime():
+            self.__arm()
+
+    def __arm(self):
+        """Set the timer to the earliest time in the heap."""
+        delay = max(0, self.heap[0][0] - self.clock.seconds())
+        if self.timer is None:
+            self.timer = self.clock.callLater(delay, self.__expire)
+        else:
+            self.timer.reset(delay)
+
+    def __expire(self):
+        self.timer = None
+        now = self.clock.seconds()
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            when, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != when:
+                continue
+            expired.append(entry)
+        for when, state, resource in expired:
+            if state == "fresh":
+                resource.markStale()
+                self.__push(resource, now + self.maxStale, "stale")
+            else:
+                self.unschedule(resource)
+                resource.clearCachedValues()
+        # forget the left-overs once they outnumber the real entries
+        if len(self.heap) > 2 * len(self.entries) + 100:
+            self.heap = [(entry[0], key) for key, entry in self.entries.items()]
+            heapq.heapify(self.heap)
+        if self.heap and self.timer is None:
+            self.__arm()
+
+
+# Access fingerprints
+# -------------------
+#
+# The default values of a model are kept per user, since OpenERP may
+# derive them from the user in many ways (e.g. via the user's employee,
+# shop or warehouse).  For the models listed in `shared_defaults`
+# (`[Cache]`), which are known not to do so, they are kept per access
+# fingerprint instead, i.e. the user's groups and company: all users with
+# the same ones share them.  The fingerprint of a user is fetched once
+# every `fingerprint_ttl` seconds, and at most `max_fingerprints` are
+# kept.  If the defaults of such a model turn out to have the requesting
+# user as a value, the model keeps them per user after all.
+
+class AccessFingerprints(object):
+    def __init__(self, backend, config=None):
+        self.backend = backend
+        self.ttl = getConfigValue(config, "Cache", "fingerprint_ttl", 10 * 60, float)
+        self.maxEntries = getConfigValue(config, "Cache", "max_fingerprints", 10000, int)
+        # (dbname, uid) -> (expires, fingerprint)
+        self.fingerprints = {}
+
+    def get(self, dbname, uid, pwd):
+        """Return (a Deferred for) the fingerprint of the user."""
+        now = time.time()
+        entry = self.fingerprints.get((dbname, uid))
+        if entry is not None and now < entry[0]:
+            return defer.succeed(entry[1])
+        d = self.backend.callRemote('object', 'execute', dbname, uid, pwd, 'res.users', 'read',
+            [uid], ['groups_id', 'company_id'])
+        d.addCallback(self.__makeFingerprint)
+        d.addErrback(self.__handleError, uid)
+        d.addCallback(self.__remember, dbname, uid)
+        return d
+
+    def __makeFingerprint(self, val):
+        user = val[0]
+        company = user.get('company_id') and user['company_id'][0] or 0
+        return "g%s-c%s" % (",".join([str(g) for g in sorted(user.get('groups_id') or [])]), company)
+
+    def __handleError(self, err, uid):
+        if err.check(defer.CancelledError):
+            return err
+        # without the groups, we cannot share anything with other users
+        log.msg("cannot read the groups of user %s: %s" % (uid, err.getErrorMessage()))
+        return "u%s" % uid
+
+    def __remember(self, fingerprint, dbname, uid):
+        now = time.time()
+        if len(self.fingerprints) >= self.maxEntries:
+            for key, entry in self.fingerprints.items():
+                if now >= entry[0]:
+                    del self.fingerprints[key]
+        if len(self.fingerprints) >= self.maxEntries:
+            # all have the same lifetime, so these are the oldest ones
+            byExpiry = sorted(self.fingerprints.items(), key=lambda item: item[1][0])
+            for key, entry in byExpiry[:max(1, len(byExpiry) / 10)]:
+                del self.fingerprints[key]
+        self.fingerprints[(dbname, uid)] = (now + self.ttl, fingerprint)
+        return fingerprint
+
+
+# Metadata snapshots
+# ------------------
+#
+# After a restart, every model would have to ask OpenERP for its schema,
+# workflow buttons and default values again, all at once.  If `file` is
+# set in `[Snapshot]`, this metadata is written to that file every
+# `interval` seconds and on shutdown, and read from it on startup.  It is
+# used right away, but fetched again in the background on first use (with
+# the credentials of the request or prewarming that uses it); metadata
+# that was fetched more than `max_age` seconds ago is not used at all.
+
+class MetadataSnapshot(object):
+    def __init__(self, dispatcher, config=None):
+        self.dispatcher = dispatcher
+        self.filename = getConfigValue(config, "Snapshot", "file", None)
+        self.interval = getConfigValue(config, "Snapshot", "interval", 300, int)
+        self.maxAge = getConfigValue(config, "Snapshot", "max_age", 24 * 60 * 60, int)
+        self.saveTask = None
+
+    def collect(self):
+        """Return [dbname, model, metadata] for all models that have some."""
+        models = []
+        for dbname, db in self.dispatcher.databases.items():
+            for model, res in db.models.items():
+                metadata = res.getMetadata()
+                if metadata is not None:
+                    models.append([dbname, model, metadata])
+        return models
+
+    def write(self, models):
+        data = xmlrpclib.dumps(({"saved": time.time(), "models": models},), allow_none=True)
+        # replace the file at once, so that it is never read half-written
+        tmpname = "%s.%d.tmp" % (self.filename, os.getpid())
+        f = open(tmpname, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmpname, self.filename)
+        return len(models)
+
+    def save(self):
+        """Write the metadata to the file (in a thread); return a Deferred."""
+        models = self.collect()
+        if not models:
+            return defer.succeed(0)
+        d = threads.deferToThread(self.write, models)
+        d.addErrback(lambda err: log.msg("cannot write snapshot %s: %s" % (self.filename, err.getErrorMessage())))
+        return d
+
+    def load(self):
+        """Give the models the metadata from the file; return how many
+        models got some."""
+        if not self.filename or not os.path.exists(self.filename):
+            return 0
+        try:
+            f = open(self.filename, "rb")
+            try:
+                snapshot = xmlrpclib.loads(f.read())[0][0]
+            finally:
+                f.close()
+        except Exception as e:
+            log.msg("cannot read snapshot %s: %s" % (self.filename, e))
+            return 0
+        now = time.time()
+        count = 0
+        for dbname, model, metadata in snapshot["models"]:
+            if metadata["fetched"] is None or now - metadata["fetched"] > self.maxAge:
+                continue
+            self.dispatcher.getDatabase(dbname).getModel(model).setMetadata(metadata)
+            count += 1
+        log.msg("loaded metadata of %d models from %s" % (count, self.filename))
+        return count
+
+    def start(self):
+        """Save the metadata periodically and on shutdown."""
+        if not self.filename:
+            return
+        self.saveTask = task.LoopingCall(self.save)
+        self.saveTask.start(self.interval, now=False)
+        reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+    def stop(self):
+        if self.saveTask is not None and self.saveTask.running:
+            self.saveTask.stop()
+        return self.save()
+
+
+# Thumbnails
+# ----------
+#
+# Images in binary fields can also be asked for in smaller sizes, e.g.
+# `/{db}/product.product/7/image?w=80`, where the width must be one of
+# the `sizes` given in `[Thumbnails]`.  Thumbnails are made with the
+# Python Imaging Library (PIL or Pillow), if it is installed, in a thread,
+# and kept in `directory` with a name derived from the item, the field,
+# its `__last_update` and the width, so a changed image gets new ones.
+# When the files take up more than `max_size` megabytes, those used least
+# recently are deleted.  Several proxy processes may share the directory;
+# each one only counts the files it knows about.  Since the files are sent
+# to clients as they are, the directory must belong to the user running
+# the proxy and must not be writable by others; otherwise thumbnails are
+# not kept.  Without a `directory`, each process keeps them in a private
+# temporary directory that is deleted on exit.
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+
+def makeThumbnail(data, width):
+    """Return `data` scaled down to `width` pixels, as JPEG if it was one
+    and as PNG otherwise; raise IOError if it is not an image."""
+    img = Image.open(StringIO(data))
+    format = img.format == "JPEG" and "JPEG" or "PNG"
+    if img.size[0] > width:
+        height = max(1, img.size[1] * width // img.size[0])
+        # JPEG images can be decoded in a smaller size right away
+        img.draft("RGB", (width, height))
+        if format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        img = img.resize((width, height), Image.ANTIALIAS)
+    out = StringIO()
+    if format == "JPEG":
+        img.save(out, "JPEG", quality=85)
+    else:
+        img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+class ThumbnailCache(object):
+    def __init__(self, config=None):
+        self.sizes = [int(s) for s in getConfigValue(config, "Thumbnails", "sizes", "80 300").split()]
+        self.directory = getConfigValue(config, "Thumbnails", "directory", None)
+        self.maxBytes = int(getConfigValue(config, "Thumbnails", "max_size", 100, float) * 1024 * 1024)
+        # file name -> [last use, size]; filled from the directory on first use
+        self.files = None
+        self.totalBytes = 0
+        # the methods below are called from several threads
+        self.lock = threading.Lock()
+
+    def isAvailable(self):
+        return Image is not None
+
+    def getKey(self, dbname, model, modelId, field, lastUpdate, width):
+        return hashlib.sha1("%s/%s/%s/%s@%s:%d" % (dbname, model, modelId, field, lastUpdate, width)).hexdigest()
+
+    def get(self, key):
+        """Return the thumbnail stored under `key`, or None."""
+        if not self.__scan():
+            return None
+        try:
+            f = open(os.path.join(self.directory, key), "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+        self.lock.acquire()
+        try:
+            if key in self.files:
+                self.files[key][0] = time.time()
+        finally:
+            self.lock.release()
+        return data
+
+    def make(self, key, data, width):
+        """Make the thumbnail of `data`, store it under `key` and return it."""
+        thumbnail = makeThumbnail(data, width)
+        if not self.__scan():
+            return thumbnail
+        # replace the file at once, so that it is never read half-written
+        filename = os.path.join(self.directory, key)
+        tmpname = "%s.%d.%d.tmp" % (filename, os.getpid(), threading.current_thread().ident)
+        try:
+            f = open(tmpname, "wb")
+            try:
+                f.write(thumbnail)
+            finally:
+                f.close()
+            os.rename(tmpname, filename)
+        except (IOError, OSError) as e:
+            log.msg("cannot store thumbnail %s: %s" % (filename, e))
+            return thumbnail
+        self.lock.acquire()
+        try:
+            if key in self.files:
+                self.totalBytes -= self.files[key][1]
+            self.files[key] = [time.time(), len(thumbnail)]
+            self.totalBytes += len(thumbnail)
+            if self.totalBytes > self.maxBytes:
+                self.__evict()
+        finally:
+            self.lock.release()
+        metrics.increment("thumbnails.made")
+        return thumbnail
+
+    def __scan(self):
+        """Find out which files there are on first use; return whether
+        the directory can be used."""
+        if self.files is not None:
+            return self.directory is not None
+        self.lock.acquire()
+        try:
+            if self.files is not None:
+                return self.directory is not None
+            # `self.files` is only set once the directory has been
+            #  checked, since other threads look at it without the lock
+            try:
+                if self.directory is None:
+                    self.directory = tempfile.mkdtemp(prefix="restful-openerp-thumbnails-")
+                    atexit.register(shutil.rmtree, self.directory, True)
+                elif not os.path.lexists(self.directory):
+                    os.makedirs(self.directory, 0700)
+                self.__checkDirectory()
+                names = os.listdir(self.directory)
+            except (OSError, ValueError) as e:
+                log.msg("not keeping thumbnails in %s: %s" % (self.directory, e))
+                self.directory = None
+                self.files = {}
+                return False
+            files = {}
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files[name] = [st.st_mtime, st.st_size]
+            self.totalBytes = sum([size for used, size in files.values()])
+            self.files = files
+            return True
+        finally:
+            self.lock.release()
+
+    def __checkDirectory(self):
+        """Raise ValueError unless nobody else can put files into the
+        directory."""
+        st = os.lstat(self.directory)
+        if not stat.S_ISDIR(st.st_mode):
+            raise ValueError("not a directory")
+        if st.st_uid != os.getuid():
+            raise ValueError("owned by another user")
+        if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError("writable by other users")
+
+    def __evict(self):
+        """Delete the least recently used files until a tenth of the
+        space is free again (the lock must be held)."""
+        byUse = sorted(self.files.items(), key=lambda item: item[1][0])
+        for name, (used, size) in byUse:
+            if self.totalBytes <= self.maxBytes * 0.9:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            del self.files[name]
+            self.totalBytes -= size
+            metrics.increment("thumbnails.evicted")
+
+
 # Dispatcher
 # ----------
 #
@@ -106,16 +2385,31 @@ def quietProxy(url):
 # on to that object by returning from the `getChild()` method.
 
 class OpenErpDispatcher(Resource, object):
-    def __init__(self, openerpUrl):
+    def __init__(self, openerpUrl, config=None):
         Resource.__init__(self)
         self.databases = {}
         self.openerpUrl = openerpUrl
+        self.config = config
+        readUrls = getConfigValue(config, "OpenERP", "read_urls", "").split()
+        self.backend = OpenErpBackendPool(openerpUrl.split(), config, readUrls)
+        # maximum size of request bodies in bytes
+        self.maxBodySize = getConfigValue(config, "Proxy Settings", "max_body_size", 10 * 1024 * 1024, int)
+        self.cacheStore = makeCacheStore(config)
+        self.responseCache = ResponseCache(config, self.cacheStore)
+        self.metadataScheduler = MetadataScheduler(config)
+        self.fingerprints = AccessFingerprints(self.backend, config)
+        self.thumbnails = ThumbnailCache(config)
+        if getConfigValue(config, "Purge", "urls", ""):
+            self.purger = CachePurger(config)
+            self.responseCache.addObserver(self.purger.invalidated)
         log.msg("Server starting up with backend: " + self.openerpUrl)
 
     #@override http://twistedmatrix.com/documents/10.0.0/api/twisted.web.resource.Resource.html#getChildWithDefault
     def getChildWithDefault(self, pathElement, request):
         """Ensure that we have HTTP Basic Auth."""
-        if not (request.getUser() and request.getPassword()):
+        if pathElement == "_health":
+            return HealthResource(self.backend)
+        elif not (request.getUser() and request.getPassword()):
             return UnauthorizedPage()
         else:
             return super(OpenErpDispatcher, self).getChildWithDefault(pathElement, request)
@@ -149,12 +2443,67 @@ class OpenErpDispatcher(Resource, object):
             else:
                 log.msg("Host header %s is ill-shaped" % httpHost)
 
-        if path in self.databases:
-            return self.databases[path]
+        return self.getDatabase(path)
+
+    def getDatabase(self, dbname):
+        """Return the resource for the given database."""
+        if dbname in self.databases:
+            return self.databases[dbname]
         else:
-            log.msg("Creating resource for '%s' database." % path)
-            self.databases[path] = OpenErpDbResource(self.openerpUrl, path)
-            return self.databases[path]
+            log.msg("Creating resource for '%s' database." % dbname)
+            self.databases[dbname] = OpenErpDbResource(self.backend, dbname, self.config, self.responseCache,
+                self.cacheStore, self.metadataScheduler, self.fingerprints, self.thumbnails)
+            return self.databases[dbname]
+
+    def prewarm(self):
+        """Fill the schema caches of the models given in the `[Prewarm]`
+        section of the configuration file (all models listed in `ir.model`
+        for `*`), so that the first requests to these models do not have
+        to wait for them."""
+        user = getConfigValue(self.config, "Prewarm", "user", None)
+        pwd = getConfigValue(self.config, "Prewarm", "password", None)
+        if not user or not pwd:
+            return defer.succeed(None)
+        databases = getConfigValue(self.config, "Prewarm", "databases", "").split()
+        models = getConfigValue(self.config, "Prewarm", "models", "*").split()
+        # number of models whose caches are filled at the same time
+        semaphore = defer.DeferredSemaphore(getConfigValue(self.config, "Prewarm", "concurrency", 4, int))
+
+        def warmDatabase(uid, dbname):
+            if not uid:
+                raise xmlrpclib.Fault("AccessDenied", "login failed")
+            d = listModels(uid, dbname)
+            d.addCallback(warmModels, uid, dbname)
+            return d
+
+        def listModels(uid, dbname):
+            if models != ["*"]:
+                return defer.succeed(models)
+            d = self.backend.callRemote('object', 'execute', dbname, uid, pwd, 'ir.model', 'search', [])
+            d.addCallback(lambda ids: self.backend.callRemote('object', 'execute', dbname, uid, pwd,
+                'ir.model', 'read', ids, ['model']))
+            d.addCallback(lambda records: sorted([record['model'] for record in records]))
+            return d
+
+        def warmModels(names, uid, dbname):
+            log.msg("prewarming schema caches of %d models in '%s' database" % (len(names), dbname))
+            dl = []
+            for model in names:
+                d = semaphore.run(self.getDatabase(dbname).getModel(model).warmCaches, uid, pwd)
+                d.addErrback(logError, "%s/%s" % (dbname, model))
+                dl.append(d)
+            return defer.DeferredList(dl)
+
+        def logError(err, dbname):
+            log.msg("prewarming '%s' failed: %s" % (dbname, err.getErrorMessage()))
+
+        dl = []
+        for dbname in databases:
+            d = self.backend.callRemote('common', 'login', dbname, user, pwd)
+            d.addCallback(warmDatabase, dbname)
+            d.addErrback(logError, dbname)
+            dl.append(d)
+        return defer.DeferredList(dl)
 
 
 # Database Resource
@@ -172,42 +2521,151 @@ class OpenErpDispatcher(Resource, object):
 class OpenErpDbResource(Resource):
 
     """This is accessed when going to /{database}."""
-    def __init__(self, openerpUrl, dbname):
+    def __init__(self, backend, dbname, config=None, responseCache=None, cacheStore=None,
+            metadataScheduler=None, fingerprints=None, thumbnails=None):
         Resource.__init__(self)
-        self.openerpUrl = openerpUrl
+        self.backend = backend
         self.dbname = dbname
+        self.config = config
+        self.responseCache = responseCache
+        self.cacheStore = cacheStore
+        self.metadataScheduler = metadataScheduler
+        self.fingerprints = fingerprints
+        self.thumbnails = thumbnails
         self.models = {}
 
     #@override http://twistedmatrix.com/documents/10.0.0/api/twisted.web.resource.Resource.html#getChild
     def getChild(self, path, request):
-        if path in self.models:
-            return self.models[path]
+        return self.getModel(path)
+
+    def getModel(self, model):
+        """Return the resource for the given model."""
+        if model in self.models:
+            return self.models[model]
         else:
-            log.msg("Creating resource for '%s' model." % path)
-            self.models[path] = OpenErpModelResource(self.openerpUrl, self.dbname, path)
-            return self.models[path]
+            log.msg("Creating resource for '%s' model." % model)
+            self.models[model] = OpenErpModelResource(self.backend, self.dbname, model, self.config,
+                self.responseCache, self.cacheStore, self.metadataScheduler, self.fingerprints, self.thumbnails)
+            return self.models[model]
 
 
 class OpenErpModelResource(Resource):
     isLeaf = True
 
     """This is accessed when going to /{database}/{model}."""
-    def __init__(self, openerpUrl, dbname, model):
+    def __init__(self, backend, dbname, model, config=None, responseCache=None, cacheStore=None,
+            metadataScheduler=None, fingerprints=None, thumbnails=None):
         Resource.__init__(self)
-        self.openerpUrl = openerpUrl
+        self.backend = backend
         self.dbname = dbname
         self.model = model
+        self.responseCache = responseCache
+        # the schema, workflow buttons and default values are also kept
+        #  in a shared cache store, if there is one
+        self.cacheStore = cacheStore
+        # number of workflow signals that are sent to OpenERP in parallel
+        #  when a workflow is executed on many items at once
+        self.workflowConcurrency = getConfigValue(config, "Proxy Settings", "workflow_concurrency", 4, int)
+        self.maxBodySize = getConfigValue(config, "Proxy Settings", "max_body_size", 10 * 1024 * 1024, int)
+        # rendering and validating large documents is done in threads
+        #  (see `__offload()`)
+        self.renderThreads = getConfigValue(config, "Proxy Settings", "render_threads", 4, int)
+        self.renderThreshold = getConfigValue(config, "Proxy Settings", "render_threshold", 100, int)
+        # seconds after which we give up on a request (per route, see
+        #  `render_GET()` etc.)
+        self.deadlines = {}
+        default = getConfigValue(config, "Proxy Settings", "deadline", 60, float)
+        for route in ("collection", "item", "binary", "schema", "defaults", "create", "workflow", "update"):
+            self.deadlines[route] = getConfigValue(config, "Proxy Settings", "deadline_" + route, default, float)
+        # a workflow on many items needs many calls, one after the other
+        self.deadlines["batch_workflow"] = getConfigValue(config, "Proxy Settings", "deadline_batch_workflow",
+            default * 10, float)
         self.desc = {}
-        self.workflowDesc = []
+        self.descFetchedAt = None
+        self.workflowArch = None
+        self.workflowDesc = ButtonList()
+        # default values per access fingerprint (or "u<uid>", see
+        #  `AccessFingerprints`), at most `max_defaults` of them
         self.defaults = {}
-        # clear self.desc and self.default every two hours
-        self.cleanUpTask = task.LoopingCall(self.clearCachedValues)
-        self.cleanUpTask.start(60 * 60 * 2)
+        self.defaultsUsed = {}
+        self.defaultsUses = 0
+        self.maxDefaults = getConfigValue(config, "Cache", "max_defaults", 100, int)
+        if fingerprints is None:
+            fingerprints = AccessFingerprints(backend, config)
+        self.fingerprints = fingerprints
+        if thumbnails is None:
+            thumbnails = ThumbnailCache(config)
+        self.thumbnails = thumbnails
+        self.sharedDefaults = model in getConfigValue(config, "Cache", "shared_defaults", "").split()
+        # render plans for the current description, per collection URL
+        self.renderPlans = {}
+        self.renderPlansDesc = None
+        # names of the metadata that is outdated or loaded from a snapshot
+        #  and has not been fetched from OpenERP since (see `__revalidate()`)
+        self.unvalidated = set()
+        # the metadata expires after some time (see `MetadataScheduler`)
+        if metadataScheduler is None:
+            metadataScheduler = MetadataScheduler(config)
+        self.metadataScheduler = metadataScheduler
+
+    def markStale(self):
+        """Fetch all metadata again in the background on next use."""
+        log.msg("schema/default cache for " + self.model + " is outdated")
+        self.unvalidated = set(["fields", "arch"] + ["defaults:%s" % key for key in self.defaults])
 
     def clearCachedValues(self):
         log.msg("clearing schema/default cache for " + self.model)
         self.desc = {}
+        self.descFetchedAt = None
+        self.workflowArch = None
+        self.workflowDesc = ButtonList()
         self.defaults = {}
+        self.defaultsUsed = {}
+        self.unvalidated = set()
+
+    def __getRenderPlan(self, path):
+        """Return the render plan for the current description and the
+        collection at `path`."""
+        if self.renderPlansDesc is not self.desc:
+            self.renderPlans = {}
+            self.renderPlansDesc = self.desc
+        plan = self.renderPlans.get(path)
+        if plan is None:
+            if len(self.renderPlans) >= 10:
+                # the proxy is known under too many names
+                self.renderPlans.clear()
+            plan = RenderPlan(self.model, self.desc, path)
+            self.renderPlans[path] = plan
+        return plan
+
+    def __offload(self, size, f, *args):
+        """Call `f` in a thread from the reactor's thread pool if the
+        amount of work it has to do (estimated by `size`, e.g. the number
+        of fields or items) is large enough to hold up other requests,
+        and call it directly otherwise.  Returns a Deferred.  Note that
+        `f` must not touch any attributes that may change in the meantime,
+        so everything it needs is passed as a parameter."""
+        if self.renderThreads and size >= self.renderThreshold:
+            return threads.deferToThread(f, *args)
+        else:
+            return defer.maybeDeferred(f, *args)
+
+    def __writeAndFinish(self, body, request, ranged=False):
+        """Send `body` (or the part of it the client asks for, if `ranged`)
+        and remember all of it in the response cache."""
+        if self.responseCache and request.method == "GET":
+            policy = self.__getCachePolicy(request)
+            policy.setHeaders(request)
+            if self.responseCache.surrogateKeys:
+                keys = " ".join(self.__getSurrogateKeys(request))
+                request.setHeader("Surrogate-Key", keys)
+                request.setHeader("xkey", keys)
+            self.responseCache.store(request, policy, body, request.cacheVersions)
+        if ranged:
+            writeRanged(request, body)
+        else:
+            request.write(body)
+            request.finish()
 
     ### list items of a collection
 
@@ -235,42 +2693,44 @@ class OpenErpModelResource(Resource):
                             val = v
                         newVals.append(v)
                     params.append((key, 'in', tuple(newVals)))
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'search', params)
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'search', params)
         d.addCallback(self.__handleCollectionAnswer, request, uid, pwd)
         return d
 
     def __handleCollectionAnswer(self, val, request, uid, pwd):
         hello()
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', val, ['name', '__last_update', 'user_id'])
+        d.addCallback(lambda items: self.__offload(len(items), self.__mkFeed, items, str(request.URLPath())))
+        d.addCallback(self.__handleFeed, request)
+        return d
 
-        def createFeed(items, request):
-            # build a feed
-            # TODO: add the feed url; will currently break the test
-            feed = pyatom.AtomFeed(title=self.model + " items",
-                                   id=str(request.URLPath()),
-                                   #feed_url=str(request.URLPath())
-                                   )
-            for item in items:
-                if not item['name']:
-                    item['name'] = "None"
-                if 'user_id' in item and item['user_id']:
-                    feed.add(title=item['name'],
-                                 url="%s/%s" % (request.URLPath(), item['id']),
-                                 updated=localTimeStringToUtcDatetime(item['__last_update']),
-                                 author=[{'name': item['user_id'][1]}])
-                else:
-                    feed.add(title=item['name'],
-                                 url="%s/%s" % (request.URLPath(), item['id']),
-                                 updated=localTimeStringToUtcDatetime(item['__last_update']),
-                                 author=[{'name': 'None'}])
-            request.setHeader("Content-Type", "application/atom+xml; charset=utf-8")
-            request.write(str(feed.to_string().encode('utf-8')))
-            request.finish()
+    def __mkFeed(self, items, path):
+        # build a feed
+        # TODO: add the feed url; will currently break the test
+        feed = pyatom.AtomFeed(title=self.model + " items",
+                               id=path,
+                               #feed_url=path
+                               )
+        updated = localTimes.toRfc3339List([item['__last_update'] for item in items])
+        for item, itemUpdated in zip(items, updated):
+            if not item['name']:
+                item['name'] = "None"
+            if 'user_id' in item and item['user_id']:
+                feed.add(title=item['name'],
+                             url="%s/%s" % (path, item['id']),
+                             updated=itemUpdated,
+                             author=[{'name': item['user_id'][1]}])
+            else:
+                feed.add(title=item['name'],
+                             url="%s/%s" % (path, item['id']),
+                             updated=itemUpdated,
+                             author=[{'name': 'None'}])
+        return str(feed.to_string().encode('utf-8'))
 
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'read', val, ['name', '__last_update', 'user_id'])
-        d.addCallback(createFeed, request)
-        return d
+    def __handleFeed(self, feed, request):
+        hello()
+        request.setHeader("Content-Type", "application/atom+xml; charset=utf-8")
+        self.__writeAndFinish(feed, request)
 
     ### get __last_update of a collection item
 
@@ -281,46 +2741,100 @@ class OpenErpModelResource(Resource):
             modelId = int(modelId)
         except:
             modelId = -1
-        proxy = quietProxy(self.openerpUrl + 'object')
 
         def handleLastItemUpdateAnswer(updateAnswer):
             if not updateAnswer:
                 raise NotFound(str(request.URLPath()))
             return (uid, updateAnswer[0]['__last_update'])
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'read', [modelId], ['__last_update'])
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', [modelId], ['__last_update'])
         d.addCallback(handleLastItemUpdateAnswer)
         return d
 
     ### list the default values for an item
 
-    def __updateDefaults(self, uid, pwd):
+    def __updateDefaults(self, uid, pwd, request):
+        """Make the default values for the user available as
+        `request.defaults`."""
         hello()
-        if not uid in self.defaults:
-            # update type description
-            proxy = quietProxy(self.openerpUrl + 'object')
-            d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'default_get', self.desc.keys(), {})
-            d.addCallback(self.__handleDefaultsAnswer, uid)
-            return d
+        if self.sharedDefaults:
+            d = self.fingerprints.get(self.dbname, uid, pwd)
+        else:
+            d = defer.succeed("u%s" % uid)
+        d.addCallback(self.__updateDefaultsFor, uid, pwd, request)
+        return d
+
+    def __updateDefaultsFor(self, key, uid, pwd, request):
+        if not key in self.defaults:
+            d = self.__fetchDefaults(uid, pwd, key)
         else:
+            self.__revalidate("defaults:%s" % key, lambda uid, pwd: self.__fetchDefaults(uid, pwd, key), uid, pwd)
+            d = defer.succeed(key)
+
+        def use(key):
+            self.defaultsUses += 1
+            self.defaultsUsed[key] = self.defaultsUses
+            request.defaults = self.defaults[key]
             return uid
+        d.addCallback(use)
+        return d
+
+    def __fetchDefaults(self, uid, pwd, key):
+        """Fetch the default values that are kept under `key`; return (a
+        Deferred for) the key under which they are kept in the end."""
+        def fetchIfMissing(val):
+            if val is not None:
+                return self.__keepDefaults(val, key)
+            d = self.backend.callRemote('object', 'execute',
+                self.dbname, uid, pwd, self.model, 'default_get', self.desc.keys(), {})
+            d.addCallback(self.__handleDefaultsAnswer, uid, key)
+            return d
+        d = self.__getSharedMetadata("defaults:%s" % key)
+        d.addCallback(fetchIfMissing)
+        return d
 
-    def __handleDefaultsAnswer(self, val, uid):
+    def __handleDefaultsAnswer(self, val, uid, key):
         hello()
-        log.msg("updating default values (uid=" + str(uid) + ") for " + self.model)
-        self.defaults[uid] = val
-        return uid
+        log.msg("updating default values (" + key + ") for " + self.model)
+        if not key.startswith("u") and self.__isUserSpecific(val, uid):
+            # do not share them with other users from now on
+            log.msg("default values of " + self.model + " are user-specific")
+            self.sharedDefaults = False
+            key = "u%s" % uid
+            for k in self.defaults.keys():
+                if not k.startswith("u"):
+                    del self.defaults[k]
+        # only now it is known for whom they are
+        self.__setSharedMetadata("defaults:%s" % key, val)
+        return self.__keepDefaults(val, key)
+
+    def __keepDefaults(self, val, key):
+        if not key in self.defaults and len(self.defaults) >= self.maxDefaults:
+            leastUsed = min(self.defaults.keys(), key=lambda k: self.defaultsUsed.get(k, 0))
+            del self.defaults[leastUsed]
+            self.defaultsUsed.pop(leastUsed, None)
+            metrics.increment("defaults.evictions")
+        self.defaults[key] = val
+        return key
+
+    def __isUserSpecific(self, val, uid):
+        """Return whether the requesting user is one of the default values."""
+        for name, value in val.items():
+            if self.desc.get(name, {}).get('relation') == 'res.users' and uid in self.__getRelatedIds(value):
+                return True
+        return False
 
     def __getItemDefaults(self, uid, request, pwd):
         hello()
         # set correct headers
         request.setHeader("Content-Type", "application/atom+xml; charset=utf-8")
         # compose answer
-        request.write(self.__mkDefaultXml(str(request.URLPath()), self.desc, self.defaults[uid]))
-        request.finish()
+        plan = self.__getRenderPlan(str(request.URLPath()))
+        d = self.__offload(len(self.desc), self.__mkDefaultXml, plan, request.defaults)
+        d.addCallback(self.__writeAndFinish, request)
+        return d
 
-    def __mkDefaultXml(self, path, desc, item):
-        ns = "".join([word[0] for word in self.model.split('.')])
-        xml = '''<?xml version="1.0" encoding="utf-8"?>
+    def __mkDefaultXml(self, plan, item):
+        xml = ['''<?xml version="1.0" encoding="utf-8"?>
 <entry xmlns="http://www.w3.org/2005/Atom">
     <title type="text">Defaults for %s</title>
     <id>%s</id>
@@ -333,71 +2847,19 @@ class OpenErpModelResource(Resource):
     <%s xmlns:%s="%s">
         <%s:id />
 ''' % (self.model,
-             path + "/defaults",
+             plan.path + "/defaults",
              datetime.datetime.utcnow().isoformat()[:-7] + 'Z',
-             path + "/defaults",
+             plan.path + "/defaults",
              'None',
-             ns + ":" + self.model.replace('.', '_'),
-             ns,
-             '/'.join(path.split("/") + ["schema"]),
-             ns
-             )
-        # loop over the fields of the current object
-        for key in desc.iterkeys():
-            value = key in item and item[key] or ""
-            # key is the name of the field, value is the content,
-            #  e.g. key="email", value="me@privacy.net"
-            fieldtype = desc[key]['type']
-            # if we have an empty field, we display a closed tag
-            #  (except if this is a boolean field)
-            if not value and fieldtype in ('many2one', 'one2many', 'many2many'):
-                xml += ("    <%s type='%s' relation='%s' />\n" % (
-                    ns + ":" + key,
-                    fieldtype,
-                    '/'.join(path.split("/")[:-1] + [self.desc[key]["relation"]]))
-                )
-            elif not value and fieldtype != "boolean":
-                xml += ("    <%s type='%s' />\n" % (
-                    ns + ":" + key,
-                    fieldtype)
-                )
-            # display URIs for many2one fields
-            elif fieldtype == 'many2one':
-                xml += ("    <%s type='%s' relation='%s'>\n      <link href='%s' />\n    </%s>\n" % (
-                    ns + ":" + key,
-                    fieldtype,
-                    '/'.join(path.split("/")[:-1] + [self.desc[key]["relation"]]),
-                    '/'.join(path.split("/")[:-1] + [self.desc[key]["relation"], str(value)]),
-                    ns + ":" + key)
-                )
-            # display URIs for *2many fields, wrapped by <item>
-            elif fieldtype in ('one2many', 'many2many'):
-                xml += ("    <%s type='%s' relation='%s'>%s</%s>\n" % (
-                    ns + ":" + key,
-                    fieldtype,
-                    '/'.join(path.split("/")[:-1] + [self.desc[key]["relation"]]),
-                    ''.join(
-                        ['\n      <link href="' + '/'.join(path.split("/")[:-1] + [desc[key]["relation"], str(v)]) + '" />' for v in value]
-                    ) + '\n    ',
-                    ns + ":" + key)
-                )
-            # for other fields, just output the data
-            elif fieldtype == 'boolean':
-                xml += ("    <%s type='%s'>%s</%s>\n" % (
-                    ns + ":" + key,
-                    fieldtype,
-                    xmlescape(str(value and "True" or "False")),
-                    ns + ":" + key)
-                )
-            else:
-                xml += ("    <%s type='%s'>%s</%s>\n" % (
-                    ns + ":" + key,
-                    fieldtype,
-                    xmlescape(str(value)),
-                    ns + ":" + key)
-                )
-        xml += ("  </%s>\n  </content>\n</entry>" % (ns + ":" + self.model.replace('.', '_')))
-        return xml
+             plan.rootTag,
+             plan.ns,
+             plan.schema,
+             plan.ns
+             )]
+        # the fields of the current object
+        xml.append(plan.renderDefaultFields(item))
+        xml.append("  </%s>\n  </content>\n</entry>" % plan.rootTag)
+        return ''.join(xml)
 
     ### list one particular item of a collection
 
@@ -422,14 +2884,13 @@ class OpenErpModelResource(Resource):
             modelId = -1
         # we add 'context' parameters, like 'lang' or 'tz'
         params = self.getParamsFromRequest(request)
-        # issue the request
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'read', [modelId], [], params)
+        # issue the request (without the contents of binary fields)
+        fields = self.__getRenderPlan(str(request.URLPath())).readFields
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', [modelId], fields, params)
         d.addCallback(self.__handleItemAnswer, request, localTimeStringToUtcDatetime(updateTime))
         return d
 
-    def __mkItemXml(self, ns, schema, basePath, path, lastModified, item):
-        result = ""
+    def __mkItemXml(self, plan, path, lastModified, item, workflowDesc):
         xmlHead = u'''<?xml version="1.0" encoding="utf-8"?>
 <entry xmlns="http://www.w3.org/2005/Atom">
     <title type="text">%s</title>
@@ -446,71 +2907,18 @@ class OpenErpModelResource(Resource):
              lastModified.isoformat()[:-13] + 'Z',
              path,
              'None',  # TODO: insert author, if present
-             ns + ":" + self.model.replace('.', '_'),
-             ns,
-             schema,
+             plan.rootTag,
+             plan.ns,
+             plan.schema,
              )
-        result += xmlHead.encode('utf-8')
-        # loop over the fields of the current object
-        for key, value in item.iteritems():
-            # key is the name of the field, value is the content,
-            #  e.g. key="email", value="me@privacy.net"
-            if key in self.desc:
-                fieldtype = self.desc[key]['type']
-                # if we have an empty field, we display a closed tag
-                #  (except if this is a boolean field)
-                if not value and fieldtype in ('many2one', 'one2many', 'many2many'):
-                    result += "    <%s type='%s' relation='%s'><!-- %s --></%s>\n" % (
-                        ns + ":" + key,
-                        fieldtype,
-                        '/'.join(basePath.split("/")[:-1] + [self.desc[key]["relation"]]),
-                        value,
-                        ns + ":" + key)
-                elif not value and fieldtype != "boolean":
-                    result += "    <%s type='%s'><!-- %s --></%s>\n" % (
-                        ns + ":" + key,
-                        fieldtype,
-                        value,
-                        ns + ":" + key)
-                # display URIs for many2one fields
-                elif fieldtype == 'many2one':
-                    result += "    <%s type='%s' relation='%s'>\n      <link href='%s' />\n    </%s>\n" % (
-                        ns + ":" + key,
-                        fieldtype,
-                        '/'.join(basePath.split("/")[:-1] + [self.desc[key]["relation"]]),
-                        '/'.join(basePath.split("/")[:-1] + [self.desc[key]["relation"], str(value[0])]),
-                        ns + ":" + key)
-                # display URIs for *2many fields, wrapped by <item>
-                elif fieldtype in ('one2many', 'many2many'):
-                    result += "    <%s type='%s' relation='%s'>%s</%s>\n" % (
-                        ns + ":" + key,
-                        fieldtype,
-                        '/'.join(basePath.split("/")[:-1] + [self.desc[key]["relation"]]),
-                        ''.join(
-                            ['\n      <link href="' + '/'.join(basePath.split("/")[:-1] + [self.desc[key]["relation"], str(v)]) + '" />' for v in value]
-                        ) + '\n    ',
-                        ns + ":" + key)
-                # for other fields, just output the data
-                else:
-                    result += "    <%s type='%s'>%s</%s>\n" % (
-                        ns + ":" + key,
-                        fieldtype,
-                        xmlescape(unicode(value).encode('utf-8')),
-                        ns + ":" + key)
-            else:  # no type given or no self.desc present
-                result += "    <%s>%s</%s>\n" % (
-                    ns + ":" + key,
-                    xmlescape(unicode(value).encode('utf-8')),
-                    ns + ":" + key)
-        result += "  </%s>\n" % (ns + ":" + self.model.replace('.', '_'))
-        for button in self.workflowDesc:
-            if "name" in button.attrib and \
-                    (not "state" in item or not "states" in button.attrib or item["state"] in button.attrib['states'].split(",")) \
-                    and not self.__is_number(button.attrib["name"]):
-                result += "  <link rel='%s' href='%s' title='%s' />\n" % \
-                    (button.attrib['name'], path + "/" + button.attrib['name'], button.attrib['string'])
-        result += "  </content>\n</entry>"
-        return result
+        result = [xmlHead.encode('utf-8')]
+        # the fields of the current object
+        result.append(plan.renderItemFields(item, path))
+        result.append("  </%s>\n" % plan.rootTag)
+        for name, button, linkStart, linkEnd in workflowDesc.getActions(item):
+            result.extend((linkStart, path, linkEnd))
+        result.append("  </content>\n</entry>")
+        return ''.join(result)
 
     def __handleItemAnswer(self, val, request, lastModified):
         hello()
@@ -527,12 +2935,12 @@ class OpenErpModelResource(Resource):
         request.setHeader("Last-Modified", httpdate(lastModified))
         request.setHeader("Content-Type", "application/atom+xml; charset=utf-8")
         # compose answer
-        ns = "".join([word[0] for word in self.model.split('.')])
         basepath = str(request.URLPath())
         path = basepath + "/" + str(item['id'])
-        s = self.__mkItemXml(ns, basepath + "/schema", basepath, path, lastModified, item)
-        request.write(s)
-        request.finish()
+        d = self.__offload(len(item), self.__mkItemXml, self.__getRenderPlan(basepath), path, lastModified, item,
+            self.workflowDesc)
+        d.addCallback(self.__writeAndFinish, request)
+        return d
 
     def __is_number(self, n):
         try:
@@ -541,6 +2949,82 @@ class OpenErpModelResource(Resource):
         except:
             return False
 
+    ### get the contents of a binary field
+
+    def __getBinaryField(self, uid, request, pwd, modelId, field):
+        hello()
+        if not self.__is_number(modelId) or not field in self.desc or self.desc[field]['type'] != 'binary':
+            raise NoChildResources("/" + '/'.join([self.dbname, self.model, modelId]))
+        params = self.getParamsFromRequest(request)
+        if "w" in params:
+            del params["w"]
+            return self.__getThumbnail(uid, request, pwd, int(modelId), field, params)
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', [int(modelId)],
+            [field, '__last_update'], params)
+        d.addCallback(self.__handleBinaryFieldAnswer, request, field)
+        return d
+
+    def __handleBinaryFieldAnswer(self, val, request, field):
+        hello()
+        if not val or not val[0][field]:
+            raise NotFound(request.uri)
+        data = base64.b64decode(val[0][field])
+        self.__writeBinary(data, request, val[0]['__last_update'])
+
+    def __writeBinary(self, data, request, lastUpdate):
+        request.setHeader("Last-Modified", httpdate(localTimeStringToUtcDatetime(lastUpdate)))
+        request.setHeader("Content-Type", guessContentType(data))
+        request.setHeader("ETag", '"%s"' % hashlib.sha1(data).hexdigest())
+        request.setHeader("Accept-Ranges", "bytes")
+        self.__writeAndFinish(data, request, True)
+
+    def __getThumbnail(self, uid, request, pwd, modelId, field, params):
+        """Serve the image in `field` scaled down to the width given as `w`,
+        from the `ThumbnailCache` if it has been made before."""
+        hello()
+        try:
+            width = int(request.args["w"][0])
+        except ValueError:
+            width = None
+        if not width in self.thumbnails.sizes:
+            raise InvalidParameter("w must be one of %s" % ", ".join([str(w) for w in self.thumbnails.sizes]))
+        if not self.thumbnails.isAvailable():
+            raise ThumbnailsNotAvailable()
+        # the thumbnail is made again when the item has changed
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', [modelId],
+            ['__last_update'])
+
+        def lookup(val):
+            if not val:
+                raise NotFound(request.uri)
+            key = self.thumbnails.getKey(self.dbname, self.model, modelId, field, val[0]['__last_update'], width)
+            d = threads.deferToThread(self.thumbnails.get, key)
+            d.addCallback(make, key)
+            d.addCallback(self.__writeBinary, request, val[0]['__last_update'])
+            return d
+
+        def make(thumbnail, key):
+            if thumbnail is not None:
+                metrics.increment("thumbnails.cached")
+                return thumbnail
+            d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', [modelId],
+                [field], params)
+            d.addCallback(scale, key)
+            return d
+
+        def scale(val, key):
+            if not val or not val[0][field]:
+                raise NotFound(request.uri)
+            d = threads.deferToThread(self.thumbnails.make, key, base64.b64decode(val[0][field]), width)
+            d.addErrback(notAnImage)
+            return d
+
+        def notAnImage(err):
+            err.trap(IOError)
+            raise InvalidParameter("%s is not an image" % request.uri.split("?")[0])
+        d.addCallback(lookup)
+        return d
+
     ### handle inserts into collection
 
     def __addToCollection(self, uid, request, pwd):
@@ -549,34 +3033,51 @@ class OpenErpModelResource(Resource):
         hello()
         if not self.desc:
             raise xmlrpclib.Fault("warning -- Object Error", "no such collection")
-        # check whether we got well-formed XML
-        parser = etree.XMLParser(remove_comments=True)
-        try:
-            doc = etree.fromstring(request.content.read(), parser=parser)
-        except Exception as e:
-            request.setResponseCode(400)
-            request.write("malformed XML: " + str(e))
-            request.finish()
-            return
-        # check whether we got valid XML with the given schema
+        # check whether we got well-formed XML; we parse the body
+        #  incrementally and look at the root element first
+        events = self.__parseBody(request)
+        event, root = events.next()
+        # prepare the schema and the default values for this model
         ns = str(request.URLPath()) + "/schema"
-        schemaxml = self.__desc2relaxNG(str(request.URLPath()), self.desc)
-        schema = etree.fromstring(schemaxml)
+        d = self.__offload(len(self.desc), self.__prepareValidation, self.__getRenderPlan(str(request.URLPath())),
+            request.defaults)
+        # if we got an Atom feed, we create one item per entry
+        if root.tag == "{http://www.w3.org/2005/Atom}feed":
+            d.addCallback(lambda (relaxng, defaultDoc):
+                self.__addEntriesToCollection(events, root, uid, request, pwd, relaxng, defaultDoc))
+            return d
+        for event, elem in events:
+            pass
+        d.addCallback(lambda (relaxng, defaultDoc):
+            self.__offload(len(root), self.__collectNewFields, root, ns, relaxng, defaultDoc))
+
+        # compose the XML-RPC call from them
+        def create(fields):
+            d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'create', fields)
+            d.addCallback(self.__handleAddCollectionAnswer, request, fields)
+            return d
+        d.addCallback(create)
+        return d
+
+    def __prepareValidation(self, plan, defaults):
+        """Return the RelaxNG validator for new items and the description
+        of an item with default values."""
+        schema = etree.fromstring(plan.getRelaxNG())
         relaxng = etree.RelaxNG(schema)
+        defaultDocRoot = etree.fromstring(self.__mkDefaultXml(plan, defaults), parser=getXmlParser())
+        defaultDoc = defaultDocRoot.find("{http://www.w3.org/2005/Atom}content").find("{%s}%s" % (plan.schema, self.model.replace(".", "_")))
+        return (relaxng, defaultDoc)
+
+    def __collectNewFields(self, doc, ns, relaxng, defaultDoc):
+        """Validate the description `doc` of a new item and return all
+        fields with non-default values."""
         # to validate doc, we need to set "id" to a numeric value
         try:
             doc.find("{%s}id" % ns).text = "-1"
         except:
             pass
         if not relaxng.validate(doc):
-            request.setResponseCode(400)
-            err = relaxng.error_log
-            request.write("invalid XML:\n" + str(err))
-            request.finish()
-            return
-        # get default values for this model
-        defaultDocRoot = etree.fromstring(self.__mkDefaultXml(str(request.URLPath()), self.desc, self.defaults[uid]), parser=parser)
-        defaultDoc = defaultDocRoot.find("{http://www.w3.org/2005/Atom}content").find("{%s}%s" % (ns, self.model.replace(".", "_")))
+            raise InvalidXml(relaxng.error_log)
         stripNsRe = re.compile(r'^{%s}(.+)$' % ns)
         whitespaceRe = re.compile(r'\s+')
         # collect all fields with non-default values
@@ -598,6 +3099,10 @@ class OpenErpModelResource(Resource):
                 fields[tagname] = int(c.text)
             elif c.attrib["type"] == "boolean":
                 fields[tagname] = (c.text == "True")
+            elif c.attrib["type"] == "binary":
+                # new contents in base64
+                if c.text and c.text.strip():
+                    fields[tagname] = c.text.strip()
             elif c.attrib["type"] == "many2one":
                 assert c.attrib['relation'] == defaultDoc.find(c.tag).attrib['relation']
                 uris = [link.attrib['href'] for link in c.getchildren()]
@@ -613,14 +3118,78 @@ class OpenErpModelResource(Resource):
             else:
                 # TODO: date, many2one (we can't really set many2many and one2many here, can we?)
                 raise NotImplementedError("don't know how to handle element " + c.tag + " of type " + c.attrib["type"])
-        # compose the XML-RPC call from them
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'create', fields)
-        d.addCallback(self.__handleAddCollectionAnswer, request)
-        return d
+        return fields
+
+    def __addEntriesToCollection(self, events, feed, uid, request, pwd, relaxng, defaultDoc):
+        """Create one item per entry of the Atom feed in the request body.
+        The entries are parsed and created one after the other, and each
+        entry is dropped from the tree once it has been processed, so
+        that memory usage stays flat for large feeds."""
+        hello()
+        basepath = str(request.URLPath())
+        ns = basepath + "/schema"
+        entryTag = "{http://www.w3.org/2005/Atom}entry"
+        itemPath = "{http://www.w3.org/2005/Atom}content/{%s}%s" % (ns, self.model.replace(".", "_"))
+        results = []
+        # the create call in progress, and whether the client has gone
+        current = [None]
+        cancelled = []
+
+        def cancel(_):
+            cancelled.append(True)
+            if current[0] is not None:
+                current[0].cancel()
+        done = defer.Deferred(cancel)
+
+        def created(objectId, fields):
+            self.__invalidate([objectId], fields)
+            results.append((basepath + "/" + str(objectId), 201, ""))
+
+        def createNext(_=None):
+            if cancelled:
+                return
+            try:
+                for event, elem in events:
+                    if event != "end" or elem.tag != entryTag or elem.getparent() is not feed:
+                        continue
+                    # we have got a complete entry
+                    try:
+                        doc = elem.find(itemPath)
+                        if doc is None:
+                            raise InvalidXml("entry %d contains no %s" % (len(results) + 1, self.model))
+                        fields = self.__collectNewFields(doc, ns, relaxng, defaultDoc)
+                    except (InvalidXml, NotImplementedError):
+                        fields = None
+                        results.append((None,) + self.__describeError(failure.Failure()))
+                    # drop this entry and all entries before it
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del feed[0]
+                    if fields is not None:
+                        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'create', fields)
+                        current[0] = d
+                        d.addCallbacks(created, lambda err: results.append((None,) + self.__describeError(err)),
+                            callbackArgs=(fields,))
+                        d.addCallback(createNext)
+                        d.addErrback(done.errback)
+                        return
+            except MalformedXml as e:
+                results.append((None, e.code, str(e)))
+            done.callback(results)
+
+        createNext()
+        done.addCallback(self.__handleAddEntriesAnswer, request)
+        return done
+
+    def __handleAddEntriesAnswer(self, results, request):
+        hello()
+        request.setHeader("Content-Type", "application/xml; charset=utf-8")
+        request.write(self.__mkResultsXml('<results>', '</results>', results))
+        request.finish()
 
-    def __handleAddCollectionAnswer(self, object_id, request):
+    def __handleAddCollectionAnswer(self, object_id, request, fields):
         hello()
+        self.__invalidate([object_id], fields)
         loc = str(request.URLPath()) + "/" + str(object_id)
         request.setResponseCode(201)
         request.setHeader("Location", loc)
@@ -632,8 +3201,7 @@ class OpenErpModelResource(Resource):
         hello()
         modelId = int(modelId)
         # first, get information about the item
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'read', [modelId], [])
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', [modelId], [])
         d.addCallback(self.__executeWorkflow, uid, request, pwd, modelId, workflow)
         return d
 
@@ -648,13 +3216,8 @@ class OpenErpModelResource(Resource):
             request.finish()
             return
         # also, the given workflow should be valid for the current state
-        for button in self.workflowDesc:
-            if "name" in button.attrib and \
-                    (not "state" in item or item["state"] in button.attrib['states'].split(",")) \
-                    and not self.__is_number(button.attrib["name"]) and workflow == button.attrib['name']:
-                currentAction = button
-                break
-        else:
+        currentAction = self.__findWorkflowButton(item, workflow)
+        if currentAction is None:
             request.setResponseCode(400)
             request.write("Workflow '%s' not allowed in state '%s'." %
                 (workflow, ("state" in item and item["state"]) or ''))
@@ -665,29 +3228,137 @@ class OpenErpModelResource(Resource):
             # get a URL from the POST body and extract model and id
             myPath = str(request.URLPath())
             objRe = re.compile(myPath[:myPath.find(self.model)] + r'(.+)/([0-9]+)$')
-            body = request.content.read()
+            body = self.__readBody(request)
             match = objRe.match(body)
             if not match:
                 raise NotImplementedError("don't know how to handle input '%s' for workflow '%s'" % (body, workflow))
             # set parameters fro request
             params = {"active_model": match.group(1), "active_id": int(match.group(2)), "active_ids": [int(match.group(2))]}
-            proxy = quietProxy(self.openerpUrl + 'object')
-            d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, workflow, [modelId], params)
-            d.addCallback(self.__handleWorkflowAnswer, request, modelId, workflow)
+            d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, workflow, [modelId], params)
+            d.addCallback(self.__handleWorkflowAnswer, request, modelId, workflow,
+                [(params["active_model"], params["active_id"])])
             return d
         elif "type" in currentAction.attrib:
             raise NotImplementedError("don't know how to handle workflow '%s'" % workflow)
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('exec_workflow', self.dbname, uid, pwd, self.model, workflow, modelId)
+        d = self.backend.callRemote('object', 'exec_workflow', self.dbname, uid, pwd, self.model, workflow, modelId)
         d.addCallback(self.__handleWorkflowAnswer, request, modelId, workflow)
         return d
 
-    def __handleWorkflowAnswer(self, result, request, modelId, workflow):
+    def __handleWorkflowAnswer(self, result, request, modelId, workflow, related=()):
+        self.__invalidate([modelId], related=related)
         request.setResponseCode(204)
         loc = str(request.URLPath()) + "/" + str(modelId)
         request.setHeader("Location", loc)
         request.finish()
 
+    def __findWorkflowButton(self, item, workflow):
+        """Return the button that triggers `workflow` if it is allowed
+        in the current state of `item`, None otherwise."""
+        return self.workflowDesc.findAction(item, workflow)
+
+    ### handle workflows on many items at once
+
+    def __prepareBatchWorkflow(self, uid, request, pwd, workflow):
+        """This is called after successful login to send the same
+        workflow signal to a list of items given in the request body,
+        either as ids or as URIs."""
+        hello()
+        # only plain workflow signals can be sent to many items at once
+        buttons = [b for b in self.workflowDesc if b.attrib.get('name') == workflow]
+        if not buttons:
+            raise InvalidParameter("workflow '%s' not present in model '%s'" % (workflow, self.model))
+        elif [b for b in buttons if "type" in b.attrib]:
+            raise InvalidParameter("workflow '%s' cannot be executed on several items at once" % workflow)
+        # collect the ids of all items
+        basepath = str(request.URLPath())
+        itemRe = re.compile(r'^(?:%s/)?([0-9]+)$' % re.escape(basepath))
+        modelIds = []
+        for ref in self.__readBody(request).split():
+            match = itemRe.match(ref)
+            if not match:
+                raise InvalidParameter("'%s' is not an item of '%s'" % (ref, basepath))
+            modelId = int(match.group(1))
+            if not modelId in modelIds:
+                modelIds.append(modelId)
+        if not modelIds:
+            raise InvalidParameter("no items given for workflow '%s'" % workflow)
+        # the state is all we need to know about the items
+        fields = 'state' in self.desc and ['state'] or ['__last_update']
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', modelIds, fields)
+        d.addCallback(self.__executeBatchWorkflow, uid, request, pwd, modelIds, workflow)
+        return d
+
+    def __executeBatchWorkflow(self, val, uid, request, pwd, modelIds, workflow):
+        hello()
+        items = dict((item['id'], item) for item in val)
+        semaphore = defer.DeferredSemaphore(self.workflowConcurrency)
+        # set when the client has gone or the deadline has passed, so
+        #  that no more queued signals are sent
+        cancelled = []
+
+        def send(modelId):
+            if cancelled:
+                return defer.fail(defer.CancelledError())
+            return self.backend.callRemote('object', 'exec_workflow', self.dbname, uid, pwd, self.model, workflow, modelId)
+
+        def execute(modelId):
+            # check whether the workflow is allowed for this item
+            href = str(request.URLPath()) + "/" + str(modelId)
+            if not modelId in items:
+                return defer.succeed((href, 404, "No such resource."))
+            item = items[modelId]
+            if self.__findWorkflowButton(item, workflow) is None:
+                return defer.succeed((href, 400, "Workflow '%s' not allowed in state '%s'." %
+                    (workflow, ("state" in item and item["state"]) or '')))
+            d = semaphore.run(send, modelId)
+            d.addCallback(executed, href, modelId)
+            d.addErrback(describe, href)
+            return d
+
+        def executed(_, href, modelId):
+            self.__invalidate([modelId])
+            return (href, 204, "")
+
+        def describe(err, href):
+            # a cancelled call is not a result, it stops the whole batch
+            if err.check(defer.CancelledError):
+                return err
+            return (href,) + self.__describeError(err)
+
+        results = defer.gatherResults([execute(modelId) for modelId in modelIds], consumeErrors=True)
+
+        def cancel(_):
+            cancelled.append(True)
+            results.cancel()
+        d = defer.Deferred(cancel)
+
+        def forward(result):
+            # once cancelled, `d` fails with CancelledError on its own
+            if not cancelled:
+                d.callback(result)
+        results.addBoth(forward)
+        d.addCallback(self.__handleBatchWorkflowAnswer, request, workflow)
+        return d
+
+    def __handleBatchWorkflowAnswer(self, results, request, workflow):
+        hello()
+        request.setHeader("Content-Type", "application/xml; charset=utf-8")
+        request.write(self.__mkResultsXml('<workflow name="%s">' % xmlescape(workflow), '</workflow>', results))
+        request.finish()
+
+    def __mkResultsXml(self, startTag, endTag, results):
+        """Return an XML document listing the outcome of an operation on
+        many items, given as a list of (URI, status code, message)."""
+        xml = ['<?xml version="1.0" encoding="utf-8"?>\n', startTag, '\n']
+        for href, code, message in results:
+            href = href and " href='%s'" % href or ""
+            if message:
+                xml.append("  <result%s status='%s'>%s</result>\n" % (href, code, xmlescape(message)))
+            else:
+                xml.append("  <result%s status='%s' />\n" % (href, code))
+        xml.append(endTag)
+        return ''.join(xml)
+
     ### handle updates
 
     def __getItemForUpdate(self, (uid, updateTime), request, pwd, modelId):
@@ -699,9 +3370,9 @@ class OpenErpModelResource(Resource):
             modelId = -1
         # we add 'context' parameters, like 'lang' or 'tz'
         params = self.getParamsFromRequest(request)
-        # issue the request
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'read', [modelId], [], params)
+        # issue the request (without the contents of binary fields)
+        fields = self.__getRenderPlan(str(request.URLPath())).readFields
+        d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'read', [modelId], fields, params)
         d.addCallback(self.__updateItem, uid, pwd, request, localTimeStringToUtcDatetime(updateTime))
         return d
 
@@ -712,32 +3383,36 @@ class OpenErpModelResource(Resource):
         if not self.desc:
             raise xmlrpclib.Fault("warning -- Object Error", "no such collection")
         # check whether we got well-formed XML
-        parser = etree.XMLParser(remove_comments=True)
-        try:
-            doc = etree.fromstring(request.content.read(), parser=parser)
-        except Exception as e:
-            request.setResponseCode(400)
-            request.write("malformed XML: " + str(e))
-            request.finish()
-            return
+        events = self.__parseBody(request)
+        event, doc = events.next()
+        for event, elem in events:
+            pass
+        # validate the object and compare it to the old values
+        d = self.__offload(len(self.desc), self.__collectChangedFields, doc, old[0],
+            self.__getRenderPlan(str(request.URLPath())), lastModified, self.workflowDesc)
+
+        # compose the XML-RPC call from them
+        def write(fields):
+            d = self.backend.callRemote('object', 'execute', self.dbname, uid, pwd, self.model, 'write', [old[0]['id']], fields)
+            d.addCallback(self.__handleUpdateItemAnswer, request, old[0], fields)
+            return d
+        d.addCallback(write)
+        return d
+
+    def __collectChangedFields(self, doc, old, plan, lastModified, workflowDesc):
+        """Validate the new description `doc` of the item `old` and
+        return all fields with changed values."""
         # check whether we got valid XML with the given schema
-        ns = str(request.URLPath()) + "/schema"
-        schemaxml = self.__desc2relaxNG(str(request.URLPath()), self.desc)
-        schema = etree.fromstring(schemaxml)
+        ns = plan.schema
+        schema = etree.fromstring(plan.getRelaxNG())
         relaxng = etree.RelaxNG(schema)
         # try to validate object
         if not relaxng.validate(doc):
-            request.setResponseCode(400)
-            err = relaxng.error_log
-            request.write("invalid XML:\n" + str(err))
-            request.finish()
-            return
+            raise InvalidXml(relaxng.error_log)
         # compose old values for this object
-        xmlns = "".join([word[0] for word in self.model.split('.')])
-        basepath = str(request.URLPath())
-        path = basepath + "/" + str(old[0]['id'])
-        s = self.__mkItemXml(xmlns, basepath + "/schema", basepath, path, lastModified, old[0])
-        oldDocRoot = etree.fromstring(s, parser=parser)
+        path = plan.path + "/" + str(old['id'])
+        s = self.__mkItemXml(plan, path, lastModified, old, workflowDesc)
+        oldDocRoot = etree.fromstring(s, parser=getXmlParser())
         oldDoc = oldDocRoot.find("{http://www.w3.org/2005/Atom}content").find("{%s}%s" % (ns, self.model.replace(".", "_")))
         stripNsRe = re.compile(r'^{%s}(.+)$' % ns)
         whitespaceRe = re.compile(r'\s+')
@@ -771,6 +3446,11 @@ class OpenErpModelResource(Resource):
                 fields[tagname] = int(c.text)
             elif c.attrib["type"] == "boolean":
                 fields[tagname] = (c.text == "True")
+            elif c.attrib["type"] == "binary":
+                # the link to the current contents is left alone, new
+                #  contents come in base64, and an empty element clears it
+                if not len(c):
+                    fields[tagname] = c.text and c.text.strip() or False
             elif c.attrib["type"] == "many2one":
                 assert c.attrib['relation'] == oldDoc.find(c.tag).attrib['relation']
                 oldUris = [link.attrib['href'] for link in oldDoc.find(c.tag).getchildren()]
@@ -788,17 +3468,31 @@ class OpenErpModelResource(Resource):
             else:
                 # TODO: date
                 raise NotImplementedError("don't know how to handle element " + c.tag + " of type " + c.attrib["type"])
-        # compose the XML-RPC call from them
-        proxy = quietProxy(self.openerpUrl + 'object')
-        d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'write', [old[0]['id']], fields)
-        d.addCallback(self.__handleUpdateItemAnswer, request)
-        return d
+        return fields
 
-    def __handleUpdateItemAnswer(self, object_id, request):
+    def __handleUpdateItemAnswer(self, result, request, old, fields):
         hello()
+        self.__invalidate([old['id']], fields, old)
         request.setResponseCode(204)
         request.finish()
 
+    ### read request bodies
+
+    def __readBody(self, request):
+        """Return the (small) body of the request as a string."""
+        checkBodySize(request, self.maxBodySize)
+        return request.content.read()
+
+    def __parseBody(self, request):
+        """Parse the body of the request incrementally and generate
+        ("start", element) and ("end", element) events."""
+        checkBodySize(request, self.maxBodySize)
+        try:
+            for event, elem in etree.iterparse(request.content, events=("start", "end"), remove_comments=True):
+                yield event, elem
+        except etree.XMLSyntaxError as e:
+            raise MalformedXml(e)
+
     ### handle login
 
     def __handleLoginAnswer(self, uid):
@@ -814,20 +3508,27 @@ class OpenErpModelResource(Resource):
         hello()
         if not self.desc:
             # update type description
-            proxy = quietProxy(self.openerpUrl + 'object')
-            d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'fields_get', [])
-            d.addCallback(self.__handleTypedescAnswer, uid)
+            d = self.__fetchTypedesc(uid, pwd)
             d.addErrback(self.__handleTypedescError, uid)
             return d
         else:
+            self.__revalidate("fields", self.__fetchTypedesc, uid, pwd)
             return uid
 
+    def __fetchTypedesc(self, uid, pwd):
+        d = self.__getMetadata("fields", lambda: self.backend.callRemote('object', 'execute',
+            self.dbname, uid, pwd, self.model, 'fields_get', []))
+        d.addCallback(self.__handleTypedescAnswer, uid)
+        return d
+
     def __handleTypedescAnswer(self, val, uid):
         hello()
         log.msg("updating schema for " + self.model)
         if "id" in val:
             del val["id"]
-        self.desc = val
+        self.desc = descriptions.getDescription(val)
+        self.descFetchedAt = time.time()
+        self.metadataScheduler.schedule(self)
         return uid
 
     def __handleTypedescError(self, err, uid):
@@ -839,18 +3540,24 @@ class OpenErpModelResource(Resource):
         hello()
         if not self.workflowDesc:
             # update type description
-            proxy = quietProxy(self.openerpUrl + 'object')
-            d = proxy.callRemote('execute', self.dbname, uid, pwd, self.model, 'fields_view_get', [])
-            d.addCallback(self.__handleWorkflowDescAnswer, uid)
+            d = self.__fetchWorkflowDesc(uid, pwd)
             d.addErrback(self.__handleWorkflowDescError, uid)
             return d
         else:
+            self.__revalidate("arch", self.__fetchWorkflowDesc, uid, pwd)
             return uid
 
-    def __handleWorkflowDescAnswer(self, val, uid):
+    def __fetchWorkflowDesc(self, uid, pwd):
+        d = self.__getMetadata("arch", lambda: self.backend.callRemote('object', 'execute',
+            self.dbname, uid, pwd, self.model, 'fields_view_get', []).addCallback(lambda val: val['arch']))
+        d.addCallback(self.__handleWorkflowDescAnswer, uid)
+        return d
+
+    def __handleWorkflowDescAnswer(self, arch, uid):
         hello()
         log.msg("updating workflow description for " + self.model)
-        self.workflowDesc = etree.fromstring(val['arch']).findall(".//button")
+        self.workflowArch = arch
+        self.workflowDesc = descriptions.getButtons(arch)
         return uid
 
     def __handleWorkflowDescError(self, err, uid):
@@ -858,45 +3565,80 @@ class OpenErpModelResource(Resource):
         # if an error appears while updating the type description
         return uid
 
-    def __desc2relaxNG(self, path, desc):
-        ns = path + "/schema"
-        xml = '''<?xml version="1.0" encoding="utf-8"?>
-<element name="%s" xmlns="http://relaxng.org/ns/structure/1.0" datatypeLibrary="http://www.w3.org/2001/XMLSchema-datatypes" ns="%s">
-<interleave>
-    <element name="id"><data type="decimal" /></element>
-''' % (self.model.replace(".", "_"), ns)
-        for key, val in desc.iteritems():
-            fieldtype = val['type']
-            required = "required" in val and val['required'] or False
-            xml += ('  <element name="%s">\n    <attribute name="type" />' % key)
-            if fieldtype in ('many2one', 'many2many', 'one2many'):
-                xml += '\n    <attribute name="relation" />'
-            if fieldtype in ('many2many', 'one2many'):
-                elemName = required and "oneOrMore" or "zeroOrMore"
-                xml += ('\n    <%s><element name="link" ns="http://www.w3.org/2005/Atom"><attribute name="href" /></element></%s>\n  ' % (elemName, elemName))
-            else:
-                output = "\n    "
-                # select the correct field type
-                if fieldtype == "many2one":
-                    s = '<element name="link" ns="http://www.w3.org/2005/Atom"><attribute name="href" /></element>'
-                    output += required and s or "<optional>" + s + "</optional>"
-                elif fieldtype == "float":
-                    s = '<data type="double" />'
-                    output += required and s or "<optional>" + s + "</optional>"
-                elif fieldtype == "boolean":
-                    s = '<choice><value>True</value><value>False</value></choice>'
-                    output += required and s or "<optional>" + s + "</optional>"
-                elif fieldtype == "integer":
-                    s = '<data type="decimal" />'
-                    output += required and s or "<optional>" + s + "</optional>"
-                else:
-                    s = required and '<data type="string"><param name="minLength">1</param></data>' or \
-                        "<optional><text /></optional>"
-                    output += s
-                xml += (output + '\n  ')
-            xml += '</element>\n'
-        xml += '</interleave>\n</element>'
-        return xml
+    def __getMetadata(self, name, fetch):
+        """Return (a Deferred for) the value of `fetch()`, which asks
+        OpenERP for some metadata of the model, unless another process
+        has already put it into the shared cache store."""
+        def store(value):
+            self.__setSharedMetadata(name, value)
+            return value
+
+        def fetchIfMissing(value):
+            if value is not None:
+                return value
+            return fetch().addCallback(store)
+        d = self.__getSharedMetadata(name)
+        d.addCallback(fetchIfMissing)
+        return d
+
+    def __getSharedMetadata(self, name):
+        """Return (a Deferred for) the metadata `name` from the shared
+        cache store, or None."""
+        if not (self.cacheStore and self.cacheStore.shared):
+            return defer.succeed(None)
+        d = self.cacheStore.get("meta:%s/%s:%s" % (self.dbname, self.model, name))
+
+        def count(value):
+            if value is not None:
+                metrics.increment("metadata.shared")
+            return value
+        d.addCallback(count)
+        return d
+
+    def __setSharedMetadata(self, name, value):
+        if self.cacheStore and self.cacheStore.shared:
+            self.cacheStore.set("meta:%s/%s:%s" % (self.dbname, self.model, name), value,
+                self.metadataScheduler.ttl)
+
+    def __revalidate(self, name, fetch, uid, pwd):
+        """Call `fetch(uid, pwd)` in the background if the metadata `name`
+        has been loaded from a snapshot and not been fetched since."""
+        if not name in self.unvalidated:
+            return
+        self.unvalidated.discard(name)
+
+        def failed(err):
+            log.msg("revalidating %s of %s failed: %s" % (name, self.model, err.getErrorMessage()))
+            self.unvalidated.add(name)
+        fetch(uid, pwd).addErrback(failed)
+
+    def getMetadata(self):
+        """Return the cached metadata for a `MetadataSnapshot`, or None.
+        The snapshot is written in a thread, so this returns copies that
+        requests cannot change in the meantime."""
+        if not self.desc:
+            return None
+        return {"fetched": self.descFetchedAt,
+                "fields": dict(self.desc),
+                "arch": self.workflowArch,
+                "defaults": dict([(key, dict(values)) for key, values in self.defaults.items()])}
+
+    def setMetadata(self, metadata):
+        """Use metadata from a `MetadataSnapshot` until it is revalidated."""
+        self.desc = descriptions.getDescription(metadata["fields"])
+        self.descFetchedAt = metadata["fetched"]
+        if metadata["arch"]:
+            self.__handleWorkflowDescAnswer(metadata["arch"], None)
+        self.defaults = dict(metadata["defaults"])
+        self.unvalidated = set(["fields", "arch"] + ["defaults:%s" % key for key in self.defaults])
+        self.metadataScheduler.schedule(self, self.descFetchedAt)
+
+    def warmCaches(self, uid, pwd):
+        """Fill the cached type and workflow descriptions, if necessary."""
+        hello()
+        d = defer.maybeDeferred(self.__updateTypedesc, uid, pwd)
+        d.addCallback(self.__updateWorkflowDesc, pwd)
+        return d
 
     def __getSchema(self, uid, request):
         hello()
@@ -906,36 +3648,59 @@ class OpenErpModelResource(Resource):
             request.finish()
             return
         else:
-            request.write(self.__desc2relaxNG(str(request.URLPath()), self.desc))
-            request.finish()
+            plan = self.__getRenderPlan(str(request.URLPath()))
+            d = self.__offload(len(self.desc), plan.getRelaxNG)
+            d.addCallback(self.__writeAndFinish, request)
+            return d
 
     ### error handling
 
-    def __cleanup(self, err, request):
-        hello()
-        log.msg("cleanup: " + str(err))
-        request.setHeader("Content-Type", "text/plain; charset=utf-8")
+    def __describeError(self, err):
+        """Return the HTTP status code and the message that correspond
+        to the given failure."""
         e = err.value
         if err.check(xmlrpclib.Fault):
             if e.faultCode == "AccessDenied":
-                request.setResponseCode(403)
-                request.write("Bad credentials.")
+                return (403, "Bad credentials.")
             elif e.faultCode.startswith("warning -- AccessError") or e.faultCode.startswith("warning -- ZugrifffFehler"):
                 # oh good, OpenERP spelling goodness...
-                request.setResponseCode(404)
-                request.write("No such resource.")
+                return (404, "No such resource.")
             elif e.faultCode.startswith("warning -- Object Error"):
-                request.setResponseCode(404)
-                request.write("No such collection.")
+                return (404, "No such collection.")
             else:
-                request.setResponseCode(500)
-                request.write("An XML-RPC error occured:\n" + e.faultCode.encode("utf-8"))
-        elif e.__class__ in (InvalidParameter, PostNotPossible, PutNotPossible, NoChildResources, NotFound):
-            request.setResponseCode(e.code)
-            request.write(str(e))
+                return (500, "An XML-RPC error occured:\n" + e.faultCode.encode("utf-8"))
+        elif e.__class__ in (InvalidParameter, PostNotPossible, PutNotPossible, NoChildResources, NotFound,
+                InvalidXml, MalformedXml, RequestTooLarge, BackendOverloaded, CircuitOpen, DeadlineExceeded,
+                ThumbnailsNotAvailable):
+            return (e.code, str(e))
+        elif err.check(error.TimeoutError):
+            return (504, "OpenERP did not answer in time.")
+        elif err.check(*CONNECTION_ERRORS):
+            return (502, "OpenERP cannot be reached.")
         else:
-            request.setResponseCode(500)
-            request.write("An error occured:\n" + str(e))
+            return (500, "An error occured:\n" + str(e))
+
+    def __cleanup(self, err, request):
+        hello()
+        if getattr(request, "aborted", False):
+            # nobody is listening anymore
+            return
+        log.msg("cleanup: " + str(err))
+        # if OpenERP is not available, a stale response is better than none
+        if self.responseCache and request.method == "GET" and \
+                err.check(DeadlineExceeded, BackendOverloaded, *CONNECTION_ERRORS):
+            d = self.responseCache.serveStale(request, self.__getCachePolicy(request))
+            d.addCallback(lambda served: served or self.__writeError(err, request))
+            return d
+        self.__writeError(err, request)
+
+    def __writeError(self, err, request):
+        request.setHeader("Content-Type", "text/plain; charset=utf-8")
+        code, message = self.__describeError(err)
+        request.setResponseCode(code)
+        if getattr(err.value, "retryAfter", None):
+            request.setHeader("Retry-After", str(err.value.retryAfter))
+        request.write(message)
         request.finish()
 
     def __raiseAnError(self, *params):
@@ -947,47 +3712,167 @@ It only throws the given exception."""
 
     ### HTTP request handling
 
+    def __applyDeadline(self, d, route):
+        """Make `d` fail with `DeadlineExceeded` if it takes longer than
+        allowed for the given route.  This cancels the backend call or
+        render step `d` is waiting for."""
+        deadline = self.deadlines[route]
+        if deadline:
+            withTimeout(d, deadline, DeadlineExceeded(deadline))
+
+    def __cancelOnDisconnect(self, request, d):
+        """Stop working on `request` as soon as the client has gone:
+        Cancelling `d` cancels the backend call or render step it is
+        waiting for, drops queued calls and skips everything after it."""
+        def abort(err):
+            if not getattr(request, "aborted", False):
+                request.aborted = True
+                metrics.increment("requests.aborted")
+                log.msg("client has gone, aborting " + request.uri)
+            d.cancel()
+        request.notifyFinish().addErrback(abort)
+
     def render_GET(self, request):
+        if not self.responseCache:
+            return self.__renderGet(request)
+        d = self.responseCache.serve(request, self.__getCachePolicy(request), self.__refresh)
+        d.addCallback(lambda served: served or self.__renderGet(request))
+        d.addErrback(self.__cleanup, request)
+        self.__cancelOnDisconnect(request, d)
+        return NOT_DONE_YET
+
+    def __getCacheRoute(self, request):
+        if not request.postpath:
+            return "feed"
+        elif request.postpath[0] in ("schema", "defaults"):
+            return request.postpath[0]
+        elif len(request.postpath) == 2:
+            return "binary"
+        else:
+            return "item"
+
+    def __getCacheTags(self, request):
+        """Return the tags of the representation for `request`, i.e. the
+        paths whose change makes it outdated."""
+        route = self.__getCacheRoute(request)
+        if route == "feed":
+            return ["/%s/%s" % (self.dbname, self.model)]
+        elif route in ("item", "binary"):
+            return ["/%s/%s/%s" % (self.dbname, self.model, request.postpath[0])]
+        return []
+
+    def __getSurrogateKeys(self, request):
+        route = self.__getCacheRoute(request)
+        if route in ("item", "binary"):
+            route = request.postpath[0]
+        return [self.dbname, "%s/%s" % (self.dbname, self.model), "%s/%s:%s" % (self.dbname, self.model, route)]
+
+    def __getCachePolicy(self, request):
+        policy = self.responseCache.getPolicy(self.dbname, self.model, self.__getCacheRoute(request))
+        if policy.maxAge < 0:
+            # valid until the schema expires
+            policy = policy.withMaxAge(int(self.metadataScheduler.getRemaining(self)))
+        return policy
+
+    def __invalidate(self, ids, fields=None, old=None, related=()):
+        """Tell the response cache (and whoever listens to it) that the
+        given items have changed, and with them the items they are (or
+        were, according to `old`) related to via `fields`."""
+        if not self.responseCache:
+            return
+        related = list(related)
+        for name, value in (fields or {}).items():
+            if name in self.desc and 'relation' in self.desc[name]:
+                for v in (value, (old or {}).get(name)):
+                    related.extend([(self.desc[name]['relation'], i) for i in self.__getRelatedIds(v)])
+        self.responseCache.invalidate(self.dbname, self.model, ids, related)
+
+    def __getRelatedIds(self, value):
+        """Return the ids in the value of a relational field, as read from
+        or written to OpenERP."""
+        if isinstance(value, bool):
+            return []
+        elif isinstance(value, (int, long)):
+            return [value]
+        elif isinstance(value, (list, tuple)):
+            if len(value) == 2 and isinstance(value[1], basestring):
+                # many2one as read from OpenERP: (id, name)
+                return [value[0]]
+            ids = []
+            for v in value:
+                if isinstance(v, (int, long)) and not isinstance(v, bool):
+                    ids.append(v)
+                elif isinstance(v, (list, tuple)) and len(v) == 3 and v[0] == 6:
+                    # x2many as written to OpenERP: (6, 0, ids)
+                    ids.extend(v[2])
+            return ids
+        return []
+
+    def __refresh(self, request):
+        """Fetch a new version of a cached representation."""
+        refreshRequest = RefreshRequest(request)
+        d = refreshRequest.notifyFinish()
+        self.__renderGet(refreshRequest)
+        return d
+
+    def __renderGet(self, request):
         hello()
         user = request.getUser()
         pwd = request.getPassword()
+        d = defer.succeed(None)
+        if self.responseCache:
+            # a change after this point makes the response outdated
+            d.addCallback(lambda _: self.responseCache.getVersions(self.__getCacheTags(request)))
+            d.addCallback(lambda versions: setattr(request, "cacheVersions", versions))
 
         # login to OpenERP
-        proxyCommon = quietProxy(self.openerpUrl + 'common')
-        d = proxyCommon.callRemote('login', self.dbname, user, pwd)
+        d.addCallback(lambda _: self.backend.callRemote('common', 'login', self.dbname, user, pwd))
         d.addCallback(self.__handleLoginAnswer)
         d.addCallback(self.__updateTypedesc, pwd)
         d.addCallback(self.__updateWorkflowDesc, pwd)
-        d.addCallback(self.__updateDefaults, pwd)
+        d.addCallback(self.__updateDefaults, pwd, request)
 
         # if uri is sth. like /[dbname]/res.partner,
         #  give a list of all objects in this collection:
         if not request.postpath:
+            route = "collection"
             d.addCallback(self.__getCollection, request, pwd)
 
         # if URI is sth. like /[dbname]/res.partner/schema,
         #  list this particular schema
         elif len(request.postpath) == 1 and request.postpath[0] == "schema":
+            route = "schema"
             d.addCallback(self.__getSchema, request)
 
         # if URI is sth. like /[dbname]/res.partner/defaults,
         #  list this particular schema
         elif len(request.postpath) == 1 and request.postpath[0] == "defaults":
+            route = "defaults"
             d.addCallback(self.__getItemDefaults, request, pwd)
 
         # if URI is sth. like /[dbname]/res.partner/7,
         #  list this particular item
         elif len(request.postpath) == 1:
+            route = "item"
             d.addCallback(self.__getLastItemUpdate, request, pwd, request.postpath[0])
             d.addCallback(self.__getItem, request, pwd, request.postpath[0])
 
-        # if URI is sth. like /[dbname]/res.partner/7/something,
+        # if URI is sth. like /[dbname]/product.product/7/image,
+        #  return the contents of this binary field
+        elif len(request.postpath) == 2:
+            route = "binary"
+            d.addCallback(self.__getBinaryField, request, pwd, *request.postpath)
+
+        # if URI is sth. like /[dbname]/res.partner/7/something/else,
         #  return 404
-        else:    # len(request.postpath) > 1
+        else:    # len(request.postpath) > 2
+            route = "item"
             d.addCallback(self.__raiseAnError,
                 NoChildResources("/" + '/'.join([self.dbname, self.model, request.postpath[0]])))
 
+        self.__applyDeadline(d, route)
         d.addErrback(self.__cleanup, request)
+        self.__cancelOnDisconnect(request, d)
         return NOT_DONE_YET
 
     def render_POST(self, request):
@@ -996,30 +3881,39 @@ It only throws the given exception."""
         pwd = request.getPassword()
 
         # login to OpenERP
-        proxyCommon = quietProxy(self.openerpUrl + 'common')
-        d = proxyCommon.callRemote('login', self.dbname, user, pwd)
+        d = self.backend.callRemote('common', 'login', self.dbname, user, pwd)
         d.addCallback(self.__handleLoginAnswer)
         d.addCallback(self.__updateTypedesc, pwd)
         d.addCallback(self.__updateWorkflowDesc, pwd)
-        d.addCallback(self.__updateDefaults, pwd)
+        d.addCallback(self.__updateDefaults, pwd, request)
 
         # if uri is sth. like /[dbname]/res.partner,
         #  POST creates an entry in this collection:
         if not request.postpath:
+            route = "create"
             d.addCallback(self.__addToCollection, request, pwd)
 
         # if uri is sth. like /[dbname]/res.partner/27/something,
         #  POST executes a workflow on this object
         elif len(request.postpath) == 2 and self.__is_number(request.postpath[0]):
+            route = "workflow"
             d.addCallback(self.__prepareWorkflow, request, pwd, *request.postpath)
 
-        # if URI is sth. like /[dbname]/res.partner/something,
-        #  return 400, cannot POST here
+        # if uri is sth. like /[dbname]/res.partner/something,
+        #  POST executes a workflow on all objects listed in the body
+        elif len(request.postpath) == 1 and not self.__is_number(request.postpath[0]):
+            route = "batch_workflow"
+            d.addCallback(self.__prepareBatchWorkflow, request, pwd, request.postpath[0])
+
+        # if URI looks different, return 400, cannot POST here
         else:
+            route = "create"
             d.addCallback(self.__raiseAnError,
                 PostNotPossible("/" + '/'.join([self.dbname, self.model, request.postpath[0]])))
 
+        self.__applyDeadline(d, route)
         d.addErrback(self.__cleanup, request)
+        self.__cancelOnDisconnect(request, d)
         return NOT_DONE_YET
 
     def render_PUT(self, request):
@@ -1028,15 +3922,15 @@ It only throws the given exception."""
         pwd = request.getPassword()
 
         # login to OpenERP
-        proxyCommon = quietProxy(self.openerpUrl + 'common')
-        d = proxyCommon.callRemote('login', self.dbname, user, pwd)
+        d = self.backend.callRemote('common', 'login', self.dbname, user, pwd)
         d.addCallback(self.__handleLoginAnswer)
         d.addCallback(self.__updateTypedesc, pwd)
         d.addCallback(self.__updateWorkflowDesc, pwd)
-        d.addCallback(self.__updateDefaults, pwd)
+        d.addCallback(self.__updateDefaults, pwd, request)
 
         # if uri is sth. like /[dbname]/res.partner/27,
         #  PUT updates this object
+        route = "update"
         if len(request.postpath) == 1 and self.__is_number(request.postpath[0]):
             d.addCallback(self.__getLastItemUpdate, request, pwd, request.postpath[0])
             d.addCallback(self.__getItemForUpdate, request, pwd, request.postpath[0])
@@ -1046,10 +3940,188 @@ It only throws the given exception."""
             d.addCallback(self.__raiseAnError,
                 PutNotPossible(str(request.URLPath()) + ''.join(['/' + r for r in request.postpath])))
 
+        self.__applyDeadline(d, route)
         d.addErrback(self.__cleanup, request)
+        self.__cancelOnDisconnect(request, d)
         return NOT_DONE_YET
 
 
+# Multi-process mode
+# ------------------
+#
+# A single process can only use one CPU core for rendering XML and
+# validating input.  When started with `--workers N`, the process that
+# was started acts as a supervisor: it creates the listening socket and
+# starts N worker processes that accept connections on that socket
+# (inherited as a file descriptor or, if the reactor cannot adopt an
+# existing socket, bound with SO_REUSEPORT by each worker).  Crashed
+# workers are restarted, and on SIGHUP all workers are replaced one
+# after the other.  Each worker has its own caches, which are warmed
+# with `OpenErpDispatcher.prewarm()` when it starts.
+
+class ReusePort(tcp.Port):
+    """A TCP port that can be bound by several processes at once."""
+    def createInternetSocket(self):
+        skt = tcp.Port.createInternetSocket(self)
+        skt.setsockopt(socket.SOL_SOCKET, getattr(socket, "SO_REUSEPORT", 15), 1)
+        return skt
+
+
+def stopGracefully(site, listeningPort, timeout, clock=reactor):
+    """Stop accepting connections; return a Deferred that fires as soon as
+    all requests in progress are finished, but after `timeout` seconds at
+    the latest."""
+    log.msg("stopping worker after %d request(s) in progress" % site.activeRequests)
+    listeningPort.stopListening()
+    deadline = clock.seconds() + timeout
+    done = defer.Deferred()
+
+    def checkDone():
+        if site.activeRequests <= 0 or clock.seconds() >= deadline:
+            done.callback(None)
+        else:
+            clock.callLater(0.1, checkDone)
+    checkDone()
+    return done
+
+
+def ignoreInterrupts():
+    """Keep a worker running on Ctrl-C: it reaches the whole process group,
+    and the supervisor then asks each worker to stop gracefully with
+    SIGTERM.  (This also keeps Twisted from installing its own SIGINT
+    handler.)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class WorkerSupervisor(object):
+    """Start the workers and watch them from the reactor of the
+    supervisor process."""
+    def __init__(self, port, workers, timeout=30, clock=reactor):
+        self.port = port
+        self.numWorkers = workers
+        self.timeout = timeout
+        self.clock = clock
+        self.workerArgs = []
+        self.workers = []
+        self.running = False
+        self.restartRequested = False
+        # the Deferred of the rolling restart in progress, if any
+        self.restarting = None
+        self.loop = None
+
+    def listen(self):
+        """Create the socket that the workers will share."""
+        if IReactorSocket is not None and IReactorSocket.providedBy(reactor):
+            skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            skt.bind(('', self.port))
+            skt.listen(50)
+            # all workers wait for connections on this socket, so it must
+            #  not block the ones that lose the race for a connection
+            skt.setblocking(False)
+            self.socket = skt
+            self.workerArgs = ["--worker-fd", str(skt.fileno())]
+        else:
+            self.workerArgs = ["--reuse-port"]
+
+    def startProcess(self):
+        return subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0])] + self.workerArgs,
+            close_fds=False)
+
+    def spawn(self):
+        proc = self.startProcess()
+        log.msg("started worker with pid %d" % proc.pid)
+        return {'proc': proc, 'started': self.clock.seconds(), 'failures': 0, 'restartAt': None}
+
+    def stopWorker(self, worker):
+        """Ask a worker to finish its requests; return a Deferred that
+        fires when it is gone."""
+        proc = worker['proc']
+        if proc.poll() is None:
+            proc.terminate()
+        deadline = self.clock.seconds() + self.timeout + 5
+        gone = defer.Deferred()
+
+        def check():
+            if proc.poll() is None and self.clock.seconds() >= deadline:
+                log.msg("killing worker with pid %d" % proc.pid)
+                proc.kill()
+                proc.wait()
+            if proc.poll() is None:
+                self.clock.callLater(0.1, check)
+            else:
+                gone.callback(None)
+        check()
+        return gone
+
+    def rollingRestart(self):
+        """Replace the workers one after the other; return a Deferred that
+        fires when all have been replaced."""
+        log.msg("restarting all workers")
+
+        def replace(i):
+            if not self.running or i >= len(self.workers):
+                return
+            worker = self.workers[i]
+            self.workers[i] = self.spawn()
+            # give the new worker some time to start up
+            d = task.deferLater(self.clock, 2, self.stopWorker, worker)
+            d.addCallback(lambda _: replace(i + 1))
+            return d
+        return defer.maybeDeferred(replace, 0)
+
+    def requestRestart(self):
+        self.restartRequested = True
+
+    def checkWorkers(self):
+        """Restart crashed workers, waiting longer and longer if they
+        keep crashing right after the start."""
+        now = self.clock.seconds()
+        for i, worker in enumerate(self.workers):
+            if worker['proc'].poll() is None:
+                continue
+            if worker['restartAt'] is None:
+                log.msg("worker with pid %d exited with code %s" % (worker['proc'].pid, worker['proc'].returncode))
+                failures = now - worker['started'] < 10 and worker['failures'] + 1 or 0
+                worker['failures'] = failures
+                worker['restartAt'] = now + min(2 ** failures - 1, 60)
+            if now >= worker['restartAt']:
+                self.workers[i] = self.spawn()
+                self.workers[i]['failures'] = worker['failures']
+
+    def tick(self):
+        if self.restartRequested and self.restarting is None:
+            self.restartRequested = False
+            self.restarting = self.rollingRestart()
+            self.restarting.addBoth(lambda _: setattr(self, "restarting", None))
+        self.checkWorkers()
+
+    def start(self):
+        self.running = True
+        self.workers = [self.spawn() for i in range(self.numWorkers)]
+        self.loop = task.LoopingCall(self.tick)
+        self.loop.clock = self.clock
+        self.loop.start(0.5, now=False)
+
+    def stop(self):
+        """Stop all workers gracefully; return a Deferred that fires when
+        they are gone."""
+        log.msg("stopping all workers")
+        self.running = False
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        return defer.DeferredList([self.stopWorker(worker) for worker in self.workers])
+
+    def run(self):
+        """Supervise the workers until SIGTERM or SIGINT; SIGHUP restarts
+        them."""
+        self.listen()
+        signal.signal(signal.SIGHUP, lambda signum, frame: reactor.callFromThread(self.requestRestart))
+        reactor.callWhenRunning(self.start)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        reactor.run()
+
+
 class InvalidParameter(Exception):
     code = 400
 
@@ -1100,6 +4172,68 @@ class NotFound(Exception):
         return str(self.res) + " was not found"
 
 
+class MalformedXml(Exception):
+    code = 400
+
+    def __init__(self, err):
+        self.err = err
+
+    def __str__(self):
+        return "malformed XML: " + str(self.err)
+
+
+class InvalidXml(Exception):
+    code = 400
+
+    def __init__(self, err):
+        self.err = err
+
+    def __str__(self):
+        return "invalid XML:\n" + str(self.err)
+
+
+class RequestTooLarge(Exception):
+    code = 413
+
+    def __init__(self, size):
+        self.size = size
+
+    def __str__(self):
+        return "The request body must not be larger than %d bytes" % self.size
+
+
+class BackendOverloaded(Exception):
+    code = 503
+
+    def __init__(self, retryAfter):
+        self.retryAfter = retryAfter
+
+    def __str__(self):
+        return "OpenERP is busy, please try again later"
+
+
+class CircuitOpen(BackendOverloaded):
+    def __str__(self):
+        return "OpenERP is not available at the moment, please try again later"
+
+
+class DeadlineExceeded(Exception):
+    code = 504
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __str__(self):
+        return "OpenERP did not answer within %s seconds" % self.deadline
+
+
+class ThumbnailsNotAvailable(Exception):
+    code = 501
+
+    def __str__(self):
+        return "Thumbnails need the Python Imaging Library"
+
+
 if __name__ == "__main__":
     # read config
     config = ConfigParser.RawConfigParser()
@@ -1109,9 +4243,56 @@ if __name__ == "__main__":
         port = config.getint("Proxy Settings", "port")
     except:
         port = 8068
+    # read command line
+    parser = optparse.OptionParser()
+    parser.add_option("--workers", type="int",
+        default=getConfigValue(config, "Proxy Settings", "workers", 0, int),
+        help="number of worker processes to start (default: serve from this process)")
+    parser.add_option("--worker-fd", type="int", help=optparse.SUPPRESS_HELP)
+    parser.add_option("--reuse-port", action="store_true", help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    isWorker = options.worker_fd is not None or options.reuse_port
+    timeout = getConfigValue(config, "Proxy Settings", "shutdown_timeout", 30, int)
     # go
     log.startLogging(sys.stdout)
-    root = OpenErpDispatcher(openerpUrl)
-    factory = Site(root)
-    reactor.listenTCP(port, factory)
+    if options.workers and not isWorker:
+        WorkerSupervisor(port, options.workers, timeout).run()
+        sys.exit(0)
+    if isWorker:
+        ignoreInterrupts()
+    root = OpenErpDispatcher(openerpUrl, config)
+    factory = OpenErpSite(root, root.maxBodySize)
+    renderThreads = getConfigValue(config, "Proxy Settings", "render_threads", 4, int)
+    if renderThreads:
+        reactor.suggestThreadPoolSize(renderThreads)
+
+    def listen(_=None):
+        if options.worker_fd is not None:
+            listeningPort = reactor.adoptStreamPort(options.worker_fd, socket.AF_INET, factory)
+        elif options.reuse_port:
+            listeningPort = ReusePort(port, factory, reactor=reactor)
+            listeningPort.startListening()
+        else:
+            listeningPort = reactor.listenTCP(port, factory)
+        if isWorker:
+            # finish the requests in progress before stopping
+            def stop():
+                stopGracefully(factory, listeningPort, timeout).addCallback(lambda _: reactor.stop())
+
+            def handleSigTerm(signum, frame):
+                reactor.callFromThread(stop)
+            reactor.callWhenRunning(signal.signal, signal.SIGTERM, handleSigTerm)
+    snapshot = MetadataSnapshot(root, config)
+    snapshot.load()
+    reactor.callWhenRunning(snapshot.start)
+    if getConfigValue(config, "Prewarm", "wait", False, configBool):
+        # accept requests only when the schema caches are filled
+        reactor.callWhenRunning(lambda: root.prewarm().addBoth(listen))
+    else:
+        listen()
+        reactor.callWhenRunning(root.prewarm)
+    reactor.callWhenRunning(root.backend.startHealthChecks)
+    metricsInterval = getConfigValue(config, "Proxy Settings", "metrics_interval", 60, int)
+    if metricsInterval:
+        task.LoopingCall(metrics.logValues).start(metricsInterval, now=False)
     reactor.run()
@@ -0,0 +1,357 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import xmlrpclib
+import ConfigParser
+
+from twisted.trial import unittest
+from twisted.internet import defer, error, task
+
+import restfulOpenErpProxy
+from restfulOpenErpProxy import CallLimiter, CircuitBreaker, OpenErpBackendPool, withTimeout
+from restfulOpenErpProxy import BackendOverloaded, CircuitOpen, DeadlineExceeded
+
+def collect(d):
+  """Return a list that receives the result (or failure) of `d`."""
+  results = []
+  d.addBoth(results.append)
+  return results
+
+class CallLimiterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.limiter = CallLimiter("test", 2, 2, 10, 7, self.clock)
+
+  def test_whenSlotsFreeThenCalledAtOnce(self):
+    calls = []
+    self.limiter.run(calls.append, "a")
+    self.limiter.run(calls.append, "b")
+    self.assertEqual(calls, ["a", "b"])
+    self.assertEqual(self.limiter.active, 0)
+
+  def test_whenReleasedThenSlotHandedToNextWaiting(self):
+    first, second = defer.Deferred(), defer.Deferred()
+    self.limiter.run(lambda: first)
+    self.limiter.run(lambda: second)
+    third = defer.Deferred()
+    calls = []
+    results = collect(self.limiter.run(lambda: calls.append("c") or third))
+    self.assertEqual((calls, self.limiter.active, len(self.limiter.waiting)), ([], 2, 1))
+    first.callback("done")
+    self.assertEqual((calls, self.limiter.active, len(self.limiter.waiting)), (["c"], 2, 0))
+    second.callback("done")
+    third.callback("done")
+    self.assertEqual((results, self.limiter.active), (["done"], 0))
+    # the queue timeout of the waiting call must not fire any more
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+  def test_whenQueueFullThenShed(self):
+    for i in range(4):
+      self.limiter.run(defer.Deferred)
+    results = collect(self.limiter.run(lambda: None))
+    self.assertEqual(len(results), 1)
+    results[0].trap(BackendOverloaded)
+    self.assertEqual(results[0].value.retryAfter, 7)
+    self.assertEqual(len(self.limiter.waiting), 2)
+
+  def test_whenWaitingTooLongThenShed(self):
+    self.limiter.run(defer.Deferred)
+    self.limiter.run(defer.Deferred)
+    calls = []
+    results = collect(self.limiter.run(calls.append, "c"))
+    self.clock.advance(9)
+    self.assertEqual(results, [])
+    self.clock.advance(1)
+    results[0].trap(BackendOverloaded)
+    self.assertEqual((calls, self.limiter.active, len(self.limiter.waiting)), ([], 2, 0))
+
+  def test_whenWaitingCallCancelledThenLeavesQueue(self):
+    first = defer.Deferred()
+    self.limiter.run(lambda: first)
+    self.limiter.run(defer.Deferred)
+    calls = []
+    d = self.limiter.run(calls.append, "c")
+    d.cancel()
+    collect(d)[0].trap(defer.CancelledError)
+    self.assertEqual((len(self.limiter.waiting), self.clock.getDelayedCalls()), (0, []))
+    first.callback("done")
+    self.assertEqual((calls, self.limiter.active), ([], 1))
+
+  def test_whenCallFailsThenSlotReleased(self):
+    def fail():
+      raise ValueError("broken")
+    failing = defer.Deferred()
+    results = [collect(self.limiter.run(fail)), collect(self.limiter.run(lambda: failing))]
+    results.append(collect(self.limiter.run(fail)))
+    self.assertEqual(self.limiter.active, 1)
+    failing.errback(ValueError("broken later"))
+    for result in results:
+      result[0].trap(ValueError)
+    self.assertEqual((self.limiter.active, len(self.limiter.waiting)), (0, 0))
+
+class WithTimeoutTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+
+  def test_whenNotAnsweredInTimeThenDeadlineExceeded(self):
+    cancelled = []
+    d = defer.Deferred(cancelled.append)
+    results = collect(withTimeout(d, 60, DeadlineExceeded(60), self.clock))
+    self.clock.advance(59)
+    self.assertEqual((results, cancelled), ([], []))
+    self.clock.advance(1)
+    self.assertEqual(cancelled, [d])
+    results[0].trap(DeadlineExceeded)
+    self.assertEqual((results[0].value.code, str(results[0].value)),
+      (504, "OpenERP did not answer within 60 seconds"))
+
+  def test_whenAnsweredThenTimerCancelled(self):
+    d = defer.Deferred()
+    results = collect(withTimeout(d, 60, DeadlineExceeded(60), self.clock))
+    d.callback("answer")
+    self.assertEqual((results, self.clock.getDelayedCalls()), (["answer"], []))
+
+  def test_whenFailedThenTimerCancelledAndFailureKept(self):
+    d = defer.Deferred()
+    results = collect(withTimeout(d, 60, DeadlineExceeded(60), self.clock))
+    d.errback(error.ConnectionLost())
+    results[0].trap(error.ConnectionLost)
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+  def test_whenCancelledForOtherReasonsThenCancelledError(self):
+    d = defer.Deferred()
+    results = collect(withTimeout(d, 60, DeadlineExceeded(60), self.clock))
+    # e.g. because the client has gone
+    d.cancel()
+    results[0].trap(defer.CancelledError)
+    self.assertEqual(self.clock.getDelayedCalls(), [])
+
+  def test_whenDeadlinePassedWhileQueuedThenCallDropped(self):
+    limiter = CallLimiter("test", 1, 10, 100, 5, self.clock)
+    limiter.run(defer.Deferred)
+    calls = []
+    results = collect(withTimeout(limiter.run(calls.append, "late"), 30, DeadlineExceeded(30), self.clock))
+    self.clock.advance(30)
+    results[0].trap(DeadlineExceeded)
+    self.assertEqual((calls, len(limiter.waiting)), ([], 0))
+
+class CircuitBreakerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.clock.advance(1000)
+    # opens when half of the last 4 calls failed
+    self.breaker = CircuitBreaker("test", 4, 4, 0.5, 10, 30, self.clock)
+
+  def _open(self):
+    for ok in (True, False, True, False):
+      self.breaker.record(ok, self.breaker.allow())
+
+  def test_whenFewFailuresThenClosed(self):
+    self.breaker.record(False, self.breaker.allow())
+    for i in range(4):
+      self.breaker.record(True, self.breaker.allow())
+    self.breaker.record(False, self.breaker.allow())
+    self.assertEqual(self.breaker.getState(), "closed")
+
+  def test_whenTooManyFailuresThenOpen(self):
+    for ok in (True, False, True):
+      self.breaker.record(ok, self.breaker.allow())
+    self.assertEqual(self.breaker.getState(), "closed")
+    self.breaker.record(False, self.breaker.allow())
+    self.assertEqual(self.breaker.getState(), "open")
+
+  def test_whenOpenThenCallsFailFast(self):
+    self._open()
+    self.clock.advance(20)
+    self.assertTrue(self.breaker.isOpen())
+    e = self.assertRaises(CircuitOpen, self.breaker.allow)
+    self.assertEqual((e.code, e.retryAfter), (503, 10))
+
+  def test_whenOpenTimeOverThenOneTrialCall(self):
+    self._open()
+    self.clock.advance(30)
+    self.assertEqual(self.breaker.getState(), "half-open")
+    self.assertTrue(self.breaker.allow())
+    # only one call at a time while half-open
+    self.assertRaises(CircuitOpen, self.breaker.allow)
+
+  def test_whenTrialCallSucceedsThenClosed(self):
+    self._open()
+    self.clock.advance(30)
+    self.breaker.record(True, self.breaker.allow())
+    self.assertEqual(self.breaker.getState(), "closed")
+    self.assertFalse(self.breaker.allow())
+    # the failures from before do not count any more
+    self.breaker.record(False, False)
+    self.assertEqual(self.breaker.getState(), "closed")
+
+  def test_whenTrialCallFailsThenOpenAgain(self):
+    self._open()
+    self.clock.advance(30)
+    self.breaker.record(False, self.breaker.allow())
+    self.assertEqual(self.breaker.getState(), "open")
+    self.clock.advance(29)
+    self.assertTrue(self.breaker.isOpen())
+    self.clock.advance(1)
+    self.assertEqual(self.breaker.getState(), "half-open")
+
+  def test_whenTrialCallCancelledThenAnotherTrialAllowed(self):
+    self._open()
+    self.clock.advance(30)
+    self.breaker.cancelled(self.breaker.allow())
+    self.assertTrue(self.breaker.allow())
+
+class FakeServers(object):
+  """Stands in for `quietProxy`: Servers are named by the first part of
+  their URL and answer at once, unless they are down, answer with a
+  fault or are slow (then the answer waits in `pending`)."""
+  def __init__(self):
+    self.calls = []
+    self.down = set()
+    self.faulty = set()
+    self.slow = set()
+    self.pending = {}
+
+  def __call__(self, url, connectTimeout=None):
+    return FakeProxy(self, url.split("/")[0])
+
+  def answer(self, server, method, args):
+    self.calls.append((server, method))
+    if server in self.down:
+      return defer.fail(error.ConnectionRefusedError())
+    if server in self.faulty:
+      return defer.fail(xmlrpclib.Fault(1, "broken"))
+    if server in self.slow and method != "version":
+      d = defer.Deferred()
+      self.pending.setdefault(server, []).append(d)
+      return d
+    return defer.succeed(server)
+
+class FakeProxy(object):
+  def __init__(self, servers, server):
+    self.servers = servers
+    self.server = server
+
+  def callRemote(self, method, *args):
+    return self.servers.answer(self.server, method, args)
+
+def makePoolConfig(**options):
+  config = ConfigParser.RawConfigParser()
+  config.add_section("OpenERP")
+  config.set("OpenERP", "call_timeout", "0")
+  for name, value in options.items():
+    config.set("OpenERP", name, value)
+  return config
+
+def read(pool, uid=1):
+  return pool.callRemote("object", "execute", "demo", uid, "pwd", "res.partner", "read", [1], ["name"])
+
+def write(pool, uid=1):
+  return pool.callRemote("object", "execute", "demo", uid, "pwd", "res.partner", "write", [1], {"name": "x"})
+
+class OpenErpBackendPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.servers = FakeServers()
+    self.patch(restfulOpenErpProxy, "quietProxy", self.servers)
+    self.pool = OpenErpBackendPool(["a/", "b/", "c/"], makePoolConfig())
+
+  def test_whenCallsInProgressThenLeastOutstandingChosen(self):
+    self.servers.slow.update(["a", "b", "c"])
+    for i in range(3):
+      write(self.pool)
+    self.assertEqual(sorted([server for server, method in self.servers.calls]), ["a", "b", "c"])
+    for server in ("b", "a", "b"):
+      self.servers.pending[server].pop().callback("done")
+      write(self.pool)
+      self.assertEqual(self.servers.calls[-1][0], server)
+
+  def test_whenUnreachableThenEjectedUntilProbeSucceeds(self):
+    self.servers.down.add("a")
+    self.servers.slow.update(["b", "c"])
+    for i in range(3):
+      write(self.pool).addErrback(lambda err: err.trap(error.ConnectError))
+    a, b, c = self.pool.backends
+    self.assertFalse(a.isAvailable())
+    # a has no calls in progress, but is not used any more
+    write(self.pool)
+    self.assertNotEqual(self.servers.calls[-1][0], "a")
+    self.pool.checkHealth()
+    self.assertFalse(a.isAvailable())
+    self.servers.down.clear()
+    self.pool.checkHealth()
+    self.assertTrue(a.isAvailable())
+    write(self.pool)
+    self.assertEqual(self.servers.calls[-1], ("a", "execute"))
+
+  def test_whenReadUnreachableThenRetriedElsewhere(self):
+    pool = OpenErpBackendPool(["a/", "b/", "c/"], makePoolConfig(retries="2"))
+    self.servers.down.update(["a", "b"])
+    results = collect(read(pool))
+    self.assertEqual(results, ["c"])
+    self.assertEqual(self.servers.calls[-1][0], "c")
+
+  def test_whenRetriesUsedUpThenFailure(self):
+    self.servers.down.update(["a", "b", "c"])
+    results = collect(read(self.pool))
+    results[0].trap(error.ConnectError)
+    # one call and one retry
+    self.assertEqual(len(self.servers.calls), 2)
+
+  def test_whenReadFaultThenNotRetried(self):
+    self.servers.faulty.update(["a", "b", "c"])
+    results = collect(read(self.pool))
+    results[0].trap(xmlrpclib.Fault)
+    self.assertEqual(len(self.servers.calls), 1)
+
+  def test_whenWriteUnreachableThenNotRetried(self):
+    self.servers.down.update(["a", "b", "c"])
+    results = collect(write(self.pool))
+    results[0].trap(error.ConnectError)
+    self.assertEqual(len(self.servers.calls), 1)
+
+class FakeTime(object):
+  """Replaces the `time` module for the pool, driven by a task.Clock."""
+  def __init__(self, clock):
+    self.time = clock.seconds
+
+class ReplicaRoutingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.servers = FakeServers()
+    self.patch(restfulOpenErpProxy, "quietProxy", self.servers)
+    self.clock = task.Clock()
+    self.clock.advance(1000)
+    self.patch(restfulOpenErpProxy, "time", FakeTime(self.clock))
+    self.pool = OpenErpBackendPool(["primary/"], makePoolConfig(read_your_writes="5"), ["replica/"])
+
+  def test_whenReadThenReplica(self):
+    self.assertEqual(collect(read(self.pool)), ["replica"])
+    self.assertEqual(collect(self.pool.callRemote("common", "login", "demo", "admin", "pwd")), ["replica"])
+
+  def test_whenWriteThenPrimary(self):
+    self.assertEqual(collect(write(self.pool)), ["primary"])
+    self.assertEqual(collect(self.pool.callRemote("object", "exec_workflow", "demo", 1, "pwd",
+      "res.partner", "confirm", 1)), ["primary"])
+
+  def test_whenReadAfterWriteThenPrimaryForAWhile(self):
+    write(self.pool, uid=1)
+    self.clock.advance(4)
+    self.assertEqual(collect(read(self.pool, uid=1)), ["primary"])
+    # other users are not affected
+    self.assertEqual(collect(read(self.pool, uid=2)), ["replica"])
+    self.clock.advance(1)
+    self.assertEqual(collect(read(self.pool, uid=1)), ["replica"])
+
+  def test_whenReplicaUnreachableThenReadRetriedOnPrimary(self):
+    self.servers.down.add("replica")
+    self.assertEqual(collect(read(self.pool)), ["primary"])
+    self.assertEqual(collect(read(self.pool)), ["primary"])
+    self.assertEqual(len(self.servers.calls), 3)
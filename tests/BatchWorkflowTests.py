@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import xmlrpclib
+import ConfigParser
+
+from lxml import etree
+
+from twisted.trial import unittest
+from twisted.internet import defer, error, task
+
+from restfulOpenErpProxy import OpenErpModelResource, MetadataScheduler
+
+from tests.InvalidationTests import FakeBackend, FakeRequest, COLLECTION
+
+class WorkflowBackend(FakeBackend):
+  """Fails the workflow for items in `broken` and keeps the answers for
+  all items in `pending` if `slow` is set."""
+
+  def __init__(self):
+    FakeBackend.__init__(self)
+    self.partners[2]["state"] = "confirmed"
+    self.broken = set()
+    self.slow = False
+    self.pending = []
+    self.signalled = []
+
+  def exec_workflow(self, db, uid, pwd, model, signal, id):
+    self.signalled.append(id)
+    if id in self.broken:
+      raise xmlrpclib.Fault("warning -- Workflow Error", "cannot confirm")
+    if self.slow:
+      d = defer.Deferred()
+      self.pending.append(d)
+      return d
+    return FakeBackend.exec_workflow(self, db, uid, pwd, model, signal, id)
+
+class DisconnectingRequest(FakeRequest):
+
+  def __init__(self, *args):
+    FakeRequest.__init__(self, *args)
+    self.gone = defer.Deferred()
+
+  def notifyFinish(self):
+    return self.gone
+
+class BatchWorkflowTest(unittest.TestCase):
+
+  def setUp(self):
+    self.config = ConfigParser.RawConfigParser()
+    self.config.add_section("Proxy Settings")
+    self.config.set("Proxy Settings", "workflow_concurrency", "1")
+    self.backend = WorkflowBackend()
+    self.scheduler = MetadataScheduler(self.config, task.Clock())
+    self.resource = self.makeResource()
+
+  def tearDown(self):
+    self.scheduler.stop()
+
+  def makeResource(self):
+    return OpenErpModelResource(self.backend, "demo", "res.partner", self.config,
+      metadataScheduler=self.scheduler)
+
+  def test_whenBatchWorkflowThenOutcomePerItem(self):
+    self.backend.broken.add(3)
+    request = FakeRequest("POST", "/confirm", "1 %s/2 3 99" % COLLECTION)
+    self.resource.render_POST(request)
+    self.assertTrue(request.finished.called)
+    self.assertEqual(request.code, 200)
+    results = [(r.get("href"), r.get("status"), r.text)
+      for r in etree.fromstring("".join(request.body)).findall("result")]
+    self.assertEqual(results[:2], [
+      (COLLECTION + "/1", "204", None),
+      (COLLECTION + "/2", "400", "Workflow 'confirm' not allowed in state 'confirmed'.")])
+    self.assertEqual(results[2][:2], (COLLECTION + "/3", "500"))
+    self.assertTrue("Workflow Error" in results[2][2])
+    self.assertEqual(results[3], (COLLECTION + "/99", "404", "No such resource."))
+    self.assertEqual(self.backend.signalled, [1, 3])
+    self.assertEqual(self.backend.partners[1]["state"], "confirmed")
+
+  def test_whenClientGoneThenQueuedSignalsNotSent(self):
+    self.backend.slow = True
+    self.backend.partners[2]["state"] = "draft"
+    request = DisconnectingRequest("POST", "/confirm", "1 2 3")
+    self.resource.render_POST(request)
+    self.assertEqual(self.backend.signalled, [1])
+    request.gone.errback(error.ConnectionDone())
+    self.assertEqual(self.backend.signalled, [1])
+    self.assertFalse(request.finished.called)
+    self.assertEqual(request.body, [])
+
+  def test_whenNoDeadlineForBatchWorkflowThenLongerThanForOthers(self):
+    self.assertEqual(self.resource.deadlines["workflow"], 60)
+    self.assertEqual(self.resource.deadlines["batch_workflow"], 600)
+    self.config.set("Proxy Settings", "deadline_batch_workflow", "120")
+    self.assertEqual(self.makeResource().deadlines["batch_workflow"], 120)
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import base64
+import ConfigParser
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.web.http_headers import Headers
+
+from restfulOpenErpProxy import parseByteRange, writeRanged, guessContentType
+from restfulOpenErpProxy import OpenErpModelResource, ResponseCache, MetadataScheduler
+
+from tests import InvalidationTests
+from tests.ResponseCacheTests import FakeCacheStore
+
+class FakeRequest(object):
+  def __init__(self, headers, etag='"abc"'):
+    self.requestHeaders = Headers()
+    for name, value in headers.items():
+      self.requestHeaders.setRawHeaders(name, [value])
+    self.responseHeaders = Headers()
+    if etag:
+      self.setHeader("ETag", etag)
+    self.code = 200
+    self.body = []
+    self.finished = False
+
+  def getHeader(self, name):
+    values = self.requestHeaders.getRawHeaders(name)
+    return values and values[-1] or None
+
+  def setHeader(self, name, value):
+    self.responseHeaders.setRawHeaders(name, [value])
+
+  def setResponseCode(self, code):
+    self.code = code
+
+  def write(self, data):
+    self.body.append(data)
+
+  def finish(self):
+    self.finished = True
+
+class ByteRangeTest(unittest.TestCase):
+
+  def test_whenRangeGivenThenPositions(self):
+    self.assertEqual(parseByteRange("bytes=0-9", 100), (0, 9))
+    self.assertEqual(parseByteRange("bytes=90-", 100), (90, 99))
+    self.assertEqual(parseByteRange("bytes=90-200", 100), (90, 99))
+    self.assertEqual(parseByteRange("bytes=-10", 100), (90, 99))
+    self.assertEqual(parseByteRange("bytes=-200", 100), (0, 99))
+
+  def test_whenNoOrUnsupportedRangeThenWholeBody(self):
+    for header in (None, "", "items=0-9", "bytes=0-9,20-29", "bytes=a-b", "bytes=9-0"):
+      self.assertEqual(parseByteRange(header, 100), None)
+
+  def test_whenBeyondEndThenUnsatisfiable(self):
+    self.assertEqual(parseByteRange("bytes=100-", 100), (None, None))
+    self.assertEqual(parseByteRange("bytes=-5", 0), (None, None))
+
+class WriteRangedTest(unittest.TestCase):
+
+  body = "".join([chr(i) for i in range(100)])
+
+  def test_whenNoRangeThenWholeBody(self):
+    request = FakeRequest({})
+    writeRanged(request, self.body)
+    self.assertEqual((request.code, "".join(request.body)), (200, self.body))
+    self.assertEqual(request.responseHeaders.getRawHeaders("Accept-Ranges"), ["bytes"])
+    self.assertTrue(request.finished)
+
+  def test_whenRangeThenPartialContent(self):
+    request = FakeRequest({"Range": "bytes=10-19"})
+    writeRanged(request, self.body)
+    self.assertEqual((request.code, "".join(request.body)), (206, self.body[10:20]))
+    self.assertEqual(request.responseHeaders.getRawHeaders("Content-Range"), ["bytes 10-19/100"])
+
+  def test_whenUnsatisfiableThen416(self):
+    request = FakeRequest({"Range": "bytes=200-"})
+    writeRanged(request, self.body)
+    self.assertEqual((request.code, request.body), (416, []))
+    self.assertEqual(request.responseHeaders.getRawHeaders("Content-Range"), ["bytes */100"])
+
+  def test_whenIfRangeOutdatedThenWholeBody(self):
+    request = FakeRequest({"Range": "bytes=10-19", "If-Range": '"old"'})
+    writeRanged(request, self.body)
+    self.assertEqual((request.code, "".join(request.body)), (200, self.body))
+
+  def test_whenETagMatchesThenNotModified(self):
+    request = FakeRequest({"If-None-Match": '"xyz", "abc"'})
+    writeRanged(request, self.body)
+    self.assertEqual((request.code, request.body), (304, []))
+
+  def test_whenContentSniffedThenType(self):
+    self.assertEqual(guessContentType("\x89PNG\r\n\x1a\n..."), "image/png")
+    self.assertEqual(guessContentType("\xff\xd8\xff\xe0"), "image/jpeg")
+    self.assertEqual(guessContentType("plain"), "application/octet-stream")
+
+class ImageBackend(InvalidationTests.FakeBackend):
+  """Partner 1 has an image, partner 2 has none."""
+  fields = dict(InvalidationTests.FakeBackend.fields)
+  fields["image"] = {"type": "binary"}
+  image = "\x89PNG\r\n\x1a\n" + "".join([chr(i % 256) for i in range(1000)])
+
+  def __init__(self):
+    InvalidationTests.FakeBackend.__init__(self)
+    for i in self.partners:
+      self.partners[i]["image"] = False
+    self.partners[1]["image"] = base64.b64encode(self.image)
+
+class BinaryFieldTest(unittest.TestCase):
+
+  def _makeResource(self, **options):
+    config = ConfigParser.RawConfigParser()
+    for section, option, value in [o.split(":") for o in options.get("cache", [])]:
+      if not config.has_section(section):
+        config.add_section(section)
+      config.set(section, option, value)
+    self.scheduler = MetadataScheduler(config, task.Clock())
+    self.backend = ImageBackend()
+    self.resource = OpenErpModelResource(self.backend, "demo", "res.partner", config,
+      ResponseCache(config, FakeCacheStore(), task.Clock()), metadataScheduler=self.scheduler)
+
+  def tearDown(self):
+    self.scheduler.stop()
+
+  def _get(self, path, headers={}):
+    request = InvalidationTests.FakeRequest("GET", path)
+    for name, value in headers.items():
+      request.requestHeaders.setRawHeaders(name, [value])
+    reads = self.backend.reads
+    self.resource.render_GET(request)
+    self.assertTrue(request.finished.called)
+    request.fetched = self.backend.reads > reads
+    return request
+
+  def _getHeader(self, request, name):
+    return request.responseHeaders.getRawHeaders(name, [None])[0]
+
+  def test_whenBinaryFieldThenDecodedContents(self):
+    self._makeResource()
+    request = self._get("/1/image")
+    self.assertEqual((request.code, "".join(request.body)), (200, self.backend.image))
+    self.assertEqual(self._getHeader(request, "Content-Type"), "image/png")
+    self.assertEqual(self._getHeader(request, "Accept-Ranges"), "bytes")
+    self.assertEqual(self._getHeader(request, "Content-Length"), "1008")
+    etag = self._getHeader(request, "ETag")
+    request = self._get("/1/image", {"Range": "bytes=0-7", "If-Range": etag})
+    self.assertEqual((request.code, "".join(request.body)), (206, self.backend.image[:8]))
+    request = self._get("/1/image", {"If-None-Match": etag})
+    self.assertEqual((request.code, request.body), (304, []))
+
+  def test_whenEmptyOrNoBinaryFieldThen404(self):
+    self._makeResource()
+    for path in ("/2/image", "/1/name", "/1/missing", "/x/image"):
+      self.assertEqual(self._get(path).code, 404, path)
+
+  def test_whenNoPolicyForBinaryThenNotCached(self):
+    self._makeResource()
+    self._get("/1/image")
+    self.assertTrue(self._get("/1/image").fetched)
+
+  def test_whenPolicyForBinaryThenCached(self):
+    self._makeResource(cache=["Cache */*/binary:max_age:60"])
+    self.assertTrue(self._get("/1/image").fetched)
+    request = self._get("/1/image", {"Range": "bytes=8-9"})
+    self.assertFalse(request.fetched)
+    self.assertEqual((request.code, "".join(request.body)), (206, "\x00\x01"))
+
+  def test_whenTooLargeThenNotCached(self):
+    self._makeResource(cache=["Cache */*/binary:max_age:60", "Cache:max_cached_body:1000"])
+    self._get("/1/image")
+    self.assertTrue(self._get("/1/image").fetched)
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+from twisted.trial import unittest
+from twisted.internet import reactor
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import LineReceiver
+
+from restfulOpenErpProxy import MemoryCacheStore, MemcachedCacheStore
+
+class FakeMemcached(LineReceiver):
+  """Understands just enough of the memcached text protocol for the
+  store (expiry times are ignored)."""
+
+  def connectionMade(self):
+    self.pending = None
+
+  def lineReceived(self, line):
+    parts = line.split()
+    command = parts[0]
+    if command in ("set", "add"):
+      self.pending = (command, parts[1], int(parts[2]), int(parts[4]))
+      self.setRawMode()
+    elif command in ("get", "gets"):
+      for key in parts[1:]:
+        if key in self.factory.values:
+          flags, data = self.factory.values[key]
+          self.sendLine("VALUE %s %d %d" % (key, flags, len(data)))
+          self.sendLine(data)
+      self.sendLine("END")
+    elif command == "delete":
+      self.sendLine(self.factory.values.pop(parts[1], None) and "DELETED" or "NOT_FOUND")
+    else:
+      self.sendLine("ERROR")
+
+  def rawDataReceived(self, data):
+    command, key, flags, length = self.pending
+    self.pending = None
+    value, rest = data[:length], data[length + 2:]
+    if command == "add" and key in self.factory.values:
+      self.sendLine("NOT_STORED")
+    else:
+      self.factory.values[key] = (flags, value)
+      self.sendLine("STORED")
+    self.setLineMode(rest)
+
+def resultOf(d):
+  """Return the result of a Deferred that has already fired."""
+  results = []
+  d.addCallback(results.append)
+  return results[0]
+
+class MemoryCacheStoreTest(unittest.TestCase):
+
+  def test_whenGetAfterSetThenValue(self):
+    store = MemoryCacheStore(10)
+    store.set("a", {"name": "x"}, 60)
+    self.assertEqual(resultOf(store.get("a")), {"name": "x"})
+    self.assertEqual(resultOf(store.get("b")), None)
+
+  def test_whenExpiredThenNone(self):
+    store = MemoryCacheStore(10)
+    store.set("a", 1, 60)
+    store.values["a"][0] = 0
+    self.assertEqual(resultOf(store.get("a")), None)
+
+  def test_whenFullThenLeastRecentlyUsedDropped(self):
+    store = MemoryCacheStore(3)
+    for key in ("a", "b", "c"):
+      store.set(key, key, 60)
+    store.get("a")
+    store.set("d", "d", 60)
+    self.assertEqual(sorted(resultOf(store.getMulti(["a", "b", "c", "d"])).keys()),
+      ["a", "c", "d"])
+
+  def test_whenTooManyBytesThenLeastRecentlyUsedDropped(self):
+    store = MemoryCacheStore(10, 350)
+    for key in ("a", "b", "c"):
+      store.set(key, key * 99, 60)
+    store.get("a")
+    store.set("d", "d" * 99, 60)
+    self.assertEqual(sorted(resultOf(store.getMulti(["a", "b", "c", "d"])).keys()),
+      ["a", "c", "d"])
+    self.assertEqual(store.size, 300)
+
+  def test_whenValueLargerThanStoreThenNotKept(self):
+    store = MemoryCacheStore(10, 400)
+    store.set("a", "a" * 99, 60)
+    self.assertFalse(resultOf(store.set("b", "b" * 400, 60)))
+    self.assertEqual((sorted(store.values), store.size), (["a"], 100))
+
+  def test_whenReplacedOrDeletedThenSizeUpdated(self):
+    store = MemoryCacheStore(10, 400)
+    store.set("a", "a" * 99, 60)
+    store.set("a", "a" * 9, 60)
+    self.assertEqual(store.size, 10)
+    store.delete("a")
+    self.assertEqual(store.size, 0)
+
+  def test_whenAddExistingThenUnchanged(self):
+    store = MemoryCacheStore(10)
+    store.set("a", 1, 60)
+    self.assertFalse(resultOf(store.add("a", 2, 60)))
+    self.assertEqual(resultOf(store.get("a")), 1)
+
+class MemcachedCacheStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    factory = Factory()
+    factory.protocol = FakeMemcached
+    factory.values = {}
+    self.values = factory.values
+    self.server = reactor.listenTCP(0, factory, interface="127.0.0.1")
+    self.store = MemcachedCacheStore(["127.0.0.1:%d" % self.server.getHost().port], "test:")
+
+  def tearDown(self):
+    for connection in self.store.connections.values():
+      connection.transport.loseConnection()
+    return self.server.stopListening()
+
+  def test_whenGetAfterSetThenValue(self):
+    value = {"name": {"type": "char", "string": u"N\xe4me"}, "ids": [1, 2]}
+    d = self.store.set("meta:demo/res.partner:fields", value, 60)
+    d.addCallback(lambda stored: self.assertTrue(stored))
+    d.addCallback(lambda _: self.store.get("meta:demo/res.partner:fields"))
+    d.addCallback(self.assertEqual, value)
+    return d
+
+  def test_whenKeyHasSpacesThenHashed(self):
+    d = self.store.set("response:/demo/res.partner?a b", "x", 60)
+    def check(_):
+      self.assertEqual(len(self.values), 1)
+      key = self.values.keys()[0]
+      self.assertTrue(key.startswith("test:"))
+      self.assertFalse(" " in key)
+    return d.addCallback(check)
+
+  def test_whenGetMultiThenPresentValues(self):
+    d = self.store.set("a", 1, 60)
+    d.addCallback(lambda _: self.store.set("b", [2], 60))
+    d.addCallback(lambda _: self.store.getMulti(["a", "b", "c"]))
+    d.addCallback(self.assertEqual, {"a": 1, "b": [2]})
+    return d
+
+  def test_whenAddExistingThenNotStored(self):
+    d = self.store.add("a", 1, 60)
+    d.addCallback(lambda _: self.store.add("a", 2, 60))
+    d.addCallback(lambda stored: self.assertFalse(stored))
+    d.addCallback(lambda _: self.store.get("a"))
+    d.addCallback(self.assertEqual, 1)
+    return d
+
+  def test_whenDeletedThenNone(self):
+    d = self.store.set("a", 1, 60)
+    d.addCallback(lambda _: self.store.delete("a"))
+    d.addCallback(lambda _: self.store.get("a"))
+    d.addCallback(self.assertEqual, None)
+    return d
+
+  def test_whenServerDownThenEmpty(self):
+    d = self.server.stopListening()
+    d.addCallback(lambda _: self.store.get("a"))
+    d.addCallback(self.assertEqual, None)
+    d.addCallback(lambda _: self.store.set("a", 1, 60))
+    d.addCallback(lambda stored: self.assertFalse(stored))
+    return d
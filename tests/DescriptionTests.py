@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import gc
+
+from twisted.trial import unittest
+
+from restfulOpenErpProxy import DescriptionTable
+
+ARCH = '<form string="Partner"><button name="confirm" string="Confirm" states="draft"/></form>'
+
+class DescriptionTableTest(unittest.TestCase):
+
+  def setUp(self):
+    self.table = DescriptionTable()
+
+  def _desc(self):
+    return {"name": {"type": "char", "string": "Name"},
+            "state": {"type": "selection", "selection": [["draft", "Draft"], ["done", "Done"]]}}
+
+  def test_whenSameContentThenSameObject(self):
+    first = self.table.getDescription(self._desc())
+    second = self.table.getDescription(self._desc())
+    self.assertIdentical(first, second)
+    self.assertEqual(first, self._desc())
+    self.assertNotEqual(first.hash, None)
+
+  def test_whenDifferentContentThenDifferentObject(self):
+    other = self._desc()
+    other["ref"] = {"type": "char", "string": "Reference"}
+    first = self.table.getDescription(self._desc())
+    second = self.table.getDescription(other)
+    self.assertNotIdentical(first, second)
+    self.assertNotEqual(first.hash, second.hash)
+
+  def test_whenSameArchThenSameButtons(self):
+    first = self.table.getButtons(ARCH)
+    self.assertIdentical(first, self.table.getButtons(unicode(ARCH)))
+    self.assertEqual([b.attrib["name"] for b in first], ["confirm"])
+
+  def test_whenUnusedThenDropped(self):
+    desc = self.table.getDescription(self._desc())
+    self.assertEqual(len(self.table.descriptions), 1)
+    del desc
+    gc.collect()
+    self.assertEqual(len(self.table.descriptions), 0)
+
+WORKFLOW_ARCH = '''<form string="Order">
+  <button name="confirm" string="Confirm" states="draft,sent"/>
+  <button name="cancel" string="Cancel"/>
+  <button name="42" string="Wizard" type="action"/>
+  <button name="done" string="Done" states="confirmed"/>
+</form>'''
+
+class ButtonListTest(unittest.TestCase):
+
+  def setUp(self):
+    self.buttons = DescriptionTable().getButtons(WORKFLOW_ARCH)
+
+  def _names(self, item):
+    return [name for name, button, linkStart, linkEnd in self.buttons.getActions(item)]
+
+  def test_whenStateNamedThenItsActions(self):
+    self.assertEqual(self._names({"state": "sent"}), ["confirm", "cancel"])
+    self.assertEqual(self._names({"state": "confirmed"}), ["cancel", "done"])
+
+  def test_whenStateUnknownThenActionsWithoutStates(self):
+    self.assertEqual(self._names({"state": "other"}), ["cancel"])
+    self.assertEqual(self._names({"state": False}), ["cancel"])
+
+  def test_whenNoStateThenAllNamedActions(self):
+    self.assertEqual(self._names({}), ["confirm", "cancel", "done"])
+
+  def test_whenFindingActionThenOnlyIfAllowed(self):
+    self.assertEqual(self.buttons.findAction({"state": "draft"}, "confirm").attrib["string"], "Confirm")
+    self.assertEqual(self.buttons.findAction({"state": "done"}, "confirm"), None)
+    self.assertEqual(self.buttons.findAction({}, "42"), None)
+
+  def test_whenRenderedThenLinkAroundPath(self):
+    name, button, linkStart, linkEnd = self.buttons.getActions({"state": "draft"})[0]
+    self.assertEqual(linkStart + "/demo/sale.order/1" + linkEnd,
+      "  <link rel='confirm' href='/demo/sale.order/1/confirm' title='Confirm' />\n")
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import xmlrpclib, ConfigParser
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from restfulOpenErpProxy import AccessFingerprints, OpenErpModelResource, MetadataScheduler
+
+from tests import InvalidationTests
+from tests.ResponseCacheTests import FakeCacheStore
+
+class FakeBackend(object):
+  def __init__(self, users):
+    self.users = users
+    self.calls = []
+
+  def callRemote(self, service, method, dbname, uid, pwd, model, function, ids, fields):
+    self.calls.append((dbname, uid))
+    if not uid in self.users:
+      return defer.fail(xmlrpclib.Fault("AccessError", "not allowed"))
+    return defer.succeed([self.users[uid]])
+
+class AccessFingerprintsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.backend = FakeBackend({
+      1: {"id": 1, "groups_id": [3, 1], "company_id": [1, "Company"]},
+      2: {"id": 2, "groups_id": [1, 3], "company_id": [1, "Company"]},
+      3: {"id": 3, "groups_id": [1, 3], "company_id": [2, "Other"]}})
+    config = ConfigParser.RawConfigParser()
+    config.add_section("Cache")
+    config.set("Cache", "max_fingerprints", "2")
+    self.fingerprints = AccessFingerprints(self.backend, config)
+
+  def _get(self, uid):
+    results = []
+    self.fingerprints.get("demo", uid, "pwd").addCallback(results.append)
+    return results[0]
+
+  def test_whenSameGroupsAndCompanyThenSameFingerprint(self):
+    self.assertEqual(self._get(1), self._get(2))
+    self.assertNotEqual(self._get(1), self._get(3))
+
+  def test_whenAskedAgainThenNotFetchedAgain(self):
+    self._get(1)
+    self._get(1)
+    self.assertEqual(self.backend.calls, [("demo", 1)])
+
+  def test_whenGroupsUnreadableThenPerUser(self):
+    self.assertEqual(self._get(7), "u7")
+
+  def test_whenFullThenOldestDropped(self):
+    for uid in (1, 2, 3):
+      self._get(uid)
+    self.assertEqual(len(self.fingerprints.fingerprints), 2)
+    self.assertTrue(("demo", 3) in self.fingerprints.fingerprints)
+
+class UserBackend(InvalidationTests.FakeBackend):
+  """Knows users 1 and 2 (who have the same groups and company); the
+  default values may depend on the user."""
+  fields = dict(InvalidationTests.FakeBackend.fields)
+  fields["user_id"] = {"type": "many2one", "relation": "res.users"}
+
+  def __init__(self, defaultUser):
+    InvalidationTests.FakeBackend.__init__(self)
+    self.defaultUser = defaultUser
+    self.defaultGets = []
+
+  def login(self, db, user, pwd):
+    return int(user[-1])
+
+  def execute(self, db, uid, pwd, model, method, *args):
+    if method == "default_get":
+      self.defaultGets.append(uid)
+      return {"name": "New", "user_id": self.defaultUser and uid}
+    return InvalidationTests.FakeBackend.execute(self, db, uid, pwd, model, method, *args)
+
+class UserRequest(InvalidationTests.FakeRequest):
+  def __init__(self, user, path):
+    InvalidationTests.FakeRequest.__init__(self, "GET", path)
+    self.user = user
+
+  def getUser(self):
+    return self.user
+
+class SharedDefaultsTest(unittest.TestCase):
+  """Two model resources with a shared cache store act as two proxy
+  processes."""
+
+  def setUp(self):
+    self.store = FakeCacheStore()
+    self.store.shared = True
+    self.schedulers = []
+
+  def tearDown(self):
+    for scheduler in self.schedulers:
+      scheduler.stop()
+
+  def _makeResource(self, backend, shared):
+    config = ConfigParser.RawConfigParser()
+    config.add_section("Cache")
+    if shared:
+      config.set("Cache", "shared_defaults", "res.partner")
+    scheduler = MetadataScheduler(config, task.Clock())
+    self.schedulers.append(scheduler)
+    return OpenErpModelResource(backend, "demo", "res.partner", config, None, self.store,
+      metadataScheduler=scheduler)
+
+  def _getDefaults(self, resource, user):
+    request = UserRequest(user, "/defaults")
+    resource.render_GET(request)
+    self.assertEqual(request.code, 200, "".join(request.body))
+    return "".join(request.body)
+
+  def _getDefaultsKeys(self):
+    return sorted([k.split(":")[-1] for k in self.store.values if ":defaults:" in k])
+
+  def test_whenNotSharedThenPerUser(self):
+    backend = UserBackend(False)
+    first, second = self._makeResource(backend, False), self._makeResource(backend, False)
+    self._getDefaults(first, "user1")
+    self._getDefaults(second, "user2")
+    self._getDefaults(second, "user1")
+    self.assertEqual(backend.defaultGets, [1, 2])
+    self.assertEqual(self._getDefaultsKeys(), ["u1", "u2"])
+    self.assertEqual(sorted(second.defaults), ["u1", "u2"])
+
+  def test_whenSharedThenPerFingerprint(self):
+    backend = UserBackend(False)
+    first, second = self._makeResource(backend, True), self._makeResource(backend, True)
+    self._getDefaults(first, "user1")
+    self._getDefaults(second, "user2")
+    self.assertEqual(backend.defaultGets, [1])
+    self.assertEqual(self._getDefaultsKeys(), ["g1-c1"])
+
+  def test_whenSharedButContainingUserThenPerUser(self):
+    backend = UserBackend(True)
+    first, second = self._makeResource(backend, True), self._makeResource(backend, True)
+    self.assertTrue("/res.users/1'" in self._getDefaults(first, "user1"))
+    self.assertEqual(self._getDefaultsKeys(), ["u1"])
+    self.assertFalse(first.sharedDefaults)
+    # the other process still shares them, but cannot find any
+    self.assertTrue("/res.users/2'" in self._getDefaults(second, "user2"))
+    self.assertEqual(backend.defaultGets, [1, 2])
+    self.assertEqual(self._getDefaultsKeys(), ["u1", "u2"])
+    self.assertFalse(second.sharedDefaults)
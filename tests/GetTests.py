@@ -36,6 +36,14 @@ class GetResponseCodesTest(OpenErpProxyTest):
         None)
     return d.addCallback(self._checkResponseCode, 405)
 
+  def test_whenHealthWithoutAuthThen200(self):
+    d = self.agent.request(
+        'GET',
+        'http://localhost:8068/_health',
+        Headers({}),
+        None)
+    return d.addCallback(self._checkResponseCode, 200)
+
   ## test collection
 
   def test_whenWrongAuthToProperCollectionThen403(self):
@@ -98,6 +106,20 @@ class GetResponseCodesTest(OpenErpProxyTest):
         None)
     return d.addCallback(self._checkResponseCode, 200)
 
+  def _checkCacheHeaders(self, response):
+    self.assertEqual(response.code, 200)
+    self.assertEqual(response.headers.getRawHeaders("Cache-Control")[0][:8], "private,")
+    self.assertEqual(response.headers.getRawHeaders("Vary")[0], "Authorization, Accept, Accept-Language")
+    self.assertTrue(response.headers.hasHeader("Expires"))
+
+  def test_whenAccessToProperResourceThenCacheHeaders(self):
+    d = self.agent.request(
+        'GET',
+        'http://localhost:8068/' + self.db + '/res.partner/4',
+        Headers({'Authorization': ['Basic %s' % self.basic]}),
+        None)
+    return d.addCallback(self._checkCacheHeaders)
+
   def test_whenAccessToInvalidResourceThen404(self):
     d = self.agent.request(
         'GET',
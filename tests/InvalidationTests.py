@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import ConfigParser
+from StringIO import StringIO
+
+from lxml import etree
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.web.http_headers import Headers
+
+from restfulOpenErpProxy import OpenErpModelResource, ResponseCache, MetadataScheduler
+
+from tests.ResponseCacheTests import FakeCacheStore
+
+COLLECTION = "http://localhost:8068/demo/res.partner"
+NS = "{%s/schema}" % COLLECTION
+
+class FakeBackend(object):
+  """Answers the calls of a model resource like OpenERP would, for a
+  small set of partners, and counts the reads."""
+  fields = {"name": {"type": "char", "required": True},
+            "state": {"type": "char"},
+            "parent_id": {"type": "many2one", "relation": "res.partner"}}
+
+  def __init__(self):
+    self.partners = {}
+    for i in (1, 2, 3):
+      self.partners[i] = {"id": i, "name": "Partner %d" % i, "state": "draft", "parent_id": False,
+        "__last_update": "2013-01-01 20:41:36.123456"}
+    self.partners[3]["parent_id"] = [1, "Partner 1"]
+    self.reads = 0
+
+  def callRemote(self, service, method, *args):
+    return defer.maybeDeferred(getattr(self, method), *args)
+
+  def login(self, db, user, pwd):
+    return 1
+
+  def exec_workflow(self, db, uid, pwd, model, signal, id):
+    self.partners[id]["state"] = "confirmed"
+    return True
+
+  def execute(self, db, uid, pwd, model, method, *args):
+    if model == "res.users":
+      return [{"id": uid, "groups_id": [1], "company_id": [1, "Company"]}]
+    if method == "fields_get":
+      return dict(self.fields)
+    elif method == "fields_view_get":
+      return {"arch": '<form><button name="confirm" string="Confirm" states="draft" /></form>'}
+    elif method == "default_get":
+      return {}
+    elif method == "search":
+      return sorted(self.partners)
+    elif method == "read":
+      self.reads += 1
+      fields = len(args) > 1 and args[1] or []
+      items = []
+      for i in args[0]:
+        if i in self.partners:
+          item = dict(self.partners[i])
+          if fields:
+            item = dict([(k, v) for k, v in item.items() if k in fields or k == "id"])
+          else:
+            # only given when asked for explicitly
+            del item["__last_update"]
+          items.append(item)
+      return items
+    elif method == "create":
+      i = max(self.partners) + 1
+      self.partners[i] = {"id": i, "name": args[0]["name"], "state": "draft",
+        "parent_id": args[0].get("parent_id") and [args[0]["parent_id"], "Parent"] or False,
+        "__last_update": "2013-01-01 20:41:36.123456"}
+      return i
+    elif method == "write":
+      for i in args[0]:
+        values = dict(args[1])
+        if values.get("parent_id"):
+          values["parent_id"] = [values["parent_id"], "Parent"]
+        self.partners[i].update(values)
+      return True
+    raise ValueError(method)
+
+class FakeRequest(object):
+
+  def __init__(self, method, path="", body=None):
+    self.method = method
+    self.uri = "/demo/res.partner" + path
+    self.postpath = [p for p in path.split("/") if p]
+    self.args = {}
+    self.requestHeaders = Headers({"Host": ["localhost:8068"]})
+    self.responseHeaders = Headers()
+    self.content = body is not None and StringIO(body) or None
+    self.code = 200
+    self.body = []
+    self.finished = defer.Deferred()
+
+  def URLPath(self):
+    return COLLECTION
+
+  def isSecure(self):
+    return False
+
+  def getUser(self):
+    return "admin"
+
+  def getPassword(self):
+    return "admin"
+
+  def getHeader(self, name):
+    values = self.requestHeaders.getRawHeaders(name)
+    return values and values[-1] or None
+
+  def setHeader(self, name, value):
+    self.responseHeaders.setRawHeaders(name, [value])
+
+  def setResponseCode(self, code, message=None):
+    self.code = code
+
+  def write(self, data):
+    self.body.append(data)
+
+  def finish(self):
+    self.finished.callback(None)
+
+  def notifyFinish(self):
+    return defer.Deferred()
+
+class InvalidationTest(unittest.TestCase):
+
+  def setUp(self):
+    config = ConfigParser.RawConfigParser()
+    config.add_section("Cache")
+    config.set("Cache", "max_age", "60")
+    self.clock = task.Clock()
+    self.clock.advance(1000)
+    self.backend = FakeBackend()
+    self.responseCache = ResponseCache(config, FakeCacheStore(), self.clock)
+    self.scheduler = MetadataScheduler(config, self.clock)
+    self.resource = OpenErpModelResource(self.backend, "demo", "res.partner", config,
+      self.responseCache, metadataScheduler=self.scheduler)
+
+  def tearDown(self):
+    self.scheduler.stop()
+
+  def request(self, method, path="", body=None):
+    request = FakeRequest(method, path, body)
+    getattr(self.resource, "render_" + method)(request)
+    self.assertTrue(request.finished.called, "%s %s not finished" % (method, path))
+    return request
+
+  def get(self, path=""):
+    """GET `path` and return the body and whether it was read from OpenERP."""
+    reads = self.backend.reads
+    request = self.request("GET", path)
+    self.assertEqual(request.code, 200)
+    return "".join(request.body), self.backend.reads > reads
+
+  def getName(self, i):
+    body, fetched = self.get("/%d" % i)
+    return etree.fromstring(body).findtext(".//" + NS + "name"), fetched
+
+  def put(self, i, name, parent=None):
+    body, fetched = self.get("/%d" % i)
+    item = etree.fromstring(body).find(".//" + NS + "res_partner")
+    item.find(NS + "name").text = name
+    if parent is not None:
+      link = item.find(NS + "parent_id").find("{http://www.w3.org/2005/Atom}link")
+      link.set("href", "%s/%d" % (COLLECTION, parent))
+    request = self.request("PUT", "/%d" % i, etree.tostring(item))
+    self.assertEqual(request.code, 204, "".join(request.body))
+
+  def test_whenNothingChangedThenServedFromCache(self):
+    self.assertEqual(self.getName(1), ("Partner 1", True))
+    self.assertEqual(self.getName(1), ("Partner 1", False))
+    self.assertEqual(self.get()[1], True)
+    self.assertEqual(self.get()[1], False)
+
+  def test_whenUpdatedThenItemAndFeedFetchedAgain(self):
+    self.get()
+    self.getName(1)
+    self.getName(2)
+    self.put(1, "Changed")
+    self.assertEqual(self.getName(1), ("Changed", True))
+    self.assertTrue("Changed" in self.get()[0])
+    # other items are not affected
+    self.assertEqual(self.getName(2), ("Partner 2", False))
+
+  def test_whenParentChangedThenOldAndNewParentFetchedAgain(self):
+    for i in (1, 2, 3):
+      self.getName(i)
+    # 3 moves from 1 to 2
+    self.put(3, "Partner 3", 2)
+    self.assertEqual(self.getName(1)[1], True)
+    self.assertEqual(self.getName(2)[1], True)
+    self.assertEqual(self.getName(3)[1], True)
+
+  def test_whenCreatedThenFeedAndParentFetchedAgain(self):
+    self.get()
+    self.getName(1)
+    self.getName(2)
+    body = etree.tostring(etree.fromstring(self.get("/defaults")[0]).find(".//" + NS + "res_partner"))
+    item = etree.fromstring(body)
+    item.find(NS + "name").text = "New"
+    parent = etree.SubElement(item.find(NS + "parent_id"), "{http://www.w3.org/2005/Atom}link")
+    parent.set("href", COLLECTION + "/1")
+    request = self.request("POST", "", etree.tostring(item))
+    self.assertEqual(request.code, 201, "".join(request.body))
+    body, fetched = self.get()
+    self.assertTrue(fetched)
+    self.assertTrue("New" in body)
+    self.assertEqual(self.getName(1)[1], True)
+    self.assertEqual(self.getName(2)[1], False)
+
+  def test_whenWorkflowExecutedThenItemAndFeedFetchedAgain(self):
+    self.get()
+    self.getName(1)
+    request = self.request("POST", "/1/confirm")
+    self.assertEqual(request.code, 204, "".join(request.body))
+    body, fetched = self.get("/1")
+    self.assertTrue(fetched)
+    self.assertEqual(etree.fromstring(body).findtext(".//" + NS + "state"), "confirmed")
+    self.assertEqual(self.get()[1], True)
+
+  def test_whenStoredAfterConcurrentWriteThenNotServed(self):
+    # a response is rendered from data read before the item was changed
+    #  and only stored afterwards; it must not be served as current
+    versions = self.responseCache.getVersions(["/demo/res.partner/1"])
+    self.responseCache.invalidate("demo", "res.partner", [1])
+    request = FakeRequest("GET", "/1")
+    request.setHeader("Content-Type", "application/atom+xml")
+    versions.addCallback(lambda v: self.responseCache.store(request, self.responseCache.getPolicy(
+      "demo", "res.partner", "item"), "<old />", v))
+    self.assertEqual(self.getName(1), ("Partner 1", True))
+
+  def test_whenVersionForgottenThenEntryNotServed(self):
+    self.getName(1)
+    # the store drops the version of the tag, but keeps the entry
+    del self.responseCache.cacheStore.values["tag:/demo/res.partner/1"]
+    self.assertEqual(self.getName(1)[1], True)
+    self.assertEqual(self.getName(1)[1], False)
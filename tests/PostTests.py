@@ -123,6 +123,24 @@ class PostResponseCodesTest(OpenErpProxyTest):
         None)
     return d.addCallback(self._checkResponseCode, 400)
 
+  ## test workflows on many items
+
+  def test_whenBatchWorkflowWithUnknownWorkflowThen400(self):
+    d = self.agent.request(
+        'POST',
+        'http://localhost:8068/' + self.db + '/res.partner/abc',
+        Headers({'Authorization': ['Basic %s' % self.basic]}),
+        StringProducer("4"))
+    return d.addCallback(self._checkResponseCode, 400)
+
+  def test_whenBatchWorkflowWithInvalidItemThen400(self):
+    d = self.agent.request(
+        'POST',
+        'http://localhost:8068/' + self.db + '/sale.order/order_confirm',
+        Headers({'Authorization': ['Basic %s' % self.basic]}),
+        StringProducer("http://localhost:8068/" + self.db + "/res.partner/4"))
+    return d.addCallback(self._checkResponseCode, 400)
+
   # NB. we do not have a simple test for "whenAccessToProperCollection" since
   #  this situation is much more difficult
 
@@ -271,5 +289,14 @@ class PostCorrectValidationsTest(OpenErpProxyTest):
         None)
     return d1.addCallback(self._doSomethingWithBody, insertData)
 
+  def test_whenFeedWithEmptyEntryThen200(self):
+    xml = """<feed xmlns="http://www.w3.org/2005/Atom"><entry><content /></entry></feed>"""
+    d = self.agent.request(
+        'POST',
+        'http://localhost:8068/' + self.db + '/res.partner',
+        Headers({'Authorization': ['Basic %s' % self.basic]}),
+        StringProducer(xml))
+    return d.addCallback(self._checkResponse, 200, """<?xml version="1.0" encoding="utf-8"?>\n<results>\n  <result status='400'>invalid XML:""")
+
 # TODO: test many2many and one2many fields
 
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import xmlrpclib
+import ConfigParser
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from restfulOpenErpProxy import OpenErpDispatcher
+
+ARCH = '<form string="Model"><button name="confirm" string="Confirm" states="draft"/></form>'
+
+class PrewarmBackend(object):
+  """Keeps the answers to fields_get in `pending` until they are given
+  with `answer()`; fails for models in `broken`."""
+
+  def __init__(self):
+    self.calls = []
+    self.pending = []
+    self.broken = set()
+
+  def callRemote(self, service, method, *args):
+    self.calls.append((method,) + args[:1] + args[3:5])
+    if method == "login":
+      return defer.succeed(1)
+    model, method = args[3:5]
+    if model == "ir.model" and method == "search":
+      return defer.succeed([1, 2])
+    elif model == "ir.model" and method == "read":
+      return defer.succeed([{"id": 1, "model": "res.partner"}, {"id": 2, "model": "product.product"}])
+    elif method == "fields_get":
+      d = defer.Deferred()
+      self.pending.append((model, d))
+      return d
+    elif method == "fields_view_get":
+      return defer.succeed({"arch": ARCH})
+    return defer.fail(ValueError(method))
+
+  def answer(self):
+    model, d = self.pending.pop(0)
+    if model in self.broken:
+      d.errback(xmlrpclib.Fault("warning -- Object Error", "no such model"))
+    else:
+      d.callback({"name": {"type": "char", "string": "Name"}})
+
+class PrewarmTest(unittest.TestCase):
+
+  def setUp(self):
+    self.config = ConfigParser.RawConfigParser()
+    self.config.add_section("Prewarm")
+    self.config.set("Prewarm", "user", "admin")
+    self.config.set("Prewarm", "password", "admin")
+    self.config.set("Prewarm", "databases", "demo")
+    self.config.set("Prewarm", "concurrency", "2")
+    self.dispatcher = OpenErpDispatcher("http://localhost:8069", self.config)
+    self.backend = PrewarmBackend()
+    self.dispatcher.backend = self.backend
+
+  def tearDown(self):
+    self.dispatcher.metadataScheduler.stop()
+
+  def getModel(self, model):
+    return self.dispatcher.databases["demo"].models[model]
+
+  def test_whenModelsConfiguredThenWarmedTwoAtATime(self):
+    self.config.set("Prewarm", "models", "res.partner broken.model product.product")
+    self.backend.broken.add("broken.model")
+    done = []
+    self.dispatcher.prewarm().addCallback(done.append)
+    self.assertEqual([model for model, d in self.backend.pending], ["res.partner", "broken.model"])
+    self.backend.answer()
+    self.assertEqual([model for model, d in self.backend.pending], ["broken.model", "product.product"])
+    self.backend.answer()
+    self.backend.answer()
+    self.assertEqual(len(done), 1)
+    # the broken model does not keep the others from being warmed
+    for model in ("res.partner", "product.product"):
+      self.assertEqual(self.getModel(model).desc, {"name": {"type": "char", "string": "Name"}})
+      self.assertEqual([b.attrib["name"] for b in self.getModel(model).workflowDesc], ["confirm"])
+    self.assertEqual(self.getModel("broken.model").desc, {})
+
+  def test_whenAllModelsThenListedFromIrModel(self):
+    self.dispatcher.prewarm()
+    self.assertEqual([model for model, d in self.backend.pending], ["product.product", "res.partner"])
+    self.assertEqual(self.backend.calls[:3], [("login", "demo"), ("execute", "demo", "ir.model", "search"),
+      ("execute", "demo", "ir.model", "read")])
+
+  def test_whenNoUserThenNothingWarmed(self):
+    self.config.remove_option("Prewarm", "user")
+    self.dispatcher.prewarm()
+    self.assertEqual(self.backend.calls, [])
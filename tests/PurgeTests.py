@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import ConfigParser
+
+from twisted.trial import unittest
+from twisted.web.server import Site
+from twisted.web.resource import Resource
+from twisted.internet import reactor
+
+from restfulOpenErpProxy import CachePurger, tagToSurrogateKey
+
+class RecordingCache(Resource):
+  """Stands in for an HTTP cache and records the requests it receives."""
+  isLeaf = True
+
+  def __init__(self):
+    Resource.__init__(self)
+    self.received = []
+    self.codes = []
+
+  def render(self, request):
+    self.received.append((request.method, request.uri, request.requestHeaders))
+    if self.codes:
+      request.setResponseCode(self.codes.pop(0))
+    return ""
+
+class CachePurgerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.cache = RecordingCache()
+    self.server = reactor.listenTCP(0, Site(self.cache), interface="127.0.0.1")
+    self.url = "http://127.0.0.1:%d" % self.server.getHost().port
+
+  def tearDown(self):
+    return self.server.stopListening()
+
+  def _makePurger(self, **options):
+    config = ConfigParser.RawConfigParser()
+    config.add_section("Purge")
+    config.set("Purge", "urls", self.url)
+    config.set("Purge", "retry_delay", "0.01")
+    for key, value in options.iteritems():
+      config.set("Purge", key, value)
+    return CachePurger(config)
+
+  def test_whenSurrogateKeyThenFeedOrId(self):
+    self.assertEqual(tagToSurrogateKey("/demo/res.partner"), "demo/res.partner:feed")
+    self.assertEqual(tagToSurrogateKey("/demo/res.partner/7"), "demo/res.partner:7")
+
+  def test_whenPurgeModeThenOneRequestPerTag(self):
+    purger = self._makePurger()
+    purger.invalidated(["/demo/res.partner", "/demo/res.partner/7"])
+    purger.invalidated(["/demo/res.partner"])
+    def check(result):
+      self.assertEqual(sorted([(m, uri) for m, uri, h in self.cache.received]),
+        [("PURGE", "/demo/res.partner"), ("PURGE", "/demo/res.partner/7")])
+    return purger.flush().addCallback(check)
+
+  def test_whenBanModeThenOneRegexForAllTags(self):
+    purger = self._makePurger(mode="ban", host="erp.example.com")
+    purger.invalidated(["/demo/res.partner", "/demo/res.partner/7"])
+    def check(result):
+      self.assertEqual(len(self.cache.received), 1)
+      method, uri, headers = self.cache.received[0]
+      self.assertEqual((method, uri), ("BAN", "/"))
+      self.assertEqual(headers.getRawHeaders("host"), ["erp.example.com"])
+      regex = headers.getRawHeaders("x-ban-url")[0]
+      self.assertIn("res\\.partner", regex)
+      self.assertTrue(regex.startswith("^("))
+    return purger.flush().addCallback(check)
+
+  def test_whenXkeyModeThenSurrogateKeysInHeader(self):
+    purger = self._makePurger(mode="xkey")
+    purger.invalidated(["/demo/res.partner", "/demo/res.partner/7"])
+    def check(result):
+      self.assertEqual(len(self.cache.received), 1)
+      method, uri, headers = self.cache.received[0]
+      self.assertEqual((method, uri), ("PURGE", "/"))
+      self.assertEqual(headers.getRawHeaders("xkey-purge"),
+        ["demo/res.partner:feed demo/res.partner:7"])
+    return purger.flush().addCallback(check)
+
+  def test_whenCacheFailsThenRetry(self):
+    self.cache.codes = [503]
+    purger = self._makePurger()
+    purger.invalidated(["/demo/res.partner"])
+    def check(result):
+      self.assertEqual([uri for m, uri, h in self.cache.received],
+        ["/demo/res.partner", "/demo/res.partner"])
+    return purger.flush().addCallback(check)
+
+  def test_whenUnknownModeThenError(self):
+    self.assertRaises(ValueError, self._makePurger, mode="refresh")
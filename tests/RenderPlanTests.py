@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import ConfigParser
+
+from lxml import etree
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+import restfulOpenErpProxy
+from restfulOpenErpProxy import RenderPlan, OpenErpModelResource, MetadataScheduler
+
+from tests.InvalidationTests import FakeBackend, FakeRequest
+
+PATH = "http://localhost:8068/demo/res.partner"
+
+class RenderPlanTest(unittest.TestCase):
+
+  def setUp(self):
+    self.plan = RenderPlan("res.partner", {
+      "name": {"type": "char", "required": True},
+      "active": {"type": "boolean"},
+      "parent_id": {"type": "many2one", "relation": "res.partner"},
+      "child_ids": {"type": "one2many", "relation": "res.partner"}}, PATH)
+
+  def test_whenCreatedThenNamesPrepared(self):
+    self.assertEqual(self.plan.ns, "rp")
+    self.assertEqual(self.plan.rootTag, "rp:res_partner")
+    self.assertEqual(self.plan.schema, PATH + "/schema")
+    self.assertEqual(self.plan.fieldsByName["parent_id"].relation, "http://localhost:8068/demo/res.partner")
+
+  def test_whenItemRenderedThenLinksAndComments(self):
+    xml = self.plan.renderItemFields({"parent_id": [2, "Parent"], "child_ids": [], "name": u"N\xe4me"}, PATH + "/1")
+    self.assertTrue("<link href='http://localhost:8068/demo/res.partner/2' />" in xml)
+    self.assertTrue("<rp:child_ids type='one2many' relation='http://localhost:8068/demo/res.partner'><!-- [] --></rp:child_ids>" in xml)
+    self.assertTrue("<rp:name type='char'>N\xc3\xa4me</rp:name>" in xml)
+
+  def test_whenDefaultsRenderedThenAllFields(self):
+    xml = self.plan.renderDefaultFields({"active": True})
+    self.assertTrue("<rp:active type='boolean'>True</rp:active>" in xml)
+    self.assertTrue("<rp:name type='char' />" in xml)
+    self.assertEqual(xml.count("\n"), 4)
+
+  def test_whenSchemaRequestedThenValidRelaxNGOnce(self):
+    schema = self.plan.getRelaxNG()
+    self.assertIdentical(schema, self.plan.getRelaxNG())
+    etree.RelaxNG(etree.fromstring(schema))
+
+  def test_whenBinaryFieldThenLinkedAndNotRead(self):
+    plan = RenderPlan("product.product", {"name": {"type": "char"}, "image": {"type": "binary"}}, PATH)
+    self.assertEqual(plan.readFields, ["name"])
+    xml = plan.renderItemFields({"name": "Mesh", "image": "iVBORw0KGgo="}, PATH + "/1")
+    self.assertTrue("<pp:image type='binary'>\n      <link href='%s/1/image' />\n    </pp:image>" % PATH in xml)
+    self.assertFalse("iVBORw0KGgo=" in xml)
+    self.assertEqual(self.plan.readFields, [])
+
+class OffloadTest(unittest.TestCase):
+
+  def setUp(self):
+    self.offloaded = []
+    deferToThread = restfulOpenErpProxy.threads.deferToThread
+
+    def spy(f, *args):
+      self.offloaded.append(f.__name__)
+      return deferToThread(f, *args)
+    self.patch(restfulOpenErpProxy.threads, "deferToThread", spy)
+    self.schedulers = []
+
+  def tearDown(self):
+    for scheduler in self.schedulers:
+      scheduler.stop()
+
+  def render(self, threshold, path):
+    """Return (a Deferred for) the status and body of a GET request for
+    `path`, rendered by a resource with the given `render_threshold`."""
+    config = ConfigParser.RawConfigParser()
+    config.add_section("Proxy Settings")
+    config.set("Proxy Settings", "render_threshold", str(threshold))
+    self.schedulers.append(MetadataScheduler(config, task.Clock()))
+    resource = OpenErpModelResource(FakeBackend(), "demo", "res.partner", config,
+      metadataScheduler=self.schedulers[-1])
+    request = FakeRequest("GET", path)
+    resource.render_GET(request)
+    return request.finished.addCallback(lambda _: (request.code, "".join(request.body)))
+
+  def _compare(self, path, offloaded):
+    def inline(result):
+      self.assertEqual(self.offloaded, [])
+      return self.render(1, path).addCallback(threaded, result)
+
+    def threaded(result, inlineResult):
+      self.assertEqual(set(self.offloaded), set(offloaded))
+      self.assertEqual(result[0], 200)
+      self.assertEqual(result, inlineResult)
+    return self.render(1000, path).addCallback(inline)
+
+  def test_whenItemAboveThresholdThenRenderedInThreadWithSameResult(self):
+    return self._compare("/1", ["__mkItemXml"])
+
+  def test_whenFeedAboveThresholdThenRenderedInThreadWithSameResult(self):
+    return self._compare("", ["__mkFeed"])
+
+  def test_whenDefaultsAboveThresholdThenRenderedInThreadWithSameResult(self):
+    return self._compare("/defaults", ["__mkDefaultXml"])
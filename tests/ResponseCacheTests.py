@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.web.http_headers import Headers
+
+from restfulOpenErpProxy import ResponseCache, CachePolicy, CacheStore, RefreshRequest, writeRanged
+
+class FakeCacheStore(CacheStore):
+  """Keeps values forever, so that only the cache decides what is too old."""
+  def __init__(self):
+    self.values = {}
+
+  def get(self, key):
+    return defer.succeed(self.values.get(key))
+
+  def getMulti(self, keys):
+    return defer.succeed(dict([(k, self.values[k]) for k in keys if k in self.values]))
+
+  def set(self, key, value, ttl):
+    self.values[key] = value
+    return defer.succeed(True)
+
+  def add(self, key, value, ttl):
+    if key in self.values:
+      return defer.succeed(False)
+    return self.set(key, value, ttl)
+
+  def delete(self, key):
+    return defer.succeed(self.values.pop(key, None) is not None)
+
+class FakeRequest(object):
+  method = "GET"
+
+  def __init__(self, uri="/demo/res.partner/1", headers={}):
+    self.uri = uri
+    self.args = {}
+    self.postpath = uri.split("/")[3:]
+    self.requestHeaders = Headers({"Host": ["localhost:8068"]})
+    for name, value in headers.items():
+      self.requestHeaders.setRawHeaders(name, [value])
+    self.responseHeaders = Headers()
+    self.code = None
+    self.body = []
+    self.finished = False
+
+  def URLPath(self):
+    return "http://localhost:8068" + self.uri
+
+  def getUser(self):
+    return "admin"
+
+  def getPassword(self):
+    return "admin"
+
+  def getHeader(self, name):
+    values = self.requestHeaders.getRawHeaders(name)
+    return values and values[-1] or None
+
+  def getResponseHeader(self, name):
+    values = self.responseHeaders.getRawHeaders(name)
+    return values and values[-1] or None
+
+  def setHeader(self, name, value):
+    self.responseHeaders.setRawHeaders(name, [value])
+
+  def setResponseCode(self, code):
+    self.code = code
+
+  def write(self, data):
+    self.body.append(data)
+
+  def finish(self):
+    self.finished = True
+
+def resultOf(d):
+  """Return the result of a Deferred that has already fired."""
+  results = []
+  d.addCallback(results.append)
+  return results[0]
+
+class ResponseCacheServeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.clock.advance(1000)
+    self.cache = ResponseCache(None, FakeCacheStore(), self.clock)
+    self.policy = CachePolicy(60, 30, 300)
+    self.refreshes = []
+    request = FakeRequest()
+    request.setHeader("Content-Type", "text/xml")
+    self.cache.store(request, self.policy, "<item />", ())
+
+  def refresh(self, request):
+    d = defer.Deferred()
+    self.refreshes.append(d)
+    return d
+
+  def serve(self, request=None):
+    request = request or FakeRequest()
+    return request, resultOf(self.cache.serve(request, self.policy, self.refresh))
+
+  def test_whenNotCachedThenNotServed(self):
+    request, served = self.serve(FakeRequest("/demo/res.partner/2"))
+    self.assertEqual((served, request.body, request.finished), (False, [], False))
+
+  def test_whenFreshThenServedWithoutRefresh(self):
+    self.clock.advance(10)
+    request, served = self.serve()
+    self.assertEqual((served, request.code, request.body, request.finished), (True, 200, ["<item />"], True))
+    self.assertEqual(request.getResponseHeader("Content-Type"), "text/xml")
+    self.assertEqual(request.getResponseHeader("Age"), "10")
+    self.assertEqual(request.getResponseHeader("Warning"), None)
+    self.assertEqual(self.refreshes, [])
+
+  def test_whenStaleThenServedAndRefreshedOnce(self):
+    other = FakeRequest("/demo/res.partner/2")
+    self.cache.store(other, self.policy, "<other />", ())
+    self.clock.advance(70)
+    for i in range(3):
+      request, served = self.serve()
+      self.assertEqual((served, request.body), (True, ["<item />"]))
+      self.assertEqual(request.getResponseHeader("Warning"), '110 - "Response is Stale"')
+    self.assertEqual(len(self.refreshes), 1)
+    # another URL is refreshed on its own
+    self.serve(FakeRequest("/demo/res.partner/2"))
+    self.assertEqual(len(self.refreshes), 2)
+    self.refreshes[0].callback(None)
+    self.assertEqual(self.cache.refreshing, set([self.cache.getKey(other)]))
+    self.serve()
+    self.assertEqual(len(self.refreshes), 3)
+
+  def test_whenRefreshFailsThenRefreshedAgainNextTime(self):
+    self.clock.advance(70)
+    self.serve()
+    self.refreshes[0].errback(ValueError("OpenERP is down"))
+    self.assertEqual(self.cache.refreshing, set())
+    self.serve()
+    self.assertEqual(len(self.refreshes), 2)
+
+  def test_whenRefreshRaisesThenRefreshedAgainNextTime(self):
+    def refresh(request):
+      raise ValueError("broken")
+    self.clock.advance(70)
+    for i in range(2):
+      request = FakeRequest()
+      self.assertTrue(resultOf(self.cache.serve(request, self.policy, refresh)))
+    self.assertEqual(self.cache.refreshing, set())
+
+  def test_whenTooStaleThenNotServed(self):
+    self.clock.advance(91)
+    request, served = self.serve()
+    self.assertEqual((served, request.body, self.refreshes), (False, [], []))
+
+  def test_whenErrorThenStaleServedForAWhile(self):
+    self.clock.advance(200)
+    request = FakeRequest()
+    self.assertTrue(resultOf(self.cache.serveStale(request, self.policy)))
+    self.assertEqual(request.body, ["<item />"])
+    self.assertEqual(request.getResponseHeader("Age"), "200")
+    self.assertEqual(request.getResponseHeader("Warning"),
+      '110 - "Response is Stale", 111 - "Revalidation Failed"')
+    self.clock.advance(161)
+    request = FakeRequest()
+    self.assertFalse(resultOf(self.cache.serveStale(request, self.policy)))
+    self.assertEqual(request.body, [])
+
+class BinaryRefreshTest(unittest.TestCase):
+
+  body = "".join([chr(i % 256) for i in range(100000)])
+
+  def test_whenRefreshedThenWholeBodyCollected(self):
+    # the client only asked for a part it already has
+    client = FakeRequest("/demo/product.product/1/image", {"Range": "bytes=0-99", "If-None-Match": '"abc"'})
+    refreshRequest = RefreshRequest(client)
+    finished = []
+    refreshRequest.notifyFinish().addCallback(finished.append)
+    refreshRequest.setHeader("ETag", '"abc"')
+    writeRanged(refreshRequest, self.body, 1024)
+    self.assertEqual((refreshRequest.code, "".join(refreshRequest.body), finished), (200, self.body, [None]))
+    self.assertEqual(client.getHeader("Range"), "bytes=0-99")
+
+  def test_whenBinaryCachedThenRangeServed(self):
+    clock = task.Clock()
+    cache = ResponseCache(None, FakeCacheStore(), clock)
+    policy = CachePolicy(60, 0, 0)
+    refreshRequest = RefreshRequest(FakeRequest("/demo/product.product/1/image"))
+    refreshRequest.setHeader("ETag", '"abc"')
+    refreshRequest.setHeader("Accept-Ranges", "bytes")
+    cache.store(refreshRequest, policy, self.body, ())
+    request = FakeRequest("/demo/product.product/1/image", {"Range": "bytes=10-19"})
+    self.assertTrue(resultOf(cache.serve(request, policy, None)))
+    self.assertEqual((request.code, request.body), (206, [self.body[10:20]]))
+    self.assertEqual(request.getResponseHeader("Content-Range"), "bytes 10-19/100000")
+
+class CachePolicyTest(unittest.TestCase):
+
+  def test_whenNothingConfiguredThenNothingCached(self):
+    store = FakeCacheStore()
+    cache = ResponseCache(None, store, task.Clock())
+    for route in ("feed", "item", "binary", "schema", "defaults"):
+      policy = cache.getPolicy("demo", "res.partner", route)
+      self.assertEqual((policy.maxAge, policy.staleWhileRevalidate, policy.staleIfError), (0, 0, 0))
+      request = FakeRequest()
+      cache.store(request, policy, "<item />", ())
+      self.assertFalse(resultOf(cache.serve(request, policy, None)))
+    self.assertEqual(store.values, {})
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import ConfigParser
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from restfulOpenErpProxy import MetadataScheduler
+
+class FakeModelResource(object):
+  def __init__(self, dbname, model):
+    self.dbname = dbname
+    self.model = model
+    self.events = []
+
+  def markStale(self):
+    self.events.append("stale")
+
+  def clearCachedValues(self):
+    self.events.append("cleared")
+
+class MetadataSchedulerTest(unittest.TestCase):
+
+  def setUp(self):
+    config = ConfigParser.RawConfigParser()
+    config.add_section("Cache")
+    config.set("Cache", "metadata_ttl", "100")
+    config.set("Cache", "metadata_jitter", "0")
+    config.set("Cache", "metadata_max_stale", "10")
+    self.clock = task.Clock()
+    self.scheduler = MetadataScheduler(config, self.clock)
+    self.partner = FakeModelResource("demo", "res.partner")
+    self.product = FakeModelResource("demo", "product.product")
+
+  def tearDown(self):
+    self.scheduler.stop()
+
+  def test_whenTtlPassedThenStaleThenCleared(self):
+    self.scheduler.schedule(self.partner)
+    self.clock.advance(99)
+    self.assertEqual(self.partner.events, [])
+    self.assertEqual(int(self.scheduler.getRemaining(self.partner)), 1)
+    self.clock.advance(1)
+    self.assertEqual(self.partner.events, ["stale"])
+    self.assertEqual(self.scheduler.getRemaining(self.partner), 0)
+    self.clock.advance(10)
+    self.assertEqual(self.partner.events, ["stale", "cleared"])
+    self.assertEqual(self.scheduler.inspect(), [])
+
+  def test_whenRefetchedWhileStaleThenNotCleared(self):
+    self.scheduler.schedule(self.partner)
+    self.clock.advance(100)
+    self.scheduler.schedule(self.partner)
+    self.clock.advance(50)
+    self.assertEqual(self.partner.events, ["stale"])
+    self.assertEqual(self.scheduler.inspect(), [("demo", "res.partner", "fresh", 50)])
+
+  def test_whenEarlierScheduledLaterThenTimerMovedUp(self):
+    self.scheduler.schedule(self.partner)
+    self.scheduler.schedule(self.product, self.clock.seconds() - 50)
+    self.clock.advance(50)
+    self.assertEqual((self.partner.events, self.product.events), ([], ["stale"]))
+    self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+  def test_whenFlushedThenClearedAtOnce(self):
+    self.scheduler.schedule(self.partner)
+    self.scheduler.schedule(self.product)
+    self.assertEqual(self.scheduler.flush(model="res.partner"), 1)
+    self.assertEqual((self.partner.events, self.product.events), (["cleared"], []))
+    self.assertEqual(self.scheduler.flush(), 1)
+    self.clock.advance(200)
+    self.assertEqual(self.partner.events, ["cleared"])
+
+  def test_whenJitterThenExpiryWithinRange(self):
+    self.scheduler.jitter = 0.1
+    for i in range(20):
+      self.scheduler.schedule(FakeModelResource("demo", "m%d" % i))
+    for dbname, model, state, remaining in self.scheduler.inspect():
+      self.assertTrue(90 <= remaining <= 110)
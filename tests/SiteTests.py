@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import ConfigParser
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+from twisted.internet.protocol import ClientCreator
+from twisted.web.resource import Resource
+
+from restfulOpenErpProxy import OpenErpModelResource, OpenErpSite, MetadataScheduler
+
+from tests import PrinterClient
+from tests.InvalidationTests import FakeBackend
+
+class SlowBackend(FakeBackend):
+  """Does not answer searches; `cancelled` fires when one is cancelled."""
+
+  def __init__(self):
+    FakeBackend.__init__(self)
+    self.searching = defer.Deferred()
+    self.cancelled = defer.Deferred()
+
+  def execute(self, db, uid, pwd, model, method, *args):
+    if method == "search":
+      d = defer.Deferred(lambda d: self.cancelled.callback(None))
+      self.searching.callback(None)
+      return d
+    return FakeBackend.execute(self, db, uid, pwd, model, method, *args)
+
+class OpenErpSiteTest(unittest.TestCase):
+  # a client that has gone must be noticed at once
+  timeout = 10
+
+  def setUp(self):
+    config = ConfigParser.RawConfigParser()
+    config.add_section("Proxy Settings")
+    config.set("Proxy Settings", "deadline", "0")
+    self.backend = SlowBackend()
+    self.scheduler = MetadataScheduler(config, task.Clock())
+    root, db = Resource(), Resource()
+    root.putChild("demo", db)
+    db.putChild("res.partner", OpenErpModelResource(self.backend, "demo", "res.partner", config,
+      metadataScheduler=self.scheduler))
+    self.site = OpenErpSite(root, 1000)
+    self.server = reactor.listenTCP(0, self.site, interface="127.0.0.1")
+    self.client = None
+
+  def tearDown(self):
+    self.scheduler.stop()
+    if self.client is not None and self.client.transport.connected:
+      self.client.transport.loseConnection()
+    return self.server.stopListening()
+
+  def connect(self):
+    self.received = defer.Deferred()
+    creator = ClientCreator(reactor, PrinterClient, self.received)
+    d = creator.connectTCP("127.0.0.1", self.server.getHost().port)
+
+    def connected(client):
+      self.client = client
+      return client
+    return d.addCallback(connected)
+
+  def send(self, client, *lines):
+    client.transport.write("\r\n".join(lines + ("", "")))
+
+  def test_whenClientGoneThenBackendCallCancelled(self):
+    def request(client):
+      self.send(client, "GET /demo/res.partner HTTP/1.1", "Host: localhost",
+        "Authorization: Basic " + "admin:admin".encode("base64").strip())
+      return self.backend.searching
+
+    def disconnect(_):
+      self.assertEqual(self.site.activeRequests, 1)
+      self.client.transport.loseConnection()
+      return self.backend.cancelled
+
+    def cancelled(_):
+      return task.deferLater(reactor, 0, lambda: self.assertEqual(self.site.activeRequests, 0))
+    d = self.connect()
+    d.addCallback(request)
+    d.addCallback(disconnect)
+    d.addCallback(cancelled)
+    return d
+
+  def _checkRejected(self, body):
+    self.assertTrue(body.startswith("HTTP/1.1 413 "), body)
+    self.assertTrue(body.endswith("\r\n\r\nThe request body must not be larger than 1000 bytes"), body)
+    self.assertEqual(self.site.activeRequests, 0)
+
+  def test_whenContentLengthTooLargeThenRejected(self):
+    def request(client):
+      self.send(client, "POST /demo/res.partner HTTP/1.1", "Host: localhost",
+        "Content-Type: application/xml", "Content-Length: 1001")
+      return self.received
+    return self.connect().addCallback(request).addCallback(self._checkRejected)
+
+  def test_whenChunkedBodyTooLargeThenRejected(self):
+    def request(client):
+      self.send(client, "POST /demo/res.partner HTTP/1.1", "Host: localhost",
+        "Content-Type: application/xml", "Transfer-Encoding: chunked")
+      for i in range(2):
+        client.transport.write("%x\r\n%s\r\n" % (600, "x" * 600))
+      return self.received
+    return self.connect().addCallback(request).addCallback(self._checkRejected)
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import os, time, ConfigParser
+
+from twisted.trial import unittest
+
+from restfulOpenErpProxy import OpenErpDispatcher, MetadataSnapshot
+
+ARCH = '<form string="Partner"><button name="confirm" string="Confirm" states="draft"/></form>'
+
+class MetadataSnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self.config = ConfigParser.RawConfigParser()
+    self.config.add_section("Snapshot")
+    self.config.set("Snapshot", "file", os.path.abspath(self.mktemp()))
+    self.dispatchers = []
+
+  def tearDown(self):
+    for dispatcher in self.dispatchers:
+      dispatcher.metadataScheduler.stop()
+
+  def _makeSnapshot(self):
+    dispatcher = OpenErpDispatcher("http://localhost:8069", self.config)
+    self.dispatchers.append(dispatcher)
+    return MetadataSnapshot(dispatcher, self.config)
+
+  def _metadata(self, fetched):
+    return {"fetched": fetched,
+            "fields": {"name": {"type": "char", "string": u"N\xe4me"}},
+            "arch": ARCH,
+            "defaults": {"g1,2-c1": {"active": True}}}
+
+  def test_whenWrittenThenLoadedWithRevalidation(self):
+    snapshot = self._makeSnapshot()
+    snapshot.dispatcher.getDatabase("demo").getModel("res.partner").setMetadata(self._metadata(time.time()))
+    self.assertEqual(snapshot.write(snapshot.collect()), 1)
+    other = self._makeSnapshot()
+    self.assertEqual(other.load(), 1)
+    model = other.dispatcher.databases["demo"].models["res.partner"]
+    self.assertEqual(model.desc, {"name": {"type": "char", "string": u"N\xe4me"}})
+    self.assertEqual(model.defaults, {"g1,2-c1": {"active": True}})
+    self.assertEqual([b.attrib["name"] for b in model.workflowDesc], ["confirm"])
+    self.assertEqual(model.unvalidated, set(["fields", "arch", "defaults:g1,2-c1"]))
+
+  def test_whenTooOldThenNotLoaded(self):
+    snapshot = self._makeSnapshot()
+    snapshot.dispatcher.getDatabase("demo").getModel("res.partner").setMetadata(
+      self._metadata(time.time() - 2 * snapshot.maxAge))
+    snapshot.write(snapshot.collect())
+    other = self._makeSnapshot()
+    self.assertEqual(other.load(), 0)
+    self.assertEqual(other.dispatcher.databases, {})
+
+  def test_whenFileMissingThenNothingLoaded(self):
+    self.assertEqual(self._makeSnapshot().load(), 0)
+
+  def test_whenCollectedThenLaterChangesNotWritten(self):
+    snapshot = self._makeSnapshot()
+    model = snapshot.dispatcher.getDatabase("demo").getModel("res.partner")
+    model.setMetadata(self._metadata(time.time()))
+    models = snapshot.collect()
+    # requests go on while the snapshot is written in a thread
+    model.defaults["g3-c1"] = {"active": False}
+    model.defaults["g1,2-c1"]["active"] = False
+    self.assertEqual(models[0][2]["defaults"], {"g1,2-c1": {"active": True}})
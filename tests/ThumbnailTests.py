@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import os, stat, shutil, tempfile, ConfigParser
+from cStringIO import StringIO
+
+from twisted.trial import unittest
+
+from restfulOpenErpProxy import Image, ThumbnailCache, makeThumbnail
+
+def mkImage(format, size=(1200, 800)):
+  out = StringIO()
+  Image.new("RGB", size, (200, 30, 30)).save(out, format)
+  return out.getvalue()
+
+class ThumbnailTest(unittest.TestCase):
+
+  if Image is None:
+    skip = "PIL is not installed"
+
+  def setUp(self):
+    self.directory = os.path.abspath(self.mktemp())
+    self.config = ConfigParser.RawConfigParser()
+    self.config.add_section("Thumbnails")
+    self.config.set("Thumbnails", "directory", self.directory)
+    self.cache = ThumbnailCache(self.config)
+
+  def test_whenScaledThenWidthAndFormatKept(self):
+    for format in ("PNG", "JPEG"):
+      img = Image.open(StringIO(makeThumbnail(mkImage(format), 80)))
+      self.assertEqual((img.format, img.size), (format, (80, 53)))
+
+  def test_whenSmallerThanWidthThenNotEnlarged(self):
+    img = Image.open(StringIO(makeThumbnail(mkImage("GIF", (40, 20)), 80)))
+    self.assertEqual((img.format, img.size), ("PNG", (40, 20)))
+
+  def test_whenNotAnImageThenIOError(self):
+    self.assertRaises(IOError, makeThumbnail, "not an image", 80)
+
+  def test_whenMadeThenFoundAgain(self):
+    key = self.cache.getKey("demo", "product.product", 7, "image", "2013-01-01 20:41:36.123456", 80)
+    self.assertEqual(self.cache.get(key), None)
+    thumbnail = self.cache.make(key, mkImage("PNG"), 80)
+    self.assertEqual(self.cache.get(key), thumbnail)
+    # also for another process using the directory
+    other = ThumbnailCache(self.config)
+    self.assertEqual(other.get(key), thumbnail)
+    self.assertEqual(other.totalBytes, len(thumbnail))
+
+  def test_whenItemChangedThenOtherKey(self):
+    self.assertNotEqual(self.cache.getKey("demo", "product.product", 7, "image", "2013-01-01 20:41:36.123456", 80),
+      self.cache.getKey("demo", "product.product", 7, "image", "2013-01-02 08:00:00.000000", 80))
+
+  def test_whenFullThenLeastRecentlyUsedDeleted(self):
+    data = mkImage("PNG")
+    size = len(self.cache.make("a", data, 80))
+    self.cache.maxBytes = int(size * 2.5)
+    self.cache.make("b", data, 80)
+    self.cache.files["a"][0] += 10
+    self.cache.make("c", data, 80)
+    self.assertEqual(sorted(os.listdir(self.directory)), ["a", "c"])
+    self.assertEqual(self.cache.totalBytes, 2 * size)
+
+  def _assertNotKept(self):
+    cache = ThumbnailCache(self.config)
+    self.assertTrue(cache.make("a", mkImage("PNG"), 80))
+    self.assertEqual(cache.get("a"), None)
+    self.assertEqual(cache.directory, None)
+
+  def test_whenDirectoryCreatedThenPrivate(self):
+    self.cache.make("a", mkImage("PNG"), 80)
+    self.assertEqual(stat.S_IMODE(os.stat(self.directory).st_mode), 0700)
+
+  def test_whenNoDirectoryThenPrivateTemporaryOne(self):
+    cache = ThumbnailCache()
+    thumbnail = cache.make("a", mkImage("PNG"), 80)
+    self.addCleanup(shutil.rmtree, cache.directory, True)
+    self.assertEqual(os.path.dirname(cache.directory), tempfile.gettempdir())
+    self.assertEqual(stat.S_IMODE(os.stat(cache.directory).st_mode), 0700)
+    self.assertEqual(cache.get("a"), thumbnail)
+
+  def test_whenWritableByOthersThenNotKept(self):
+    os.makedirs(self.directory)
+    os.chmod(self.directory, 0777)
+    self._assertNotKept()
+    self.assertEqual(os.listdir(self.directory), [])
+
+  def test_whenSymlinkThenNotKept(self):
+    target = os.path.abspath(self.mktemp())
+    os.makedirs(target, 0700)
+    os.symlink(target, self.directory)
+    self._assertNotKept()
+    self.assertEqual(os.listdir(target), [])
+
+  def test_whenOwnedByOtherUserThenNotKept(self):
+    if os.getuid() != 0:
+      raise unittest.SkipTest("only root can give the directory away")
+    os.makedirs(self.directory, 0700)
+    os.chown(self.directory, 4242, -1)
+    self._assertNotKept()
+    self.assertEqual(os.listdir(self.directory), [])
+
+  def test_whenDirectoryBeingCheckedThenNotUsedYet(self):
+    # other threads only look at `files` to decide whether to use it
+    seen = []
+    check = ThumbnailCache._ThumbnailCache__checkDirectory
+
+    def spy(cache):
+      seen.append(cache.files)
+      check(cache)
+    self.patch(ThumbnailCache, "_ThumbnailCache__checkDirectory", spy)
+    os.makedirs(self.directory)
+    os.chmod(self.directory, 0777)
+    self.cache.make("a", mkImage("PNG"), 80)
+    self.assertEqual((seen, self.cache.files, self.cache.directory), ([None], {}, None))
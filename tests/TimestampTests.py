@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import datetime
+import dateutil.tz
+
+from twisted.trial import unittest
+
+from restfulOpenErpProxy import LocalTimeConverter
+
+class LocalTimeConverterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.converter = LocalTimeConverter(dateutil.tz.gettz("Europe/Berlin"))
+
+  def test_whenWinterOrSummerThenOffsetOfThatDay(self):
+    self.assertEqual(self.converter.toRfc3339List(["2013-01-01 20:41:36.123456", "2013-07-01 00:41:36.000001"]),
+      ["2013-01-01T19:41:36Z", "2013-06-30T22:41:36Z"])
+
+  def test_whenDatetimeThenUtcWithMicroseconds(self):
+    self.assertEqual(self.converter.toUtcDatetime("2013-01-01 20:41:36.123456"),
+      datetime.datetime(2013, 1, 1, 19, 41, 36, 123456, tzinfo=dateutil.tz.tzutc()))
+
+  def test_whenShortFractionThenParsed(self):
+    self.assertEqual(self.converter.toRfc3339("2013-01-01 20:41:36.12"), "2013-01-01T19:41:36Z")
+
+  def test_whenHalfHourOffsetThenSameAsDatetime(self):
+    converter = LocalTimeConverter(dateutil.tz.gettz("Asia/Kolkata"))
+    self.assertEqual(converter.toRfc3339("2013-01-01 00:10:00.000000"), "2012-12-31T18:40:00Z")
+
+  def test_whenFormattedByFeedThenUnchanged(self):
+    updated = self.converter.toRfc3339("2013-01-01 20:41:36.123456")
+    self.assertEqual(updated.strftime("%Y-%m-%dT%H:%M:%SZ"), "2013-01-01T19:41:36Z")
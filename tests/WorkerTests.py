@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License version 3 as published by
+# the Free Software Foundation.
+
+import os, sys, signal, subprocess
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from restfulOpenErpProxy import WorkerSupervisor, stopGracefully
+
+class FakeProcess(object):
+  """A worker that exits when it is told to, unless it is `stubborn`."""
+  pids = 100
+
+  def __init__(self, stubborn=False):
+    FakeProcess.pids += 1
+    self.pid = FakeProcess.pids
+    self.returncode = None
+    self.stubborn = stubborn
+    self.signals = []
+
+  def poll(self):
+    return self.returncode
+
+  def exit(self, code=0):
+    self.returncode = code
+
+  def terminate(self):
+    self.signals.append("TERM")
+    if not self.stubborn:
+      self.exit(-15)
+
+  def kill(self):
+    self.signals.append("KILL")
+    self.exit(-9)
+
+  def wait(self):
+    return self.returncode
+
+class FakeSupervisor(WorkerSupervisor):
+  def __init__(self, workers, clock):
+    WorkerSupervisor.__init__(self, 8068, workers, 30, clock)
+    self.processes = []
+    self.stubborn = False
+
+  def startProcess(self):
+    self.processes.append(FakeProcess(self.stubborn))
+    return self.processes[-1]
+
+class WorkerSupervisorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.supervisor = FakeSupervisor(2, self.clock)
+    self.supervisor.start()
+
+  def tearDown(self):
+    if self.supervisor.running:
+      self.supervisor.stop()
+      self.clock.advance(40)
+
+  def _advance(self, seconds):
+    for i in range(int(seconds * 10)):
+      self.clock.advance(0.1)
+
+  def test_whenStartedThenWorkersSpawned(self):
+    self.assertEqual(len(self.supervisor.processes), 2)
+
+  def test_whenCrashingRightAfterStartThenRestartedLaterAndLater(self):
+    first = self.supervisor.workers[0]['proc']
+    first.exit(1)
+    self._advance(0.5)
+    # first failure: restarted after 1 second
+    self.assertEqual(len(self.supervisor.processes), 2)
+    self._advance(1)
+    self.assertEqual(len(self.supervisor.processes), 3)
+    self.supervisor.processes[-1].exit(1)
+    self._advance(3)
+    self.assertEqual(len(self.supervisor.processes), 3)
+    self._advance(1)
+    self.assertEqual(len(self.supervisor.processes), 4)
+    self.assertEqual(self.supervisor.workers[0]['failures'], 2)
+
+  def test_whenCrashingAfterRunningForAWhileThenRestartedAtOnce(self):
+    self._advance(20)
+    self.supervisor.workers[1]['proc'].exit(1)
+    self._advance(0.5)
+    self.assertEqual(len(self.supervisor.processes), 3)
+    self.assertEqual(self.supervisor.workers[1]['failures'], 0)
+
+  def test_whenRestartRequestedThenReplacedOneAfterTheOther(self):
+    old = list(self.supervisor.processes)
+    self.supervisor.requestRestart()
+    self._advance(0.5)
+    self.assertEqual(len(self.supervisor.processes), 3)
+    self.assertEqual((old[0].signals, old[1].signals), ([], []))
+    self._advance(2)
+    self.assertEqual((old[0].signals, old[1].signals), (["TERM"], []))
+    self.assertEqual(len(self.supervisor.processes), 4)
+    self._advance(2.1)
+    self.assertEqual(old[1].signals, ["TERM"])
+    self.assertEqual([w['proc'] for w in self.supervisor.workers], self.supervisor.processes[2:])
+    self.assertEqual(self.supervisor.restarting, None)
+    # terminated workers are not restarted
+    self._advance(5)
+    self.assertEqual(len(self.supervisor.processes), 4)
+
+  def test_whenStoppedThenAllTerminated(self):
+    stopped = []
+    self.supervisor.stop().addCallback(stopped.append)
+    self.assertEqual(len(stopped), 1)
+    self.assertEqual([p.signals for p in self.supervisor.processes], [["TERM"], ["TERM"]])
+    self._advance(5)
+    self.assertEqual(len(self.supervisor.processes), 2)
+
+  def test_whenWorkerDoesNotStopThenKilledAfterTimeout(self):
+    stubborn = self.supervisor.workers[0]['proc']
+    stubborn.stubborn = True
+    stopped = []
+    self.supervisor.stop().addCallback(stopped.append)
+    self._advance(34.5)
+    self.assertEqual((stubborn.signals, stopped), (["TERM"], []))
+    self._advance(1)
+    self.assertEqual(stubborn.signals, ["TERM", "KILL"])
+    self.assertEqual(len(stopped), 1)
+
+class FakeSite(object):
+  activeRequests = 2
+
+class FakePort(object):
+  listening = True
+
+  def stopListening(self):
+    self.listening = False
+
+class StopGracefullyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.site = FakeSite()
+    self.port = FakePort()
+    self.stopped = []
+    stopGracefully(self.site, self.port, 30, self.clock).addCallback(self.stopped.append)
+
+  def test_whenRequestsFinishedThenStopped(self):
+    self.assertEqual((self.port.listening, self.stopped), (False, []))
+    self.clock.advance(5)
+    self.site.activeRequests = 0
+    self.clock.advance(0.1)
+    self.assertEqual(self.stopped, [None])
+
+  def test_whenRequestsTakeTooLongThenStoppedAnyway(self):
+    for i in range(299):
+      self.clock.advance(0.1)
+    self.assertEqual(self.stopped, [])
+    self.clock.advance(0.2)
+    self.assertEqual(self.stopped, [None])
+
+class WorkerSignalsTest(unittest.TestCase):
+
+  def test_whenInterruptedThenWorkerKeepsRunning(self):
+    # in a process of its own, so that the test runner is not affected
+    script = "\n".join([
+      "import os, signal, time",
+      "from restfulOpenErpProxy import ignoreInterrupts",
+      "ignoreInterrupts()",
+      "os.kill(os.getpid(), signal.SIGINT)",
+      "time.sleep(0.2)",
+      "print 'alive'"])
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    proc = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, env=env)
+    self.assertEqual((proc.communicate()[0].strip(), proc.returncode), ("alive", 0))
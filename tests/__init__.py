@@ -10,12 +10,11 @@
 import os, sys, xmlrpclib, ConfigParser
 
 from twisted.trial import unittest
-from twisted.web.server import Site
 from twisted.internet import reactor
 from twisted.internet.protocol import Protocol
 from twisted.web.client import Agent
 
-from restfulOpenErpProxy import OpenErpDispatcher
+from restfulOpenErpProxy import OpenErpDispatcher, OpenErpSite
 
 # NB. to be run with 'trial' from the twisted test suite
 
@@ -47,15 +46,13 @@ class OpenErpProxyTest(unittest.TestCase):
     self.db = config.get("Tests", "db")
     # start listening
     self.root = OpenErpDispatcher(openerpUrl)
-    self.factory = Site(self.root)
+    self.factory = OpenErpSite(self.root)
     self.server = reactor.listenTCP(8068, self.factory)
     self.client = None
     self.agent = Agent(reactor)
 
   def tearDown(self):
-    for dbname, dbres in self.root.databases.iteritems():
-      for modelname, modelres in dbres.models.iteritems():
-        modelres.cleanUpTask.stop()
+    self.root.metadataScheduler.stop()
     if self.client is not None:
       self.client.transport.loseConnection()
     return self.server.stopListening()